@@ -10,4 +10,123 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
 CHUNK_THRESHOLD = int(os.getenv("CHUNK_THRESHOLD", "1000"))
-OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
\ No newline at end of file
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+# Header que activa la captura de spans por request (se devuelven en Server-Timing)
+TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Trace-Spans")
+
+# Warm-up opcional al arrancar: proveedor e índices (separados por coma) a pre-resolver
+WARMUP_PROVIDER = os.getenv("WARMUP_PROVIDER", "pinecone")
+WARMUP_INDEXES = [name.strip() for name in os.getenv("WARMUP_INDEXES", "").split(",") if name.strip()]
+
+# Ventana y tamaño máximo del micro-batching de fetch por ID (0 desactiva la ventana)
+FETCH_BATCH_WINDOW_MS = float(os.getenv("FETCH_BATCH_WINDOW_MS", "2"))
+FETCH_BATCH_MAX_IDS = int(os.getenv("FETCH_BATCH_MAX_IDS", "1000"))
+
+# Micro-batching de embeddings de consultas concurrentes (0 desactiva la ventana)
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_BATCH_MAX_SIZE = min(int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "256")), 2048)
+
+# Límites globales por proceso para cada recurso compartido entre requests
+DOWNLOAD_MAX_WORKERS = int(os.getenv("DOWNLOAD_MAX_WORKERS", "8"))
+PARSING_MAX_WORKERS = int(os.getenv("PARSING_MAX_WORKERS", "4"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "8"))
+UPSERT_MAX_CONCURRENCY = int(os.getenv("UPSERT_MAX_CONCURRENCY", "20"))
+
+# Cupo de workers de embeddings reservado a búsquedas: las ingestas nunca lo ocupan
+EMBEDDING_INTERACTIVE_RESERVED = int(os.getenv("EMBEDDING_INTERACTIVE_RESERVED", "2"))
+
+# Control de admisión: requests en vuelo por clase (global y por namespace) y Retry-After al rechazar
+SEARCH_MAX_INFLIGHT = int(os.getenv("SEARCH_MAX_INFLIGHT", "256"))
+SEARCH_MAX_INFLIGHT_PER_NAMESPACE = int(os.getenv("SEARCH_MAX_INFLIGHT_PER_NAMESPACE", "64"))
+SEARCH_RETRY_AFTER_SECONDS = int(os.getenv("SEARCH_RETRY_AFTER_SECONDS", "1"))
+INGEST_MAX_INFLIGHT = int(os.getenv("INGEST_MAX_INFLIGHT", "8"))
+INGEST_MAX_INFLIGHT_PER_NAMESPACE = int(os.getenv("INGEST_MAX_INFLIGHT_PER_NAMESPACE", "2"))
+INGEST_RETRY_AFTER_SECONDS = int(os.getenv("INGEST_RETRY_AFTER_SECONDS", "30"))
+
+# Chunks canónicos recordados por namespace para la deduplicación (los más antiguos se descartan),
+# en un SQLite que comparten los workers y que sobrevive a reinicios
+DEDUP_MAX_ENTRIES_PER_NAMESPACE = int(os.getenv("DEDUP_MAX_ENTRIES_PER_NAMESPACE", "50000"))
+DEDUP_INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", "data/dedup.sqlite3")
+
+# Subida directa de archivos: límite del cuerpo, límite por archivo y memoria del spool de PDF/DOCX
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_SPOOL_MAX_MEMORY = int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY", str(5 * 1024 * 1024)))
+# Texto, HTML, PDF y DOCX se extraen completos en memoria antes de embeber: tienen un límite propio
+UPLOAD_MAX_TEXT_FILE_BYTES = int(os.getenv("UPLOAD_MAX_TEXT_FILE_BYTES", str(20 * 1024 * 1024)))
+# Hilos que consumen subidas; fuera del threadpool de requests para no quitarle hilos a las búsquedas
+UPLOAD_MAX_CONCURRENCY = int(os.getenv("UPLOAD_MAX_CONCURRENCY", str(INGEST_MAX_INFLIGHT)))
+
+# Búsqueda two-stage: almacén SQLite de vectores completos y sobre-muestreo de candidatos del índice compacto
+FULL_VECTOR_STORE_PATH = os.getenv("FULL_VECTOR_STORE_PATH", "data/full_vectors.sqlite3")
+TWO_STAGE_OVERSAMPLE = int(os.getenv("TWO_STAGE_OVERSAMPLE", "4"))
+
+# Búsqueda agrupada por documento: sobre-muestreo inicial, tope de matches por consulta y candidatos extra para MMR
+GROUP_OVERSAMPLE = int(os.getenv("GROUP_OVERSAMPLE", "4"))
+GROUP_MAX_FETCH = int(os.getenv("GROUP_MAX_FETCH", "1000"))
+GROUP_MMR_CANDIDATES = int(os.getenv("GROUP_MMR_CANDIDATES", "3"))
+
+# Deadline del request: header opcional (en ms) y deadline por defecto de las búsquedas
+DEADLINE_HEADER = os.getenv("DEADLINE_HEADER", "X-Request-Timeout-Ms")
+SEARCH_TIMEOUT_SECONDS = float(os.getenv("SEARCH_TIMEOUT_SECONDS", "10"))
+
+# Timeout de cada llamada al proveedor por operación (se recorta a lo que quede del deadline del request)
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "5"))
+FETCH_TIMEOUT_SECONDS = float(os.getenv("FETCH_TIMEOUT_SECONDS", "5"))
+UPSERT_TIMEOUT_SECONDS = float(os.getenv("UPSERT_TIMEOUT_SECONDS", "30"))
+EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_TIMEOUT_SECONDS", "30"))
+
+# Reintentos de errores transitorios con backoff exponencial acotado y jitter completo
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.2"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "20"))
+# Los 429 esperan más (y respetan los headers de reset); la ingesta bulk reintenta más veces los embeddings
+RATE_LIMIT_BASE_DELAY_SECONDS = float(os.getenv("RATE_LIMIT_BASE_DELAY_SECONDS", "2"))
+RATE_LIMIT_MAX_DELAY_SECONDS = float(os.getenv("RATE_LIMIT_MAX_DELAY_SECONDS", "60"))
+EMBEDDING_BULK_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_BULK_MAX_ATTEMPTS", "8"))
+
+# Hedging de lecturas: copia tras el p95 observado, con un mínimo de muestras y un cupo de carga extra
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "10"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.05"))
+HEDGE_LATENCY_WINDOW = int(os.getenv("HEDGE_LATENCY_WINDOW", "500"))
+PROVIDER_READ_MAX_CONCURRENCY = int(os.getenv("PROVIDER_READ_MAX_CONCURRENCY", "32"))
+
+# Circuit breaker por proveedor e índice, y caché de últimos resultados para responder con el circuito abierto
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+STALE_CACHE_MAX_ENTRIES = int(os.getenv("STALE_CACHE_MAX_ENTRIES", "1000"))
+STALE_CACHE_MAX_AGE_SECONDS = float(os.getenv("STALE_CACHE_MAX_AGE_SECONDS", "600"))
+
+# Réplica local de namespaces calientes: activación, búsquedas por ventana para replicar, presupuesto y vigencia
+LOCAL_REPLICA_ENABLED = os.getenv("LOCAL_REPLICA_ENABLED", "false").lower() in ("1", "true", "yes")
+LOCAL_REPLICA_HOT_QUERIES = int(os.getenv("LOCAL_REPLICA_HOT_QUERIES", "100"))
+LOCAL_REPLICA_HOT_WINDOW_SECONDS = float(os.getenv("LOCAL_REPLICA_HOT_WINDOW_SECONDS", "60"))
+LOCAL_REPLICA_MEMORY_MB = int(os.getenv("LOCAL_REPLICA_MEMORY_MB", "512"))
+LOCAL_REPLICA_MAX_AGE_SECONDS = float(os.getenv("LOCAL_REPLICA_MAX_AGE_SECONDS", "900"))
+LOCAL_REPLICA_BUILD_CONCURRENCY = int(os.getenv("LOCAL_REPLICA_BUILD_CONCURRENCY", "1"))
+
+# Profiling por muestreo: activación, header que perfila un request, token de admin (obligatorio) y frecuencias
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILE_SAMPLE_HZ = float(os.getenv("PROFILE_SAMPLE_HZ", "100"))
+PROFILE_CONTINUOUS_HZ = float(os.getenv("PROFILE_CONTINUOUS_HZ", "5"))
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "50"))
+
+# Snapshots de namespaces: directorio, vectores por página y páginas en vuelo al exportar/importar
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "data/snapshots")
+SNAPSHOT_PAGE_SIZE = int(os.getenv("SNAPSHOT_PAGE_SIZE", "1000"))
+SNAPSHOT_CONCURRENCY = int(os.getenv("SNAPSHOT_CONCURRENCY", "4"))
+
+# Modo multi-worker: procesos de uvicorn y estado compartido entre ellos (generaciones, segmentos de réplicas)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+SHARED_STATE_ENABLED = os.getenv("SHARED_STATE_ENABLED", str(WEB_CONCURRENCY > 1)).lower() in ("1", "true", "yes")
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", "data/shared")
+SHARED_GENERATION_SLOTS = int(os.getenv("SHARED_GENERATION_SLOTS", "65536"))
+# Cada cuánto vuelca cada worker sus métricas en SHARED_STATE_DIR para que /metrics las agregue
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+# Caché de embeddings compartida por los workers (por defecto, activa junto con el estado compartido)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", str(SHARED_STATE_ENABLED)).lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
@@ -0,0 +1,63 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from starlette.responses import Response
+
+from app.configurations.config import PROFILE_CONTINUOUS_HZ, PROFILING_ADMIN_TOKEN, PROFILING_ENABLED
+from app.middlewares.profiling_middleware import is_admin_token_valid
+from app.services.profiler_service import ProfilerService
+
+FOLDED_MEDIA_TYPE = "text/plain; charset=utf-8"
+
+
+def require_profiling_admin(x_admin_token: Optional[str] = Header(None)):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="El profiling está deshabilitado (PROFILING_ENABLED)")
+    if not PROFILING_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="No hay token de administración configurado (PROFILING_ADMIN_TOKEN)")
+    if not is_admin_token_valid(x_admin_token):
+        raise HTTPException(status_code=403, detail="Token de administración inválido")
+
+
+router = APIRouter(
+    prefix="/api/ms/vector-db/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_profiling_admin)]
+)
+
+
+@router.get("/profiles")
+async def list_profiles():
+    continuous = ProfilerService.continuous()
+    return {
+        "profiles": ProfilerService.summaries(),
+        "continuous": continuous.summary() if continuous is not None else None
+    }
+
+
+@router.post("/profiling/continuous")
+async def set_continuous_profiling(enabled: bool, sample_hz: float = PROFILE_CONTINUOUS_HZ):
+    if sample_hz <= 0 or sample_hz > 1000:
+        raise HTTPException(status_code=400, detail="sample_hz debe estar entre 0 y 1000")
+    session = ProfilerService.set_continuous(enabled, sample_hz)
+    return {"enabled": session is not None, "profile": session.summary() if session is not None else None}
+
+
+@router.get("/profiles/continuous")
+async def get_continuous_profile(reset: bool = False):
+    session = ProfilerService.continuous()
+    if session is None:
+        raise HTTPException(status_code=404, detail="El profiling continuo no está activo")
+    folded = session.folded()
+    if reset:
+        session.reset()
+    return Response(content=folded, media_type=FOLDED_MEDIA_TYPE)
+
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    session = ProfilerService.get(profile_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"No existe el perfil {profile_id}")
+    # Formato folded: compatible con flamegraph.pl, speedscope e inferno
+    return Response(content=session.folded(), media_type=FOLDED_MEDIA_TYPE)
@@ -1,16 +1,29 @@
-from fastapi import APIRouter, HTTPException, Depends
-from app.models.models import IndexConfig, UpsertRequest, QueryRequest
+import json
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Depends, Request
+from app.middlewares.profiling_middleware import ProfiledRoute
+from app.models.models import (
+    DataItem, IndexConfig, SnapshotRequest, StructuredIngestionConfig, UpsertRequest, QueryRequest
+)
+from app.services.resilience_service import CircuitOpenError, DeadlineExceededError
+from app.services.response_encoding_service import ResponseEncoder
+from app.services.scheduler_service import OverloadedError
+from app.services.upload_service import UploadService, UploadTooLargeError
 from app.services.vector_db_service_interface import VectorDBServiceInterface
 
 router = APIRouter(
     prefix="/api/ms/vector-db",
-    tags=["vector-db"]
+    tags=["vector-db"],
+    route_class=ProfiledRoute
 )
 
 
+# Los endpoints que llaman al proveedor son síncronos para que FastAPI los ejecute en su threadpool
+# y no bloqueen el event loop mientras esperan a OpenAI o Pinecone.
 @router.post("/create_index/{provider_name}")
-async def create_index(provider_name: str, config: IndexConfig,
-                       vector_db_service: VectorDBServiceInterface = Depends()):
+def create_index(provider_name: str, config: IndexConfig,
+                 vector_db_service: VectorDBServiceInterface = Depends()):
     try:
         vector_db_service.create_index(provider_name, config)
         return {"message": f"Índice {config.index_name} creado exitosamente en {provider_name}"}
@@ -19,28 +32,76 @@ async def create_index(provider_name: str, config: IndexConfig,
 
 
 @router.post("/upsert_data/{provider_name}/{index_name}")
-async def upsert_data(provider_name: str, index_name: str, upsert_request: UpsertRequest,
-                      vector_db_service: VectorDBServiceInterface = Depends()):
+def upsert_data(provider_name: str, index_name: str, upsert_request: UpsertRequest,
+                vector_db_service: VectorDBServiceInterface = Depends()):
     try:
-        vector_db_service.upsert_data(provider_name, index_name, upsert_request)
-        return {"message": f"Datos insertados exitosamente en el índice {index_name} de {provider_name}"}
+        report = vector_db_service.upsert_data(provider_name, index_name, upsert_request)
+        response = {"message": f"Datos insertados exitosamente en el índice {index_name} de {provider_name}"}
+        if report is not None:
+            response["deduplication"] = report
+        return response
+    except (OverloadedError, DeadlineExceededError, CircuitOpenError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail="Error al insertar datos: " + str(e))
 
 
+# La subida es asíncrona porque lee el cuerpo en streaming; la ingesta corre en el pool UPLOAD.
+@router.post("/upload/{provider_name}/{index_name}")
+async def upload_files(provider_name: str, index_name: str, request: Request, namespace: str, record_id: str,
+                       metadata: Optional[str] = None, ingestion: Optional[str] = None,
+                       vector_db_service: VectorDBServiceInterface = Depends()):
+    try:
+        record = DataItem(
+            id=record_id,
+            data={},
+            metadata=json.loads(metadata) if metadata else {},
+            ingestion=StructuredIngestionConfig(**json.loads(ingestion)) if ingestion else None
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Parámetros de subida inválidos: " + str(e))
+
+    try:
+        files = await UploadService(vector_db_service).upload_multipart(
+            request, provider_name, index_name, namespace, record
+        )
+        return {"message": f"{len(files)} archivo(s) insertados en el índice {index_name} de {provider_name}",
+                "files": files}
+    except (OverloadedError, DeadlineExceededError, CircuitOpenError):
+        raise
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Error al subir archivos: " + str(e))
+
+
 @router.post("/search/{provider_name}/{index_name}")
-async def search(provider_name: str, index_name: str, query_request: QueryRequest,
-                 vector_db_service: VectorDBServiceInterface = Depends()):
+def search(provider_name: str, index_name: str, query_request: QueryRequest, request: Request,
+           vector_db_service: VectorDBServiceInterface = Depends()):
     try:
         results = vector_db_service.search(provider_name, index_name, query_request)
-        return results
+        # JSON, NDJSON o MessagePack según Accept, sin pasar por el encoder de FastAPI
+        return ResponseEncoder.matches_response(results, request.headers.get("accept"))
+    except (OverloadedError, DeadlineExceededError, CircuitOpenError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail="Error en la búsqueda: " + str(e))
 
 
+@router.post("/compare_search/{provider_name}/{index_name}")
+def compare_search(provider_name: str, index_name: str, query_request: QueryRequest,
+                   vector_db_service: VectorDBServiceInterface = Depends()):
+    try:
+        return vector_db_service.compare_search(provider_name, index_name, query_request)
+    except (OverloadedError, DeadlineExceededError, CircuitOpenError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Error en la comparación: " + str(e))
+
+
 @router.post("/ensure_namespace/{provider_name}/{index_name}/{namespace}")
-async def ensure_namespace(provider_name: str, index_name: str, namespace: str,
-                          vector_db_service: VectorDBServiceInterface = Depends()):
+def ensure_namespace(provider_name: str, index_name: str, namespace: str,
+                     vector_db_service: VectorDBServiceInterface = Depends()):
     try:
         result = vector_db_service.ensure_namespace_exists(provider_name, index_name, namespace)
         return result
@@ -48,6 +109,30 @@ async def ensure_namespace(provider_name: str, index_name: str, namespace: str,
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/export_namespace/{provider_name}/{index_name}/{namespace}")
+def export_namespace(provider_name: str, index_name: str, namespace: str, snapshot_request: SnapshotRequest,
+                     vector_db_service: VectorDBServiceInterface = Depends()):
+    try:
+        return vector_db_service.export_namespace(provider_name, index_name, namespace, snapshot_request)
+    except (OverloadedError, DeadlineExceededError, CircuitOpenError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Error al exportar el namespace: " + str(e))
+
+
+@router.post("/import_namespace/{provider_name}/{index_name}/{namespace}")
+def import_namespace(provider_name: str, index_name: str, namespace: str, snapshot_request: SnapshotRequest,
+                     vector_db_service: VectorDBServiceInterface = Depends()):
+    try:
+        return vector_db_service.import_namespace(provider_name, index_name, namespace, snapshot_request)
+    except (OverloadedError, DeadlineExceededError, CircuitOpenError):
+        raise
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"No existe el snapshot {snapshot_request.snapshot}")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Error al importar el namespace: " + str(e))
+
+
 @router.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from starlette.responses import Response
+
+from app.services.metrics_service import CONTENT_TYPE_LATEST, metrics
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,38 @@
+from fastapi import FastAPI
+
+from app.configurations.config import DEADLINE_HEADER
+from app.services.resilience_service import deadline_scope
+
+
+class DeadlineMiddleware:
+    """Middleware ASGI que fija el deadline del request a partir del header DEADLINE_HEADER (en ms).
+
+    El deadline viaja en un contextvar, así que llega a los pools compartidos y recorta el timeout
+    de cada llamada al proveedor; sin header solo aplican los timeouts por operación.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.deadline_header = DEADLINE_HEADER.lower().encode()
+
+    def _timeout_seconds(self, scope):
+        for name, value in scope.get("headers", []):
+            if name == self.deadline_header:
+                try:
+                    milliseconds = float(value)
+                except ValueError:
+                    return None
+                return milliseconds / 1000 if milliseconds > 0 else None
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with deadline_scope(self._timeout_seconds(scope)):
+            await self.app(scope, receive, send)
+
+
+def setup_deadline_middleware(app: FastAPI):
+    app.add_middleware(DeadlineMiddleware)
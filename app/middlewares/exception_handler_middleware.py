@@ -1,6 +1,9 @@
 from fastapi import FastAPI
 from starlette.responses import JSONResponse
 
+from app.services.resilience_service import CircuitOpenError, DeadlineExceededError
+from app.services.scheduler_service import OverloadedError
+
 
 async def not_implemented_error_handler(request, exc: NotImplementedError):
     error_message = exc.args[0] if exc.args else "El proveedor no está implementado."
@@ -11,5 +14,31 @@ async def not_implemented_error_handler(request, exc: NotImplementedError):
         )
 
 
+async def overloaded_error_handler(request, exc: OverloadedError):
+    return JSONResponse(
+            status_code=429,
+            content={"message": str(exc)},
+            headers={"Retry-After": str(exc.retry_after)}
+        )
+
+
+async def deadline_exceeded_error_handler(request, exc: DeadlineExceededError):
+    return JSONResponse(
+            status_code=504,
+            content={"message": str(exc)}
+        )
+
+
+async def circuit_open_error_handler(request, exc: CircuitOpenError):
+    return JSONResponse(
+            status_code=503,
+            content={"message": str(exc)},
+            headers={"Retry-After": str(exc.retry_after)}
+        )
+
+
 def setup_exception_handlers(app: FastAPI):
     app.add_exception_handler(NotImplementedError, not_implemented_error_handler)
+    app.add_exception_handler(OverloadedError, overloaded_error_handler)
+    app.add_exception_handler(DeadlineExceededError, deadline_exceeded_error_handler)
+    app.add_exception_handler(CircuitOpenError, circuit_open_error_handler)
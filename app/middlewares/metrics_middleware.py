@@ -0,0 +1,76 @@
+import time
+
+from fastapi import FastAPI
+from starlette.routing import Match
+
+from app.configurations.config import TRACE_HEADER
+from app.services.metrics_service import FIRST_REQUEST_SECONDS, HTTP_REQUEST_SECONDS, current_spans, start_trace, stop_trace
+
+
+def _aggregate_spans(spans):
+    # Un upsert puede generar cientos de spans; se agrupan por nombre para el header
+    aggregated = {}
+    for name, seconds in spans:
+        total, count = aggregated.get(name, (0.0, 0))
+        aggregated[name] = (total + seconds, count + 1)
+    return aggregated
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que mide cada request y, si se pide, devuelve los spans en Server-Timing."""
+
+    def __init__(self, app, router_app: FastAPI):
+        self.app = app
+        self.router_app = router_app
+        self.trace_header = TRACE_HEADER.lower().encode()
+        # Las sondas de /health llegan antes que el tráfico real; medimos el primer request de cada ruta
+        self.first_request_routes = set()
+
+    def _route_template(self, scope) -> str:
+        # Usamos la plantilla de la ruta para no disparar la cardinalidad con path params
+        for route in self.router_app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_requested = any(name == self.trace_header for name, _ in scope.get("headers", []))
+        token = start_trace() if trace_requested else None
+        status = {"code": 500}
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if token is not None:
+                    spans = _aggregate_spans(current_spans())
+                    if spans:
+                        server_timing = ", ".join(
+                            f'{name};dur={seconds * 1000:.2f};desc="x{count}"'
+                            for name, (seconds, count) in spans.items()
+                        )
+                        message["headers"] = list(message.get("headers", [])) + [
+                            (b"server-timing", server_timing.encode())
+                        ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = self._route_template(scope)
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status["code"])
+            if route not in self.first_request_routes:
+                self.first_request_routes.add(route)
+                FIRST_REQUEST_SECONDS.set(elapsed, route=route)
+            if token is not None:
+                stop_trace(token)
+
+
+def setup_metrics_middleware(app: FastAPI):
+    app.add_middleware(MetricsMiddleware, router_app=app)
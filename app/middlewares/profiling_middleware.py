@@ -0,0 +1,74 @@
+import hmac
+import inspect
+import logging
+
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+
+from app.configurations.config import PROFILE_HEADER, PROFILING_ADMIN_TOKEN, PROFILING_ENABLED
+from app.services.profiler_service import ProfilerService
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+def is_admin_token_valid(token: str) -> bool:
+    # Sin token configurado no se concede acceso: perfilar expone código y datos del proceso
+    return bool(PROFILING_ADMIN_TOKEN) and hmac.compare_digest(token or "", PROFILING_ADMIN_TOKEN)
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI que perfila el request si trae PROFILE_HEADER y devuelve el id en X-Profile-Id.
+
+    El perfil queda disponible en /admin/profiles/{id}. Sin el header no se toca nada más que la
+    lectura de headers. Los endpoints síncronos del router con `ProfiledRoute` asocian además su hilo
+    del threadpool a la sesión mientras se ejecutan.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.profile_header = PROFILE_HEADER.lower().encode()
+        self.admin_token_header = ADMIN_TOKEN_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        if self.profile_header not in headers or not is_admin_token_valid(
+            headers.get(self.admin_token_header, b"").decode("latin-1")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        session, token = ProfilerService.start(f"{scope['method']} {scope['path']}")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", session.id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            ProfilerService.finish(session, token)
+
+
+class ProfiledRoute(APIRoute):
+    """Ruta cuyo endpoint síncrono se muestrea completo, incluido el código fuera de las etapas."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = ProfilerService.bound_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def setup_profiling_middleware(app: FastAPI):
+    if PROFILING_ENABLED:
+        if not PROFILING_ADMIN_TOKEN:
+            logger.warning(
+                "PROFILING_ENABLED is set but PROFILING_ADMIN_TOKEN is empty; profiling and admin endpoints are refused"
+            )
+        app.add_middleware(ProfilingMiddleware)
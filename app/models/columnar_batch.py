@@ -0,0 +1,26 @@
+from typing import Any, Dict, List
+
+
+class ColumnarBatch:
+    """Lote de filas en formato columnar: los textos a embeber y una lista de valores por columna.
+
+    Evita crear un dict por fila durante la lectura; el dict de metadata de cada fila solo se
+    construye al armar el vector para el upsert.
+    """
+
+    __slots__ = ("texts", "columns", "row_offset")
+
+    def __init__(self, texts: List[str], columns: Dict[str, List[Any]], row_offset: int):
+        self.texts = texts
+        self.columns = columns
+        self.row_offset = row_offset
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def row_metadata(self, row: int) -> Dict[str, Any]:
+        return {
+            name: values[row]
+            for name, values in self.columns.items()
+            if values[row] is not None
+        }
@@ -0,0 +1,32 @@
+from typing import Optional
+
+EUCLIDEAN = "euclidean"
+
+
+def ranking_score(score: float, metric: str) -> float:
+    """Score orientado para ordenar, donde mayor siempre es mejor: en euclidean el score es una distancia."""
+    return -score if metric == EUCLIDEAN else score
+
+
+class IndexProfile:
+    """Dimensiones de un índice: la que guarda el proveedor y, en modo two-stage, la completa.
+
+    En modo two-stage los embeddings se piden con `full_dimension`, el índice recibe la versión
+    recortada y los vectores completos quedan en el almacén local para re-puntuar candidatos.
+    """
+
+    __slots__ = ("name", "dimension", "full_dimension", "metric")
+
+    def __init__(self, name: str, dimension: int, full_dimension: Optional[int] = None, metric: str = "cosine"):
+        self.name = name
+        self.dimension = dimension
+        self.full_dimension = full_dimension
+        self.metric = metric
+
+    @property
+    def two_stage(self) -> bool:
+        return bool(self.full_dimension) and self.full_dimension > self.dimension
+
+    @property
+    def embedding_dimension(self) -> int:
+        return self.full_dimension if self.two_stage else self.dimension
@@ -1,25 +1,46 @@
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, confloat
 
 
 class IndexConfig(BaseModel):
     index_name: str
     dimension: int
     metric: str
+    # Si es mayor que `dimension`, el índice es two-stage: guarda vectores recortados y re-puntúa con los completos
+    full_dimension: Optional[int] = None
     cloud: str = "aws"
     region: str = "us-east-1"
 
 
+class StructuredIngestionConfig(BaseModel):
+    """Configuración por subida para CSV/JSONL: qué columnas se embeben y cuáles van a metadata."""
+    delimiter: str = ";"
+    embedding_columns: Optional[List[str]] = None
+    embedding_template: Optional[str] = None
+    metadata_columns: Optional[List[str]] = None
+    batch_rows: int = 500
+
+
+class DeduplicationConfig(BaseModel):
+    """Deduplicación de chunks antes de embeber: `reuse` copia el embedding del canónico y
+    `reference` no lo sube al índice: guarda una referencia al canónico (metadata y
+    `duplicate_of`) que se resuelve con el vector del canónico en el fetch por ID."""
+    threshold: confloat(ge=0, le=1) = 0.9
+    mode: Literal["reuse", "reference"] = "reuse"
+
+
 class DataItem(BaseModel):
     id: str
     data: dict
     metadata: dict = {}
     file_urls: Optional[List[str]] = []
+    ingestion: Optional[StructuredIngestionConfig] = None
 
 
 class UpsertRequest(BaseModel):
     namespace: str
     records: List[DataItem]
+    deduplication: Optional[DeduplicationConfig] = None
 
 
 class QueryRequest(BaseModel):
@@ -28,3 +49,14 @@ class QueryRequest(BaseModel):
     top_k: int = 3
     namespace: str
     metadata_filter: dict = {}
+    # Búsqueda agrupada por documento: top_k cuenta documentos distintos, cada uno con sus mejores chunks
+    group_by_document: bool = False
+    chunks_per_document: int = 3
+    # Diversificación MMR de los documentos: 1 = solo relevancia, 0 = solo diversidad
+    mmr_lambda: Optional[float] = None
+
+
+class SnapshotRequest(BaseModel):
+    """Snapshot de un namespace en SNAPSHOT_DIR; `resume` retoma una importación desde su checkpoint."""
+    snapshot: str
+    resume: bool = True
@@ -0,0 +1,16 @@
+from typing import BinaryIO
+
+
+class UploadedFile:
+    """Archivo recibido por el endpoint de subida, listo para extraer.
+
+    `stream` puede ser el propio cuerpo del request en streaming (formatos de texto) o un spool
+    acotado ya completo (PDF/DOCX); quien lo consume lo lee una sola vez y luego lo cierra.
+    """
+
+    __slots__ = ("file_name", "file_extension", "stream")
+
+    def __init__(self, file_name: str, file_extension: str, stream: BinaryIO):
+        self.file_name = file_name
+        self.file_extension = file_extension
+        self.stream = stream
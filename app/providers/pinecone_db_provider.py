@@ -1,25 +1,99 @@
 import time
 import asyncio
+import functools
 import inspect
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, as_completed
+from typing import Any, BinaryIO, Dict, List, Optional
 
-from pinecone import Pinecone, ServerlessSpec
-from app.configurations.config import PINECONE_API_KEY, CHUNK_THRESHOLD
+from app.configurations.config import (
+    PINECONE_API_KEY, CHUNK_THRESHOLD, FETCH_TIMEOUT_SECONDS, GROUP_MAX_FETCH, GROUP_MMR_CANDIDATES,
+    GROUP_OVERSAMPLE, QUERY_TIMEOUT_SECONDS, SNAPSHOT_CONCURRENCY, SNAPSHOT_PAGE_SIZE, TWO_STAGE_OVERSAMPLE,
+    UPSERT_TIMEOUT_SECONDS
+)
+from app.models.index_profile import EUCLIDEAN, IndexProfile, ranking_score
 from app.models.models import IndexConfig, QueryRequest, UpsertRequest, DataItem
 from app.providers.vector_db_provider import VectorDBProvider
+from app.services.deduplication_service import DeduplicationService, DeduplicationSession
+from app.services.document_grouping_service import collapse, group_matches, next_fetch_size
 from app.services.text_splitter_service import TextSplitterService
 from app.services.embedding_service import EmbeddingService
+from app.services.executor_service import ExecutorService
 from app.services.file_processor_service import FileProcessorService
+from app.services.full_vector_store import FullVectorStore
+from app.services.local_replica_service import LocalReplicaService
+from app.services.metrics_service import (
+    SEARCH_GROUP_DOCUMENTS, SEARCH_GROUP_ROUNDS, SEARCH_SECONDS, SNAPSHOT_PAGE_SECONDS, SNAPSHOT_VECTORS,
+    UPSERT_BATCH_FAILURES, UPSERT_BATCH_SECONDS, UPSERT_BATCH_SIZE
+)
+from app.services.profiler_service import ProfilerService
+from app.services.resilience_service import ResilienceService
+from app.services.snapshot_service import ImportCheckpoint, SnapshotReader, SnapshotWriter, snapshot_path
+
+logger = logging.getLogger(__name__)
 
 
 class PineconeDBProvider(VectorDBProvider):
     def __init__(self):
-        self.pc = Pinecone(api_key=PINECONE_API_KEY)
+        self._pc = None
+        self._indexes = {}
+        self._profiles = {}
+        self._lock = threading.Lock()
         self.text_splitter = TextSplitterService()
         self.embedding_service = EmbeddingService()
         self.file_processor = FileProcessorService()
+        self.full_vectors = FullVectorStore()
+        self.replicas = LocalReplicaService(self._snapshot_namespace, self._namespace_vector_count)
+
+    @property
+    def pc(self):
+        # El cliente de Pinecone se crea en el primer uso; importar el SDK es costoso
+        if self._pc is None:
+            with self._lock:
+                if self._pc is None:
+                    from pinecone import Pinecone
+                    self._pc = Pinecone(api_key=PINECONE_API_KEY)
+        return self._pc
+
+    def _get_index(self, index_name: str):
+        """Devuelve el handle cacheado del índice para reutilizar su pool de conexiones."""
+        index = self._indexes.get(index_name)
+        if index is None:
+            pc = self.pc
+            with self._lock:
+                index = self._indexes.get(index_name)
+                if index is None:
+                    index = pc.Index(index_name)
+                    self._indexes[index_name] = index
+        return index
+
+    def _get_profile(self, index_name: str) -> IndexProfile:
+        """Dimensión real del índice (cacheada) y, si es two-stage, la dimensión completa registrada."""
+        profile = self._profiles.get(index_name)
+        if profile is None:
+            description = self.pc.describe_index(index_name)
+            profile = IndexProfile(
+                index_name, description.dimension, self.full_vectors.get_full_dimension(index_name),
+                description.metric
+            )
+            self._profiles[index_name] = profile
+        return profile
+
+    def _embedder(self, profile: IndexProfile):
+        return functools.partial(self.embedding_service.create_embeddings, dimensions=profile.embedding_dimension)
+
+    def warm_up(self, index_names: List[str]):
+        for index_name in index_names:
+            # describe_index_stats abre la conexión y valida que el índice exista
+            self._describe_index_stats(index_name)
+            self._get_profile(index_name)
+        self.embedding_service.client
 
     def create_index(self, config: IndexConfig):
+        from pinecone import ServerlessSpec
+
         self.pc.create_index(
             name=config.index_name,
             dimension=config.dimension,
@@ -33,21 +107,45 @@ class PineconeDBProvider(VectorDBProvider):
         while not self.pc.describe_index(config.index_name).status['ready']:
             time.sleep(1)
 
-    def upsert_data(self, index_name: str, upsert_request: UpsertRequest):
-        index = self.pc.Index(index_name)
+        if config.full_dimension and config.full_dimension > config.dimension:
+            self.full_vectors.register_index(config.index_name, config.full_dimension)
+        self._profiles.pop(config.index_name, None)
+        self.replicas.drop_index(config.index_name)
+
+    def upsert_data(self, index_name: str, upsert_request: UpsertRequest) -> Optional[Dict[str, Any]]:
+        index = self._get_index(index_name)
+        profile = self._get_profile(index_name)
+        namespace = upsert_request.namespace
+        
+        # Los documentos que se reemplazan dejan de servir como canónicos antes de deduplicar
+        DeduplicationService.forget(index_name, namespace, [record.id for record in upsert_request.records])
+        session = None
+        if upsert_request.deduplication is not None:
+            session = DeduplicationService.session(
+                index_name, namespace, upsert_request.deduplication,
+                lambda ids: self._fetch_vector_values(index_name, ids, namespace),
+                lambda references: self.full_vectors.put_references(index_name, namespace, references)
+            )
         
         all_records = []
+        structured_records = []
         
         for record in upsert_request.records:
             all_records.append(record)
             
             if record.file_urls:
-                file_records = self.file_processor.process_file_urls_to_records(
-                    record.file_urls, 
-                    record.id, 
-                    record.metadata
-                )
-                all_records.extend(file_records)
+                with ProfilerService.stage("file_download"):
+                    file_records = self.file_processor.process_file_urls_to_records(
+                        record.file_urls, 
+                        record.id, 
+                        record.metadata,
+                        record.ingestion
+                    )
+                for file_record in file_records:
+                    if "rows" in file_record["data"]:
+                        structured_records.append(file_record)
+                    else:
+                        all_records.append(file_record)
         
         modified_request = UpsertRequest(
             namespace=upsert_request.namespace,
@@ -55,82 +153,264 @@ class PineconeDBProvider(VectorDBProvider):
         )
         
         if len(all_records) > 100:
-            return self._upsert_data_batched(index, modified_request)
+            self._upsert_data_batched(index, modified_request, profile, session)
+        else:
+            self._upsert_data_optimized(index, modified_request, profile, session)
         
-        return self._upsert_data_optimized(index, modified_request)
-
-    def _process_and_upsert_batch(self, index, records, namespace):
-        """Procesa un solo lote de registros y los carga a Pinecone."""
-        chunks = self._process_records_to_chunks(records)
-        if not chunks:
-            return
+        # Los CSV/JSONL se suben después del borrado previo, lote a lote y sin materializar el archivo
+        for structured_record in structured_records:
+            self._upsert_structured_record(index, structured_record, namespace, profile, session)
+        
+        if session is None:
+            return None
+        deferred = session.resolve_deferred(self._embedder(profile))
+        for future in self._submit_upserts(index, deferred, namespace, profile):
+            future.result()
+        return session.report()
 
-        embeddings = self._create_embeddings_for_chunks(chunks)
-        vectors = self._build_vectors_from_chunks_and_embeddings(chunks, embeddings)
+    def ingest_file(self, index_name: str, namespace: str, record: DataItem, file_name: str,
+                    file_extension: str, stream: BinaryIO) -> Dict[str, Any]:
+        """Extrae, embebe y sube un archivo recibido por el endpoint de subida, sin borrar lo anterior."""
+        index = self._get_index(index_name)
+        profile = self._get_profile(index_name)
+        with ProfilerService.stage("file_extract"):
+            file_record = self.file_processor.process_stream_to_record(
+                stream, file_name, file_extension, record.id, record.metadata, record.ingestion
+            )
         
-        # Hacemos el upsert en lotes paralelos para máxima velocidad
-        upsert_batch_size = 100
-        with ThreadPoolExecutor(max_workers=20) as upsert_executor:
-            futures = []
-            for i in range(0, len(vectors), upsert_batch_size):
-                batch_vectors = vectors[i:i + upsert_batch_size]
-                future = upsert_executor.submit(index.upsert, vectors=batch_vectors, namespace=namespace)
-                futures.append(future)
-            
-            # Esperar a que todos los lotes de upsert terminen
-            for future in as_completed(futures):
+        if "rows" in file_record["data"]:
+            self._upsert_structured_record(index, file_record, namespace, profile)
+        else:
+            vectors = self._prepare_vectors([DataItem(**file_record)], profile)
+            for future in self._submit_upserts(index, vectors, namespace, profile):
                 future.result()
-    
-    def _upsert_data_optimized(self, index, upsert_request: UpsertRequest):
-        def _prepare_vectors():
-            chunks = self._process_records_to_chunks(upsert_request.records)
-            if not chunks:
-                return None
-            embeddings = self._create_embeddings_for_chunks(chunks)
-            return self._build_vectors_from_chunks_and_embeddings(chunks, embeddings)
-
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            delete_future = executor.submit(self._delete_existing_document_chunks, index, upsert_request)
-            vectors_future = executor.submit(_prepare_vectors)
-            
-            delete_future.result()
-            vectors = vectors_future.result()
-            
-            if vectors:
-                batch_size = 100
-                with ThreadPoolExecutor(max_workers=20) as upsert_executor:
-                    futures = []
-                    for i in range(0, len(vectors), batch_size):
-                        batch_vectors = vectors[i:i + batch_size]
-                        future = upsert_executor.submit(index.upsert, vectors=batch_vectors, namespace=upsert_request.namespace)
-                        futures.append(future)
-                    
-                    for future in as_completed(futures):
+        
+        return {"id": file_record["id"], "file_name": file_name, "file_type": file_extension}
+
+    def delete_records(self, index_name: str, namespace: str, record_ids: List[str]):
+        DeduplicationService.forget(index_name, namespace, record_ids)
+        self._delete_by_original_ids(self._get_index(index_name), namespace, record_ids, self._get_profile(index_name))
+
+    def export_namespace(self, index_name: str, namespace: str, snapshot_name: str) -> Dict[str, Any]:
+        """Vuelca el namespace a un snapshot columnar, página a página y sin re-embeber nada.
+
+        En índices two-stage se exportan los vectores completos del almacén local, de modo que el
+        snapshot se puede importar en un índice de cualquier dimensión menor o igual.
+        """
+        index = self._get_index(index_name)
+        profile = self._get_profile(index_name)
+        writer = SnapshotWriter(
+            snapshot_path(snapshot_name), profile.embedding_dimension,
+            {"index": index_name, "namespace": namespace, "metric": profile.metric}
+        )
+        # Se leen hasta SNAPSHOT_CONCURRENCY páginas en paralelo y se escriben en orden: memoria acotada
+        in_flight = deque()
+        try:
+            for page_ids in self._paged_ids(index, namespace):
+                in_flight.append(ExecutorService.submit(
+                    ExecutorService.SNAPSHOT, self._export_page, index, profile, namespace, page_ids
+                ))
+                while len(in_flight) >= SNAPSHOT_CONCURRENCY:
+                    writer.write_page(*in_flight.popleft().result())
+            while in_flight:
+                writer.write_page(*in_flight.popleft().result())
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            writer.abort()
+            raise
+        return {"snapshot": snapshot_name, **writer.close()}
+
+    def import_namespace(self, index_name: str, namespace: str, snapshot_name: str,
+                         resume: bool = True) -> Dict[str, Any]:
+        """Sube un snapshot al namespace en paralelo, registrando cada página terminada para poder reanudar."""
+        index = self._get_index(index_name)
+        profile = self._get_profile(index_name)
+        path = snapshot_path(snapshot_name)
+        reader = SnapshotReader(path)
+        try:
+            if reader.dimension < profile.embedding_dimension:
+                raise ValueError(
+                    f"El snapshot tiene dimensión {reader.dimension} y el índice {index_name} "
+                    f"necesita {profile.embedding_dimension}"
+                )
+            if reader.header.get("metric") != profile.metric:
+                logger.warning(
+                    "Importing snapshot %s (%s) into %s (%s)",
+                    snapshot_name, reader.header.get("metric"), index_name, profile.metric
+                )
+            checkpoint = ImportCheckpoint(path, index_name, namespace, reader.fingerprint)
+            if not resume:
+                checkpoint.clear()
+            pending = [number for number in range(len(reader.pages)) if number not in checkpoint.done]
+
+            in_flight = deque()
+            imported = 0
+            try:
+                for number in pending:
+                    in_flight.append((number, ExecutorService.submit(
+                        ExecutorService.SNAPSHOT, self._import_page, index, reader, number, namespace, profile
+                    )))
+                    while len(in_flight) >= SNAPSHOT_CONCURRENCY:
+                        number, future = in_flight.popleft()
+                        imported += future.result()
+                        checkpoint.mark(number)
+                while in_flight:
+                    number, future = in_flight.popleft()
+                    imported += future.result()
+                    checkpoint.mark(number)
+            except BaseException:
+                # Las páginas que ya estaban en vuelo se terminan y quedan registradas para el reintento
+                for number, future in in_flight:
+                    try:
                         future.result()
+                    except Exception:
+                        continue
+                    checkpoint.mark(number)
+                raise
+            checkpoint.clear()
+        finally:
+            reader.close()
+
+        return {
+            "snapshot": snapshot_name,
+            "pages": len(reader.pages),
+            "skipped_pages": len(reader.pages) - len(pending),
+            "vectors": imported
+        }
+
+    def _prepare_vectors(self, records, profile: IndexProfile, session: Optional[DeduplicationSession] = None):
+        """Convierte un lote de registros en vectores listos para subir (chunks + embeddings)."""
+        with ProfilerService.stage("chunking"):
+            chunks = self._process_records_to_chunks(records)
+        if not chunks:
+            return []
+        if session is not None:
+            # Solo se embeben los chunks canónicos; los duplicados reutilizan su vector o se omiten
+            vectors = [
+                {"id": chunk["id"], "metadata": {**chunk["metadata"], "text": chunk["text"]}}
+                for chunk in chunks
+            ]
+            return session.embed(vectors, self._embedder(profile))
+        embeddings = self._create_embeddings_for_chunks(chunks, profile)
+        return self._build_vectors_from_chunks_and_embeddings(chunks, embeddings)
+    
+    def _submit_upserts(self, index, vectors, namespace, profile: IndexProfile) -> List[Future]:
+        # Los lotes van al pool compartido de upserts, que limita la concurrencia contra Pinecone
+        upsert_batch_size = 100
+        return [
+            ExecutorService.submit(
+                ExecutorService.UPSERT, self._upsert_vectors_batch,
+                index, vectors[i:i + upsert_batch_size], namespace, profile
+            )
+            for i in range(0, len(vectors), upsert_batch_size)
+        ]
+    
+    def _upsert_data_optimized(self, index, upsert_request: UpsertRequest, profile: IndexProfile,
+                               session: Optional[DeduplicationSession] = None):
+        delete_future = ExecutorService.submit(
+            ExecutorService.UPSERT, self._delete_existing_document_chunks, index, upsert_request, profile
+        )
+        vectors_future = ExecutorService.submit(
+            ExecutorService.PARSING, self._prepare_vectors, upsert_request.records, profile, session
+        )
+        
+        delete_future.result()
+        vectors = vectors_future.result()
+        
+        for future in self._submit_upserts(index, vectors, upsert_request.namespace, profile):
+            future.result()
     
-    def _upsert_data_batched(self, index, upsert_request: UpsertRequest):
-        self._delete_existing_document_chunks(index, upsert_request)
+    def _upsert_data_batched(self, index, upsert_request: UpsertRequest, profile: IndexProfile,
+                             session: Optional[DeduplicationSession] = None):
+        self._delete_existing_document_chunks(index, upsert_request, profile)
 
         batch_size = 50 
         records = upsert_request.records
         
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = []
-            for i in range(0, len(records), batch_size):
-                batch_records = records[i:i + batch_size]
-                future = executor.submit(
-                    self._process_and_upsert_batch, 
-                    index, 
-                    batch_records, 
-                    upsert_request.namespace
-                )
-                futures.append(future)
+        prepare_futures = [
+            ExecutorService.submit(
+                ExecutorService.PARSING, self._prepare_vectors, records[i:i + batch_size], profile, session
+            )
+            for i in range(0, len(records), batch_size)
+        ]
+        
+        # Cada lote empieza a subirse en cuanto tiene sus embeddings
+        upsert_futures = []
+        for future in as_completed(prepare_futures):
+            try:
+                vectors = future.result()
+            except Exception as e:
+                logger.warning("Error en un lote de upsert: %s", e)
+                continue
+            upsert_futures.extend(self._submit_upserts(index, vectors, upsert_request.namespace, profile))
+        
+        for future in upsert_futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning("Error en un lote de upsert: %s", e)
+    
+    def _upsert_structured_record(self, index, record: Dict[str, Any], namespace: str, profile: IndexProfile,
+                                  session: Optional[DeduplicationSession] = None):
+        """Embebe y sube un archivo estructurado lote a lote, con memoria acotada a unos pocos lotes."""
+        base_metadata = record["metadata"]
+        id_prefix = f"{record['id']}_{base_metadata.get('file_type', '.csv').lstrip('.')}_row_"
+        
+        in_flight = deque()
+        for batch in record["data"]["rows"]:
+            vectors = [
+                {
+                    "id": f"{id_prefix}{batch.row_offset + row}",
+                    "metadata": {
+                        **base_metadata,
+                        **batch.row_metadata(row),
+                        "text": batch.texts[row]
+                    }
+                }
+                for row in range(len(batch))
+            ]
+            if session is not None:
+                vectors = session.embed(vectors, self._embedder(profile))
+            else:
+                embeddings = self._embedder(profile)(batch.texts)
+                for vector, embedding in zip(vectors, embeddings):
+                    vector["values"] = embedding
+            in_flight.append(self._submit_upserts(index, vectors, namespace, profile))
             
-            for future in as_completed(futures):
-                try:
+            # Solo el lote anterior sigue subiéndose mientras se parsea y embebe el siguiente
+            while len(in_flight) > 1:
+                for future in in_flight.popleft():
                     future.result()
-                except Exception as e:
-                    print(f"Error en un lote de upsert: {e}")
+        
+        for batch_futures in in_flight:
+            for future in batch_futures:
+                future.result()
+    
+    def _upsert_vectors_batch(self, index, vectors, namespace, profile: IndexProfile):
+        if profile.two_stage:
+            # Los vectores completos van al almacén local; el índice recibe la versión recortada
+            self.full_vectors.put(profile.name, namespace, vectors)
+            vectors = [
+                {**vector, "values": EmbeddingService.shorten(vector["values"], profile.dimension)}
+                for vector in vectors
+            ]
+        
+        UPSERT_BATCH_SIZE.observe(len(vectors))
+        try:
+            with UPSERT_BATCH_SECONDS.time(span="upsert"):
+                # El upsert es idempotente por ID, así que se puede reintentar
+                ResilienceService.call(
+                    "pinecone", profile.name, "upsert",
+                    lambda timeout: index.upsert(vectors=vectors, namespace=namespace, _request_timeout=timeout),
+                    UPSERT_TIMEOUT_SECONDS
+                )
+        except Exception:
+            UPSERT_BATCH_FAILURES.inc()
+            # No se sabe qué parte del lote llegó al índice: la réplica local deja de ser fiable
+            self.replicas.invalidate(profile.name, namespace)
+            raise
+        self.replicas.apply_upsert(profile.name, namespace, vectors)
     
     def _process_records_to_chunks(self, records):
         all_chunks = []
@@ -139,85 +419,66 @@ class PineconeDBProvider(VectorDBProvider):
         for record in records:
             # Verificar si record.data["text"] es una lista (para archivos grandes procesados en chunks)
             text_content = record.data.get('text') if hasattr(record, 'data') and isinstance(record.data, dict) else None
-            is_chunked_list = isinstance(text_content, list)
-
-            if is_chunked_list: # Este es el caso para CSV
-                # `text_content` es ahora una lista de listas de diccionarios
-                for chunk_group in text_content:
-                    for item in chunk_group:
-                        # Cada 'item' tiene 'text' para embedding y 'metadata' completos
-                        chunk_id = f"{record.id}_csv_row_{len(all_chunks)}"
-                        all_chunks.append({
-                            "id": chunk_id,
-                            "text": item["text"],
-                            "metadata": {
-                                **record.metadata, # Metadatos base del record
-                                **item["metadata"]  # Metadatos completos de la fila
-                            }
-                        })
-            else: # Caso para TXT, MD, etc.
-                file_type = record.metadata.get('file_type', 'unknown')
-                
-                stream_chunk_index = 0
-                # ... (el resto de la lógica original para archivos no-CSV)
-                # Aquí asumimos que text_content es una lista de strings
-                if isinstance(text_content, list):
-                    for content_chunk in text_content:
-                        chunk_id = f"{record.id}_stream_{stream_chunk_index}"
-                        
-                        if len(content_chunk) > CHUNK_THRESHOLD:
-                            sub_chunks = self.text_splitter.split_text_with_metadata(
-                                text=content_chunk,
-                                original_id=chunk_id,
-                                metadata=record.metadata
-                            )
-                            all_chunks.extend(sub_chunks)
-                        else:
-                            enhanced_metadata = {
-                                **record.metadata,
-                                "original_id": record.id,
-                                "chunk_index": stream_chunk_index,
-                                "total_chunks": len(text_content),
-                                "chunk_size": len(content_chunk),
-                                "created_at": timestamp
-                            }
-                            all_chunks.append({
-                                "id": chunk_id,
-                                "text": content_chunk,
-                                "metadata": enhanced_metadata
-                            })
-                        stream_chunk_index += 1
-                else:
-                    # Procesamiento para datos que no son de archivo (texto plano, etc.)
-                    combined_text = self.text_splitter.combine_data_values(record.data)
+            
+            # Los CSV/JSONL van por el camino columnar en streaming; aquí solo llegan listas de strings
+            stream_chunk_index = 0
+            if isinstance(text_content, list):
+                for content_chunk in text_content:
+                    chunk_id = f"{record.id}_stream_{stream_chunk_index}"
                     
-                    if len(combined_text) > CHUNK_THRESHOLD:
-                        chunks = self.text_splitter.split_text_with_metadata(
-                            text=combined_text,
-                            original_id=record.id,
+                    if len(content_chunk) > CHUNK_THRESHOLD:
+                        sub_chunks = self.text_splitter.split_text_with_metadata(
+                            text=content_chunk,
+                            original_id=chunk_id,
                             metadata=record.metadata
                         )
-                        all_chunks.extend(chunks)
+                        all_chunks.extend(sub_chunks)
                     else:
                         enhanced_metadata = {
                             **record.metadata,
                             "original_id": record.id,
-                            "chunk_index": 0,
-                            "total_chunks": 1,
-                            "chunk_size": len(combined_text),
+                            "chunk_index": stream_chunk_index,
+                            "total_chunks": len(text_content),
+                            "chunk_size": len(content_chunk),
                             "created_at": timestamp
                         }
                         all_chunks.append({
-                            "id": record.id,
-                            "text": combined_text,
+                            "id": chunk_id,
+                            "text": content_chunk,
                             "metadata": enhanced_metadata
                         })
+                    stream_chunk_index += 1
+            else:
+                # Procesamiento para datos que no son de archivo (texto plano, etc.)
+                combined_text = self.text_splitter.combine_data_values(record.data)
+                
+                if len(combined_text) > CHUNK_THRESHOLD:
+                    chunks = self.text_splitter.split_text_with_metadata(
+                        text=combined_text,
+                        original_id=record.id,
+                        metadata=record.metadata
+                    )
+                    all_chunks.extend(chunks)
+                else:
+                    enhanced_metadata = {
+                        **record.metadata,
+                        "original_id": record.id,
+                        "chunk_index": 0,
+                        "total_chunks": 1,
+                        "chunk_size": len(combined_text),
+                        "created_at": timestamp
+                    }
+                    all_chunks.append({
+                        "id": record.id,
+                        "text": combined_text,
+                        "metadata": enhanced_metadata
+                    })
         
         return all_chunks
     
-    def _create_embeddings_for_chunks(self, chunks):
+    def _create_embeddings_for_chunks(self, chunks, profile: IndexProfile):
         texts = [chunk["text"] for chunk in chunks]
-        return self.embedding_service.create_embeddings(texts)
+        return self.embedding_service.create_embeddings(texts, profile.embedding_dimension)
     
     def _build_vectors_from_chunks_and_embeddings(self, chunks, embeddings):
         return [
@@ -232,11 +493,18 @@ class PineconeDBProvider(VectorDBProvider):
             for chunk, embedding in zip(chunks, embeddings)
         ]
     
-    def _delete_existing_document_chunks(self, index, upsert_request):
+    def _delete_existing_document_chunks(self, index, upsert_request, profile: IndexProfile):
         original_ids = [record.id for record in upsert_request.records]
-        
+        self._delete_by_original_ids(index, upsert_request.namespace, original_ids, profile)
+    
+    def _delete_by_original_ids(self, index, namespace: str, original_ids: List[str], profile: IndexProfile):
         if not original_ids:
             return
+        
+        if profile.two_stage:
+            self.full_vectors.delete_documents(profile.name, namespace, original_ids)
+        # Los duplicados guardados como referencia (deduplicación en modo reference) se borran con su documento
+        self.full_vectors.delete_references(profile.name, namespace, original_ids)
             
         try:
             index.delete(
@@ -246,61 +514,336 @@ class PineconeDBProvider(VectorDBProvider):
                         {"original_record_id": {"$in": original_ids}}
                     ]
                 },
-            namespace=upsert_request.namespace
+            namespace=namespace
         )
         except Exception:
-            pass
+            self.replicas.invalidate(profile.name, namespace)
+        else:
+            self.replicas.apply_delete(profile.name, namespace, original_ids)
 
     def search(self, index_name: str, query_request: QueryRequest):
-        index = self.pc.Index(index_name)
+        index = self._get_index(index_name)
 
         results_to_return = []
         if query_request.ids:
-            query_results = index.fetch(query_request.ids, query_request.namespace)
-            for vector_id, vector_data in query_results['vectors'].items():
-                metadata = vector_data.get('metadata', {})
-                text_content = metadata.pop('text', '')
-                
-                results_to_return.append({
-                    'id': vector_data['id'],
-                    'score': None,
-                    'metadata': metadata,
-                    'vector': vector_data['values'],
-                    'text': text_content
-                })
+            fetched = self.fetch_by_ids(index_name, query_request.ids, query_request.namespace)
+            results_to_return.extend(fetched.values())
         else:
-            query_embedding = self.embedding_service.create_single_embedding(query_request.query)
-
-            query_results = index.query(
-                namespace=query_request.namespace,
-                vector=query_embedding,
-                top_k=query_request.top_k,
-                include_values=True,
-                include_metadata=True,
-                filter=query_request.metadata_filter
-            )
+            profile = self._get_profile(index_name)
+            with SEARCH_SECONDS.time(span="search_embed", stage="embed"):
+                query_embedding = self.embedding_service.create_single_embedding(
+                    query_request.query, profile.embedding_dimension
+                )
 
-            for match in query_results['matches']:
-                metadata = match.get('metadata', {})
-                text_content = metadata.pop('text', '')
-                
-                results_to_return.append({
-                    'id': match['id'],
-                    'score': match['score'],
-                    'metadata': metadata,
-                    'vector': match['values'],
-                    'text': text_content
-                })
+            if query_request.group_by_document:
+                results_to_return = self._document_search(index, profile, query_request, query_embedding)
+            else:
+                results_to_return = self._ranked_matches(index, profile, query_request, query_embedding, query_request.top_k)
 
         return results_to_return
     
+    def _ranked_matches(self, index, profile: IndexProfile, query_request: QueryRequest,
+                        query_embedding: List[float], top_k: int) -> List[Dict[str, Any]]:
+        if profile.two_stage:
+            return self._two_stage_search(index, profile, query_request, query_embedding, top_k=top_k)
+        return self._query_matches(index, profile.name, query_request, query_embedding, top_k)
+    
+    def _document_search(self, index, profile: IndexProfile, query_request: QueryRequest,
+                         query_embedding: List[float]) -> List[Dict[str, Any]]:
+        """Devuelve los `top_k` documentos distintos con sus mejores chunks, en una sola pasada del servidor.
+
+        Se piden `top_k * GROUP_OVERSAMPLE` chunks y, si no alcanzan para `top_k` documentos, se vuelve
+        a consultar con un tamaño estimado a partir de los chunks por documento observados, hasta
+        GROUP_MAX_FETCH o hasta agotar el namespace. Con MMR se buscan candidatos extra para diversificar.
+        """
+        top_k = query_request.top_k
+        mmr_lambda = query_request.mmr_lambda
+        if mmr_lambda is not None and not 0 <= mmr_lambda <= 1:
+            raise ValueError("mmr_lambda debe estar entre 0 y 1")
+        if query_request.chunks_per_document < 1:
+            raise ValueError("chunks_per_document debe ser al menos 1")
+        wanted = top_k * GROUP_MMR_CANDIDATES if mmr_lambda is not None and mmr_lambda < 1 else top_k
+        limit = max(GROUP_MAX_FETCH, top_k)
+        
+        fetch_k = min(limit, max(top_k * GROUP_OVERSAMPLE, query_request.chunks_per_document))
+        rounds = 0
+        while True:
+            rounds += 1
+            matches = self._ranked_matches(index, profile, query_request, query_embedding, fetch_k)
+            documents = len(group_matches(matches, 1, profile.metric))
+            if documents >= wanted or len(matches) < fetch_k or fetch_k >= limit:
+                break
+            fetch_k = next_fetch_size(fetch_k, documents, wanted, limit)
+        
+        SEARCH_GROUP_ROUNDS.observe(rounds)
+        SEARCH_GROUP_DOCUMENTS.observe(documents)
+        return collapse(matches, top_k, query_request.chunks_per_document, mmr_lambda, profile.metric)
+    
+    def _query_matches(self, index, index_name: str, query_request: QueryRequest, vector: List[float], top_k: int,
+                       include_values: bool = True) -> List[Dict[str, Any]]:
+        # Los namespaces calientes se responden desde la réplica local sin salir a la red
+        query_results = self.replicas.query(
+            self._get_profile(index_name), query_request.namespace, vector, top_k,
+            query_request.metadata_filter, include_values
+        )
+        if query_results is None:
+            with SEARCH_SECONDS.time(span="search_query", stage="query"):
+                query_results = ResilienceService.call(
+                    "pinecone", index_name, "query",
+                    lambda timeout: index.query(
+                        namespace=query_request.namespace,
+                        vector=vector,
+                        top_k=top_k,
+                        include_values=include_values,
+                        include_metadata=True,
+                        filter=query_request.metadata_filter,
+                        _request_timeout=timeout
+                    ),
+                    QUERY_TIMEOUT_SECONDS,
+                    hedge=True
+                )
+
+        results = []
+        for match in query_results['matches']:
+            metadata = match.get('metadata', {})
+            text_content = metadata.pop('text', '')
+            
+            results.append({
+                'id': match['id'],
+                'score': match['score'],
+                'metadata': metadata,
+                'vector': match.get('values', []),
+                'text': text_content
+            })
+        return results
+    
+    def _two_stage_search(self, index, profile: IndexProfile, query_request: QueryRequest,
+                          query_embedding: List[float], oversample: int = TWO_STAGE_OVERSAMPLE,
+                          top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Pide `top_k * oversample` candidatos al índice compacto y los re-puntúa con los vectores completos."""
+        top_k = top_k or query_request.top_k
+        compact_query = EmbeddingService.shorten(query_embedding, profile.dimension)
+        candidates = self._query_matches(
+            index, profile.name, query_request, compact_query, min(top_k * oversample, 1000), include_values=False
+        )
+        return self._rescore(profile, query_request.namespace, query_embedding, candidates)[:top_k]
+    
+    def _rescore(self, profile: IndexProfile, namespace: str, query_embedding: List[float],
+                 candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        import numpy as np
+
+        with SEARCH_SECONDS.time(span="search_rescore", stage="rescore"):
+            full_vectors = self.full_vectors.get(profile.name, namespace, [match['id'] for match in candidates])
+            query = np.asarray(query_embedding, dtype=np.float32)
+            query_norm = np.linalg.norm(query) or 1.0
+            for match in candidates:
+                vector = full_vectors.get(match['id'])
+                if vector is None:
+                    # Sin vector completo (p. ej. cargado antes del modo two-stage) se conserva el score compacto
+                    continue
+                # Mismo score que devuelve Pinecone para la métrica del índice
+                if profile.metric == "dotproduct":
+                    score = vector @ query
+                elif profile.metric == EUCLIDEAN:
+                    difference = vector - query
+                    score = difference @ difference
+                else:
+                    score = vector @ query / ((np.linalg.norm(vector) or 1.0) * query_norm)
+                match['score'] = float(score)
+                match['vector'] = vector.tolist()
+            return sorted(candidates, key=lambda match: ranking_score(match['score'], profile.metric), reverse=True)
+    
+    def compare_search(self, index_name: str, query_request: QueryRequest) -> Dict[str, Any]:
+        """Compara calidad y latencia de la búsqueda compacta sola contra la two-stage.
+
+        La referencia es un pool de candidatos mucho mayor re-puntuado con los vectores completos,
+        que aproxima el ranking exacto a dimensión completa; el recall se mide contra su top_k.
+        """
+        profile = self._get_profile(index_name)
+        if not profile.two_stage:
+            raise ValueError(f"El índice {index_name} no está configurado como two-stage")
+        
+        index = self._get_index(index_name)
+        top_k = query_request.top_k
+        query_embedding = self.embedding_service.create_single_embedding(
+            query_request.query, profile.embedding_dimension
+        )
+        compact_query = EmbeddingService.shorten(query_embedding, profile.dimension)
+        
+        start = time.perf_counter()
+        coarse = self._query_matches(index, index_name, query_request, compact_query, top_k, include_values=False)
+        coarse_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        two_stage = self._two_stage_search(index, profile, query_request, query_embedding)
+        two_stage_seconds = time.perf_counter() - start
+        
+        reference_pool = min(top_k * TWO_STAGE_OVERSAMPLE * 8, 1000)
+        start = time.perf_counter()
+        reference = self._rescore(
+            profile, query_request.namespace, query_embedding,
+            self._query_matches(index, index_name, query_request, compact_query, reference_pool, include_values=False)
+        )[:top_k]
+        reference_seconds = time.perf_counter() - start
+        
+        reference_ids = {match['id'] for match in reference}
+        
+        def recall(results):
+            if not reference_ids:
+                return 1.0
+            return len(reference_ids & {match['id'] for match in results}) / len(reference_ids)
+        
+        return {
+            "dimension": profile.dimension,
+            "full_dimension": profile.full_dimension,
+            "oversample": TWO_STAGE_OVERSAMPLE,
+            "reference_pool": reference_pool,
+            "coarse": {"seconds": coarse_seconds, "recall_at_k": recall(coarse)},
+            "two_stage": {"seconds": two_stage_seconds, "recall_at_k": recall(two_stage)},
+            "reference": {"seconds": reference_seconds}
+        }
+    
+    def fetch_by_ids(self, index_name: str, ids: List[str], namespace: str) -> Dict[str, Dict[str, Any]]:
+        unique_ids = list(dict.fromkeys(ids))
+        
+        vectors = self.replicas.fetch(index_name, namespace, unique_ids)
+        if vectors is None:
+            vectors = self._fetch_vectors(self._get_index(index_name), index_name, unique_ids, namespace)
+        missing = [vector_id for vector_id in unique_ids if vector_id not in vectors]
+        if missing:
+            vectors = {**vectors, **self._fetch_references(index_name, missing, namespace)}
+        
+        results = {}
+        for vector_id, vector_data in vectors.items():
+            metadata = vector_data.get('metadata', {})
+            text_content = metadata.pop('text', '')
+            
+            results[vector_id] = {
+                'id': vector_data['id'],
+                'score': None,
+                'metadata': metadata,
+                'vector': vector_data['values'],
+                'text': text_content
+            }
+        return results
+    
+    def _fetch_references(self, index_name: str, ids: List[str], namespace: str) -> Dict[str, Any]:
+        """Resuelve duplicados guardados como referencia: metadata propia y vector del canónico."""
+        references = self.full_vectors.get_references(index_name, namespace, ids)
+        if not references:
+            return {}
+        canonical_ids = list({metadata['duplicate_of'] for metadata in references.values()})
+        canonicals = self.replicas.fetch(index_name, namespace, canonical_ids)
+        if canonicals is None:
+            canonicals = self._fetch_vectors(self._get_index(index_name), index_name, canonical_ids, namespace)
+        return {
+            vector_id: {
+                'id': vector_id,
+                'metadata': metadata,
+                # Si el canónico ya no existe la referencia se devuelve sin vector
+                'values': canonicals[metadata['duplicate_of']]['values'] if metadata['duplicate_of'] in canonicals else []
+            }
+            for vector_id, metadata in references.items()
+        }
+    
+    def _fetch_vectors(self, index, index_name: str, ids: List[str], namespace: str) -> Dict[str, Any]:
+        vectors = {}
+        # Pinecone admite hasta 1000 IDs por fetch
+        for i in range(0, len(ids), 1000):
+            with SEARCH_SECONDS.time(span="search_fetch", stage="fetch"):
+                fetch_results = ResilienceService.call(
+                    "pinecone", index_name, "fetch",
+                    lambda timeout, batch=ids[i:i + 1000]: index.fetch(batch, namespace, _request_timeout=timeout),
+                    FETCH_TIMEOUT_SECONDS,
+                    hedge=True
+                )
+            vectors.update(fetch_results['vectors'])
+        return vectors
+    
+    def _describe_index_stats(self, index_name: str):
+        index = self._get_index(index_name)
+        # Es una lectura: se reintenta y se cubre con hedge como el fetch, y respeta el deadline del request
+        return ResilienceService.call(
+            "pinecone", index_name, "describe_index_stats",
+            lambda timeout: index.describe_index_stats(_request_timeout=timeout),
+            FETCH_TIMEOUT_SECONDS,
+            hedge=True
+        )
+
+    def _namespace_vector_count(self, index_name: str, namespace: str) -> int:
+        stats = self._describe_index_stats(index_name)
+        namespace_stats = stats['namespaces'].get(namespace)
+        return namespace_stats['vector_count'] if namespace_stats else 0
+    
+    def _snapshot_namespace(self, index_name: str, namespace: str):
+        """Recorre el namespace completo (listado paginado de IDs + fetch) para cargar la réplica local."""
+        index = self._get_index(index_name)
+        for page_ids in index.list(namespace=namespace):
+            if page_ids:
+                yield [
+                    {'id': vector_id, 'values': vector['values'], 'metadata': vector.get('metadata') or {}}
+                    for vector_id, vector in self._fetch_vectors(index, index_name, list(page_ids), namespace).items()
+                ]
+    
+    def _fetch_vector_values(self, index_name: str, ids: List[str], namespace: str) -> Dict[str, List[float]]:
+        profile = self._get_profile(index_name)
+        if profile.two_stage:
+            # La deduplicación reutiliza el vector completo; el recorte se aplica al subirlo
+            return {vector_id: vector.tolist() for vector_id, vector in self.full_vectors.get(index_name, namespace, ids).items()}
+        return {vector_id: match['vector'] for vector_id, match in self.fetch_by_ids(index_name, ids, namespace).items()}
+    
+    @staticmethod
+    def _paged_ids(index, namespace: str):
+        """Agrupa el listado paginado de IDs del namespace en páginas de SNAPSHOT_PAGE_SIZE."""
+        page = []
+        for listed_ids in index.list(namespace=namespace):
+            page.extend(listed_ids)
+            while len(page) >= SNAPSHOT_PAGE_SIZE:
+                yield page[:SNAPSHOT_PAGE_SIZE]
+                page = page[SNAPSHOT_PAGE_SIZE:]
+        if page:
+            yield page
+
+    def _export_page(self, index, profile: IndexProfile, namespace: str, page_ids: List[str]):
+        with SNAPSHOT_PAGE_SECONDS.time(operation="export"):
+            fetched = self._fetch_vectors(index, profile.name, page_ids, namespace)
+            ids = list(fetched)
+            if profile.two_stage:
+                full = self.full_vectors.get(profile.name, namespace, ids)
+                missing = [vector_id for vector_id in ids if vector_id not in full]
+                if missing:
+                    raise ValueError(f"Faltan los vectores completos de {len(missing)} IDs (p. ej. {missing[0]})")
+                vectors = [full[vector_id] for vector_id in ids]
+            else:
+                vectors = [fetched[vector_id]['values'] for vector_id in ids]
+        SNAPSHOT_VECTORS.inc(len(ids), operation="export")
+        return ids, vectors, [fetched[vector_id].get('metadata') or {} for vector_id in ids]
+
+    def _import_page(self, index, reader: SnapshotReader, number: int, namespace: str, profile: IndexProfile) -> int:
+        with SNAPSHOT_PAGE_SECONDS.time(operation="import"):
+            ids, matrix, metadatas = reader.read_page(number)
+            dimension = profile.embedding_dimension
+            vectors = [
+                {
+                    "id": vector_id,
+                    # Un snapshot de mayor dimensión se recorta igual que los embeddings de dimensión reducida
+                    "values": row.tolist() if len(row) == dimension else EmbeddingService.shorten(row, dimension),
+                    "metadata": metadata
+                }
+                for vector_id, row, metadata in zip(ids, matrix, metadatas)
+            ]
+            for future in self._submit_upserts(index, vectors, namespace, profile):
+                future.result()
+        SNAPSHOT_VECTORS.inc(len(vectors), operation="import")
+        return len(vectors)
+
     def ensure_namespace_exists(self, index_name: str, namespace: str):
         try:
-            index = self.pc.Index(index_name)
+            index = self._get_index(index_name)
             
             index.query(
                 namespace=namespace,
-                vector=[0.0] * 1536,
+                vector=[0.0] * self._get_profile(index_name).dimension,
                 top_k=1,
                 include_metadata=False
             )
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from app.models.models import QueryRequest, UpsertRequest
+from typing import Any, BinaryIO, Dict, List, Optional
+from app.models.models import DataItem, QueryRequest, UpsertRequest
 
 
 class VectorDBProvider(ABC):
@@ -8,13 +9,44 @@ class VectorDBProvider(ABC):
         pass
 
     @abstractmethod
-    def upsert_data(self, index_name: str, upsert_request: UpsertRequest):
+    def upsert_data(self, index_name: str, upsert_request: UpsertRequest) -> Optional[Dict[str, Any]]:
+        """Devuelve el reporte de deduplicación de la ingesta, o None si no se pidió."""
+        pass
+
+    @abstractmethod
+    def ingest_file(self, index_name: str, namespace: str, record: DataItem, file_name: str,
+                    file_extension: str, stream: BinaryIO) -> Dict[str, Any]:
+        pass
+
+    @abstractmethod
+    def delete_records(self, index_name: str, namespace: str, record_ids: List[str]):
         pass
 
     @abstractmethod
     def search(self, index_name: str, query_request: QueryRequest):
         pass
     
+    @abstractmethod
+    def compare_search(self, index_name: str, query_request: QueryRequest) -> Dict[str, Any]:
+        pass
+    
+    @abstractmethod
+    def fetch_by_ids(self, index_name: str, ids: List[str], namespace: str) -> Dict[str, Dict[str, Any]]:
+        pass
+    
     @abstractmethod
     def ensure_namespace_exists(self, index_name: str, namespace: str):
         pass
+
+    @abstractmethod
+    def export_namespace(self, index_name: str, namespace: str, snapshot_name: str) -> Dict[str, Any]:
+        pass
+
+    @abstractmethod
+    def import_namespace(self, index_name: str, namespace: str, snapshot_name: str,
+                         resume: bool = True) -> Dict[str, Any]:
+        pass
+
+    def warm_up(self, index_names: List[str]):
+        """Pre-resuelve índices y abre conexiones; los proveedores sin estado lo ignoran."""
+        pass
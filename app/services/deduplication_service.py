@@ -0,0 +1,430 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.configurations.config import DEDUP_INDEX_PATH, DEDUP_MAX_ENTRIES_PER_NAMESPACE
+from app.models.models import DeduplicationConfig
+from app.services.metrics_service import DEDUP_CHUNKS
+
+logger = logging.getLogger(__name__)
+
+MODE_REUSE = "reuse"
+MODE_REFERENCE = "reference"
+
+# Parámetros fijos de MinHash/LSH: las firmas de distintas ingestas tienen que ser comparables.
+# 32 bandas de 4 filas detectan candidatos desde ~0.4 de similitud; el umbral real se aplica al verificar.
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+_MERSENNE_PRIME = (1 << 61) - 1
+
+_WHITESPACE = re.compile(r'\s+')
+_permutations = None
+_permutations_lock = threading.Lock()
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        raise ImportError("numpy is required for deduplication. Install with: pip install numpy")
+
+
+def _get_permutations():
+    global _permutations
+    if _permutations is None:
+        with _permutations_lock:
+            if _permutations is None:
+                np = _numpy()
+                # Semilla fija para que las firmas no cambien entre procesos
+                generator = np.random.RandomState(1)
+                a = generator.randint(1, 1 << 31, size=NUM_PERM).astype(np.uint64)
+                b = generator.randint(0, 1 << 31, size=NUM_PERM).astype(np.uint64)
+                _permutations = (a, b)
+    return _permutations
+
+
+class _Fingerprint:
+    __slots__ = ("exact_hash", "signature")
+
+    def __init__(self, exact_hash: bytes, signature):
+        self.exact_hash = exact_hash
+        self.signature = signature
+
+    def band_keys(self) -> List[Tuple[int, bytes]]:
+        return [(band, self.signature[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+
+def _fingerprint(text: str) -> Optional[_Fingerprint]:
+    normalized = _WHITESPACE.sub(' ', text).strip().lower()
+    if not normalized:
+        return None
+
+    np = _numpy()
+    exact_hash = hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+    shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(max(1, len(normalized) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    a, b = _get_permutations()
+    signature = ((a[:, None] * hashes[None, :] + b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+    return _Fingerprint(exact_hash, signature)
+
+
+def _owner(vector: Dict[str, Any]) -> str:
+    # Mismo criterio que el borrado previo de documentos: original_record_id u original_id
+    metadata = vector["metadata"]
+    return metadata.get("original_record_id") or metadata.get("original_id") or vector["id"]
+
+
+class _DedupStore:
+    """Chunks canónicos de todos los namespaces en SQLite: sobreviven a reinicios y los comparten los workers.
+
+    Cada chunk guarda su hash exacto, su firma MinHash y su dueño; las bandas LSH van en una tabla
+    aparte que se borra en cascada con el chunk. Las búsquedas y altas de un lote corren dentro de
+    una transacción `BEGIN IMMEDIATE`, así dos workers no eligen canónicos distintos para el mismo texto.
+    """
+
+    def __init__(self, path: str = DEDUP_INDEX_PATH, max_entries: int = DEDUP_MAX_ENTRIES_PER_NAMESPACE):
+        self.path = path
+        self.max_entries = max_entries
+        self._connection: Optional[sqlite3.Connection] = None
+        self._writes: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            with self._lock:
+                if self._connection is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    # Sin transacciones implícitas: se abren a mano con BEGIN IMMEDIATE
+                    connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.execute("PRAGMA synchronous=NORMAL")
+                    connection.execute("PRAGMA foreign_keys=ON")
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS dedup_chunks ("
+                        "seq INTEGER PRIMARY KEY AUTOINCREMENT, index_name TEXT NOT NULL, namespace TEXT NOT NULL, "
+                        "id TEXT NOT NULL, owner TEXT NOT NULL, exact_hash BLOB NOT NULL, signature BLOB NOT NULL, "
+                        "UNIQUE (index_name, namespace, id))"
+                    )
+                    connection.execute(
+                        "CREATE INDEX IF NOT EXISTS dedup_chunks_exact ON dedup_chunks (index_name, namespace, exact_hash)"
+                    )
+                    connection.execute(
+                        "CREATE INDEX IF NOT EXISTS dedup_chunks_owner ON dedup_chunks (index_name, namespace, owner)"
+                    )
+                    connection.execute(
+                        "CREATE INDEX IF NOT EXISTS dedup_chunks_seq ON dedup_chunks (index_name, namespace, seq)"
+                    )
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS dedup_bands ("
+                        "band_key BLOB NOT NULL, "
+                        "chunk_seq INTEGER NOT NULL REFERENCES dedup_chunks (seq) ON DELETE CASCADE)"
+                    )
+                    connection.execute("CREATE INDEX IF NOT EXISTS dedup_bands_key ON dedup_bands (band_key)")
+                    connection.execute("CREATE INDEX IF NOT EXISTS dedup_bands_chunk ON dedup_bands (chunk_seq)")
+                    self._connection = connection
+        return self._connection
+
+    def exists(self) -> bool:
+        return self._connection is not None or os.path.exists(self.path)
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection
+        with self._lock:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def trim(self, index_name: str, namespace: str, added: int):
+        # Se descartan los canónicos más antiguos para acotar el tamaño por namespace, cada tanto y no en cada alta
+        key = (index_name, namespace)
+        self._writes[key] = self._writes.get(key, 0) + added
+        if self._writes[key] < max(1000, self.max_entries // 10):
+            return
+        self._writes[key] = 0
+        self.connection.execute(
+            "DELETE FROM dedup_chunks WHERE index_name = ? AND namespace = ? AND seq <= ("
+            "SELECT seq FROM dedup_chunks WHERE index_name = ? AND namespace = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+            (index_name, namespace, index_name, namespace, self.max_entries),
+        )
+
+
+class _NamespaceIndex:
+    """Chunks canónicos conocidos de un namespace: hash exacto, buckets LSH y dueño de cada uno.
+
+    Los métodos se llaman dentro de `transaction()`.
+    """
+
+    def __init__(self, store: _DedupStore, index_name: str, namespace: str):
+        self.store = store
+        self.index_name = index_name
+        self.namespace = namespace
+
+    def transaction(self):
+        return self.store.transaction()
+
+    def _band_keys(self, fingerprint: _Fingerprint) -> List[bytes]:
+        # El índice y el namespace entran en la clave, así una sola tabla de bandas sirve para todos
+        scope = f"{self.index_name}\0{self.namespace}\0".encode("utf-8")
+        return [
+            hashlib.blake2b(scope + bytes([band]) + key, digest_size=8).digest()
+            for band, key in fingerprint.band_keys()
+        ]
+
+    def find(self, fingerprint: _Fingerprint, threshold: float) -> Optional[Tuple[str, str]]:
+        connection = self.store.connection
+        row = connection.execute(
+            "SELECT id FROM dedup_chunks WHERE index_name = ? AND namespace = ? AND exact_hash = ? ORDER BY seq LIMIT 1",
+            (self.index_name, self.namespace, fingerprint.exact_hash),
+        ).fetchone()
+        if row is not None:
+            return row[0], "exact"
+
+        band_keys = self._band_keys(fingerprint)
+        candidates = connection.execute(
+            "SELECT id, signature FROM dedup_chunks WHERE seq IN ("
+            f"SELECT chunk_seq FROM dedup_bands WHERE band_key IN ({','.join('?' * len(band_keys))}))",
+            band_keys,
+        ).fetchall()
+
+        np = _numpy()
+        best_id, best_similarity = None, threshold
+        for candidate_id, signature in candidates:
+            similarity = (np.frombuffer(signature, dtype=np.uint64) == fingerprint.signature).sum() / NUM_PERM
+            if similarity >= best_similarity:
+                best_id, best_similarity = candidate_id, similarity
+        return (best_id, "near") if best_id is not None else None
+
+    def add(self, vector_id: str, fingerprint: _Fingerprint, owner: str):
+        self.remove(vector_id)
+        connection = self.store.connection
+        seq = connection.execute(
+            "INSERT INTO dedup_chunks (index_name, namespace, id, owner, exact_hash, signature) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.index_name, self.namespace, vector_id, owner, fingerprint.exact_hash, fingerprint.signature.tobytes()),
+        ).lastrowid
+        connection.executemany(
+            "INSERT INTO dedup_bands (band_key, chunk_seq) VALUES (?, ?)",
+            [(key, seq) for key in self._band_keys(fingerprint)],
+        )
+        self.store.trim(self.index_name, self.namespace, 1)
+
+    def remove(self, vector_id: str):
+        self.store.connection.execute(
+            "DELETE FROM dedup_chunks WHERE index_name = ? AND namespace = ? AND id = ?",
+            (self.index_name, self.namespace, vector_id),
+        )
+
+    def forget(self, owners: List[str]):
+        # SQLite limita la cantidad de parámetros por consulta
+        for i in range(0, len(owners), 500):
+            batch = owners[i:i + 500]
+            self.store.connection.execute(
+                "DELETE FROM dedup_chunks WHERE index_name = ? AND namespace = ? "
+                f"AND owner IN ({','.join('?' * len(batch))})",
+                [self.index_name, self.namespace, *batch],
+            )
+
+
+class DeduplicationSession:
+    """Deduplicación de una ingesta: decide qué chunks se embeben y arma el reporte.
+
+    Recibe vectores sin `values` (id + metadata con "text"). Los canónicos de ingestas anteriores se
+    verifican con un fetch antes de reutilizarse; los duplicados de canónicos de otro lote de esta
+    misma ingesta, que puede seguir en vuelo, se resuelven al final con `resolve_deferred`.
+    En modo `reference` los duplicados no se suben al índice: se entregan a `store_references`
+    (id + metadata con "text" y "duplicate_of") para que sigan siendo recuperables y borrables.
+    """
+
+    def __init__(self, index: _NamespaceIndex, config: DeduplicationConfig,
+                 fetch_vectors: Callable[[List[str]], Dict[str, List[float]]],
+                 store_references: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+        self.index = index
+        self.config = config
+        self.fetch_vectors = fetch_vectors
+        self.store_references = store_references
+        self._lock = threading.Lock()
+        self._session_ids: Set[str] = set()
+        self._deferred: List[Tuple[Dict[str, Any], str, str]] = []
+        self._references: List[Dict[str, str]] = []
+        self._counts = {"chunks": 0, "embedded": 0, "exact": 0, "near": 0}
+
+    def embed(self, vectors: List[Dict[str, Any]],
+              embed_fn: Callable[[List[str]], List[List[float]]]) -> List[Dict[str, Any]]:
+        fingerprints = [_fingerprint(vector["metadata"]["text"]) for vector in vectors]
+        matches: Dict[int, Tuple[str, str]] = {}
+        to_embed: List[int] = []
+        local_ids: Set[str] = set()
+
+        with self.index.transaction():
+            for i, (vector, fingerprint) in enumerate(zip(vectors, fingerprints)):
+                if fingerprint is not None:
+                    match = self.index.find(fingerprint, self.config.threshold)
+                    if match is not None and match[0] != vector["id"]:
+                        matches[i] = match
+                        continue
+                    self.index.add(vector["id"], fingerprint, _owner(vector))
+                to_embed.append(i)
+                local_ids.add(vector["id"])
+            session_ids = self._register_session_ids(local_ids)
+
+        # Los canónicos de ingestas anteriores pueden haberse borrado: se verifican antes de usarlos
+        external = {i: match for i, match in matches.items()
+                    if match[0] not in local_ids and match[0] not in session_ids}
+        found = self._fetch({canonical_id for canonical_id, _ in external.values()})
+        stale = {i for i, (canonical_id, _) in external.items() if canonical_id not in found}
+        if stale:
+            with self.index.transaction():
+                for i in sorted(stale):
+                    self.index.remove(matches[i][0])
+                for i in sorted(stale):
+                    match = self.index.find(fingerprints[i], self.config.threshold)
+                    if match is not None and match[0] in local_ids:
+                        matches[i] = match
+                        continue
+                    del matches[i]
+                    self.index.add(vectors[i]["id"], fingerprints[i], _owner(vectors[i]))
+                    to_embed.append(i)
+                    local_ids.add(vectors[i]["id"])
+                self._register_session_ids(local_ids)
+
+        embeddings = embed_fn([vectors[i]["metadata"]["text"] for i in to_embed]) if to_embed else []
+        values_by_id = {vectors[i]["id"]: embedding for i, embedding in zip(to_embed, embeddings)}
+        values_by_id.update(found)
+
+        results = []
+        references = []
+        for i in to_embed:
+            vectors[i]["values"] = values_by_id[vectors[i]["id"]]
+            results.append(vectors[i])
+        for i, (canonical_id, kind) in matches.items():
+            if self.config.mode == MODE_REUSE and canonical_id not in values_by_id:
+                # El canónico está en otro lote de esta ingesta: se copia su vector al final
+                with self._lock:
+                    self._deferred.append((vectors[i], canonical_id, kind))
+                continue
+            vector = self._resolve_duplicate(vectors[i], canonical_id, kind, values_by_id.get(canonical_id))
+            (references if self.config.mode == MODE_REFERENCE else results).append(vector)
+
+        if references and self.store_references is not None:
+            self.store_references(references)
+        self._count(len(vectors), len(to_embed))
+        return results
+
+    def resolve_deferred(self, embed_fn: Callable[[List[str]], List[List[float]]]) -> List[Dict[str, Any]]:
+        with self._lock:
+            deferred, self._deferred = self._deferred, []
+        if not deferred:
+            return []
+
+        found = self._fetch({canonical_id for _, canonical_id, _ in deferred})
+        results = []
+        missing = []
+        for vector, canonical_id, kind in deferred:
+            if canonical_id in found:
+                results.append(self._resolve_duplicate(vector, canonical_id, kind, found[canonical_id]))
+            else:
+                # El lote del canónico falló: el duplicado se embebe por su cuenta
+                missing.append(vector)
+
+        if missing:
+            embeddings = embed_fn([vector["metadata"]["text"] for vector in missing])
+            for vector, embedding in zip(missing, embeddings):
+                vector["values"] = embedding
+                results.append(vector)
+            self._count(0, len(missing))
+        return results
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            report = {
+                "mode": self.config.mode,
+                "threshold": self.config.threshold,
+                "chunks": self._counts["chunks"],
+                "embedded": self._counts["embedded"],
+                "exact_duplicates": self._counts["exact"],
+                "near_duplicates": self._counts["near"],
+                "embeddings_skipped": self._counts["exact"] + self._counts["near"],
+            }
+            if self.config.mode == MODE_REFERENCE:
+                report["references"] = list(self._references)
+        return report
+
+    def _register_session_ids(self, ids: Set[str]) -> Set[str]:
+        with self._lock:
+            self._session_ids.update(ids)
+            return set(self._session_ids)
+
+    def _resolve_duplicate(self, vector: Dict[str, Any], canonical_id: str, kind: str,
+                           values: Optional[List[float]]) -> Dict[str, Any]:
+        with self._lock:
+            self._counts[kind] += 1
+            if self.config.mode == MODE_REFERENCE:
+                self._references.append({"id": vector["id"], "duplicate_of": canonical_id, "match": kind})
+        DEDUP_CHUNKS.inc(result=kind)
+        vector["metadata"]["duplicate_of"] = canonical_id
+        if self.config.mode == MODE_REFERENCE:
+            # La referencia no lleva vector propio: se resuelve con el del canónico al leerla
+            return {"id": vector["id"], "metadata": vector["metadata"]}
+        vector["values"] = values
+        return vector
+
+    def _count(self, chunks: int, embedded: int):
+        with self._lock:
+            self._counts["chunks"] += chunks
+            self._counts["embedded"] += embedded
+        if embedded:
+            DEDUP_CHUNKS.inc(embedded, result="embedded")
+
+    def _fetch(self, ids: Set[str]) -> Dict[str, List[float]]:
+        if not ids:
+            return {}
+        try:
+            return self.fetch_vectors(list(ids))
+        except Exception as e:
+            # Si el fetch falla se embeben los duplicados en lugar de frenar la ingesta
+            logger.warning("No se pudieron verificar los chunks canónicos: %s", e)
+            return {}
+
+
+class DeduplicationService:
+    """Índices de chunks canónicos por índice y namespace, en un SQLite compartido por workers y reinicios."""
+
+    _store = _DedupStore()
+
+    @staticmethod
+    def _get_index(index_name: str, namespace: str) -> _NamespaceIndex:
+        return _NamespaceIndex(DeduplicationService._store, index_name, namespace)
+
+    @staticmethod
+    def session(index_name: str, namespace: str, config: DeduplicationConfig,
+                fetch_vectors: Callable[[List[str]], Dict[str, List[float]]],
+                store_references: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> DeduplicationSession:
+        return DeduplicationSession(
+            DeduplicationService._get_index(index_name, namespace), config, fetch_vectors, store_references
+        )
+
+    @staticmethod
+    def forget(index_name: str, namespace: str, owners: List[str]):
+        """Olvida los canónicos de documentos que se van a reemplazar o borrar."""
+        # Sin deduplicación previa no hay nada que olvidar: no se crea la base
+        if not owners or not DeduplicationService._store.exists():
+            return
+        index = DeduplicationService._get_index(index_name, namespace)
+        with index.transaction():
+            index.forget(owners)
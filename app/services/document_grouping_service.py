@@ -0,0 +1,93 @@
+import math
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.models.index_profile import ranking_score
+
+
+def _numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("numpy is required for MMR diversification. Install with: pip install numpy")
+    return np
+
+
+def document_key(match: Dict[str, Any]) -> str:
+    # Mismo criterio que el borrado y la deduplicación: original_record_id u original_id
+    metadata = match.get('metadata') or {}
+    return metadata.get('original_record_id') or metadata.get('original_id') or match['id']
+
+
+def group_matches(matches: List[Dict[str, Any]], chunks_per_document: int,
+                  metric: str = "cosine") -> List[Dict[str, Any]]:
+    """Agrupa matches en documentos, conservando los mejores chunks de cada uno.
+
+    Los documentos quedan ordenados por el score de su mejor chunk, según la métrica del índice
+    (en euclidean el score es una distancia y el mejor es el menor).
+    """
+    groups: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    ordered = sorted(matches, key=lambda match: ranking_score(match['score'], metric), reverse=True)
+    for match in ordered:
+        key = document_key(match)
+        group = groups.get(key)
+        if group is None:
+            groups[key] = {'document_id': key, 'score': match['score'], 'matches': [match]}
+        elif len(group['matches']) < chunks_per_document:
+            group['matches'].append(match)
+    return list(groups.values())
+
+
+def next_fetch_size(fetched: int, documents: int, top_k: int, limit: int) -> int:
+    """Tamaño de la próxima consulta según los chunks por documento observados hasta ahora."""
+    chunks_per_document = fetched / max(documents, 1)
+    # Margen del 25 % sobre la estimación y al menos el doble, para converger en pocas rondas
+    estimate = math.ceil(top_k * chunks_per_document * 1.25)
+    return min(limit, max(fetched * 2, estimate))
+
+
+def mmr_select(documents: List[Dict[str, Any]], top_k: int, mmr_lambda: float,
+               metric: str = "cosine") -> List[Dict[str, Any]]:
+    """Selecciona `top_k` documentos por Maximal Marginal Relevance sobre el vector de su mejor chunk.
+
+    La relevancia es el score (invertido si es una distancia) normalizado a [0, 1] y la redundancia,
+    el coseno máximo contra los ya elegidos; `mmr_lambda=1` equivale al ranking por relevancia. Si
+    algún documento no trae vector (o las dimensiones no coinciden) se devuelve el ranking original.
+    """
+    if len(documents) <= 1:
+        return documents[:top_k]
+    vectors = [document['matches'][0].get('vector') for document in documents]
+    if not all(vectors) or len({len(vector) for vector in vectors}) != 1:
+        return documents[:top_k]
+
+    np = _numpy()
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+    scores = np.asarray([ranking_score(document['score'], metric) for document in documents], dtype=np.float32)
+    spread = scores.max() - scores.min()
+    relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+    # Similitud máxima de cada candidato contra la selección, actualizada con un producto por paso
+    max_similarity = np.full(len(documents), -np.inf, dtype=np.float32)
+    available = np.ones(len(documents), dtype=bool)
+    selected = []
+    for _ in range(min(top_k, len(documents))):
+        if selected:
+            gain = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        else:
+            gain = relevance.copy()
+        gain[~available] = -np.inf
+        best = int(np.argmax(gain))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, matrix @ matrix[best])
+    return [documents[i] for i in selected]
+
+
+def collapse(matches: List[Dict[str, Any]], top_k: int, chunks_per_document: int,
+             mmr_lambda: Optional[float] = None, metric: str = "cosine") -> List[Dict[str, Any]]:
+    documents = group_matches(matches, chunks_per_document, metric)
+    if mmr_lambda is not None and mmr_lambda < 1:
+        return mmr_select(documents, top_k, mmr_lambda, metric)
+    return documents[:top_k]
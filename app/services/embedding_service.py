@@ -1,18 +1,91 @@
-from openai import OpenAI
-from typing import List
-import time
-from app.configurations.config import OPENAI_API_KEY, OPENAI_EMBEDDING_MODEL
+from typing import List, Optional
+import threading
+from app.configurations.config import (
+    EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_BULK_MAX_ATTEMPTS, EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_TIMEOUT_SECONDS, OPENAI_API_KEY, OPENAI_EMBEDDING_MODEL, RETRY_MAX_ATTEMPTS
+)
+from app.services.executor_service import ExecutorService
+from app.services.metrics_service import (
+    EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_REQUESTS, EMBEDDING_REQUEST_SECONDS, EMBEDDING_RETRIES, EMBEDDING_TOKENS
+)
+from app.services.request_coalescing_service import MicroBatcher
+from app.services.resilience_service import ResilienceService, failure_reason
+from app.services.scheduler_service import PRIORITY_BULK, current_priority
+from app.services.shared_state_service import SharedEmbeddingCache
+
+# Dimensión nativa de cada modelo; los text-embedding-3 admiten vectores más cortos con `dimensions`
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
 
 
 class EmbeddingService:
     def __init__(self):
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self._client = None
+        self._client_lock = threading.Lock()
         self.model = OPENAI_EMBEDDING_MODEL
         self.max_texts_per_batch = 2048
         self.max_chars_per_batch = 750000
+        # Compartida por todos los workers: un texto ya embebido por cualquiera no vuelve a la API
+        self.cache = SharedEmbeddingCache() if EMBEDDING_CACHE_ENABLED else None
+        # Las consultas de búsquedas concurrentes se agrupan en una sola llamada a la API
+        self._query_batcher = MicroBatcher(
+            "query_embedding",
+            self._embed_query_batch,
+            EMBEDDING_BATCH_WINDOW_MS / 1000,
+            EMBEDDING_BATCH_MAX_SIZE
+        )
 
-    def create_embeddings(self, texts: List[str]) -> List[List[float]]:
-        all_embeddings = []
+    @property
+    def client(self):
+        # El SDK de OpenAI se importa en el primer uso para no penalizar el arranque
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    # Los reintentos los gobierna ResilienceService; el SDK no reintenta por su cuenta
+                    self._client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        return self._client
+
+    @property
+    def native_dimension(self) -> int:
+        return MODEL_DIMENSIONS.get(self.model, 1536)
+
+    def supports_dimensions(self) -> bool:
+        return self.model.startswith("text-embedding-3")
+
+    @staticmethod
+    def shorten(embedding: List[float], dimensions: int) -> List[float]:
+        """Recorta un embedding a `dimensions` y lo renormaliza, igual que hace la API con `dimensions`."""
+        import numpy as np
+
+        vector = np.asarray(embedding[:dimensions], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector = vector / norm
+        return vector.tolist()
+
+    def create_embeddings(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        if self.cache is None or not texts:
+            return self._create_embeddings_uncached(texts, dimensions)
+
+        embeddings = self.cache.get_many(self.model, dimensions, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        EMBEDDING_CACHE_REQUESTS.inc(len(texts) - len(missing), result="hit")
+        if missing:
+            EMBEDDING_CACHE_REQUESTS.inc(len(missing), result="miss")
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            created = self._create_embeddings_uncached(missing_texts, dimensions)
+            self.cache.put_many(self.model, dimensions, missing_texts, created)
+            created_by_text = dict(zip(missing_texts, created))
+            for i in missing:
+                embeddings[i] = created_by_text[texts[i]]
+        return embeddings
+
+    def _create_embeddings_uncached(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        batches = []
         current_batch = []
         current_char_count = 0
 
@@ -22,8 +95,7 @@ class EmbeddingService:
             if (current_char_count + char_count > self.max_chars_per_batch or 
                 len(current_batch) >= self.max_texts_per_batch) and current_batch:
                 
-                batch_embeddings = self._get_embeddings_with_retry(current_batch)
-                all_embeddings.extend(batch_embeddings)
+                batches.append(current_batch)
                 
                 current_batch = [text]
                 current_char_count = char_count
@@ -32,27 +104,60 @@ class EmbeddingService:
                 current_char_count += char_count
 
         if current_batch:
-            batch_embeddings = self._get_embeddings_with_retry(current_batch)
-            all_embeddings.extend(batch_embeddings)
+            batches.append(current_batch)
+        
+        # Las llamadas pasan por el pool compartido, que limita la concurrencia global contra la API
+        futures = [
+            ExecutorService.submit(ExecutorService.EMBEDDING, self._get_embeddings_with_retry, batch, dimensions)
+            for batch in batches
+        ]
+        
+        all_embeddings = []
+        for future in futures:
+            all_embeddings.extend(future.result())
             
         return all_embeddings
 
-    def _get_embeddings_with_retry(self, texts: List[str]) -> List[List[float]]:
-        try:
-            return self._create_embeddings_batch(texts)
-        except Exception as e:
-            if "rate limit" in str(e).lower():
-                time.sleep(60)
-                return self._create_embeddings_batch(texts)
-            else:
-                raise e
-    
-    def _create_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        response = self.client.embeddings.create(
-            input=texts,
-            model=self.model
+    def _get_embeddings_with_retry(self, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+        # Backoff exponencial acotado y circuit breaker por modelo, dentro del deadline del request.
+        # La ingesta bulk tolera esperar a que se reponga el cupo, así que tiene más intentos
+        return ResilienceService.call(
+            "openai", self.model, "embedding",
+            lambda timeout: self._create_embeddings_batch(texts, dimensions, timeout),
+            EMBEDDING_TIMEOUT_SECONDS,
+            max_attempts=EMBEDDING_BULK_MAX_ATTEMPTS if current_priority() == PRIORITY_BULK else RETRY_MAX_ATTEMPTS,
+            on_retry=lambda error: EMBEDDING_RETRIES.inc(model=self.model, reason=failure_reason(error))
         )
+    
+    def _create_embeddings_batch(self, texts: List[str], dimensions: Optional[int] = None,
+                                 timeout: float = EMBEDDING_TIMEOUT_SECONDS) -> List[List[float]]:
+        # Solo se pide una dimensión reducida cuando el modelo la admite y es menor que la nativa
+        extra_args = {}
+        if dimensions and self.supports_dimensions() and dimensions < self.native_dimension:
+            extra_args["dimensions"] = dimensions
+        
+        EMBEDDING_BATCH_SIZE.observe(len(texts), model=self.model)
+        with EMBEDDING_REQUEST_SECONDS.time(span="embedding", model=self.model):
+            response = self.client.embeddings.create(
+                input=texts,
+                model=self.model,
+                timeout=timeout,
+                **extra_args
+            )
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            EMBEDDING_TOKENS.inc(usage.total_tokens, model=self.model)
         return [embedding.embedding for embedding in response.data]
     
-    def create_single_embedding(self, text: str) -> List[float]:
-        return self.create_embeddings([text])[0] 
\ No newline at end of file
+    def create_single_embedding(self, text: str, dimensions: Optional[int] = None) -> List[float]:
+        if not text.strip():
+            # La API rechaza textos vacíos; no lo mezclamos con consultas ajenas para no hacer fallar su lote
+            return self.create_embeddings([text], dimensions)[0]
+        return self._query_batcher.submit((self.model, dimensions), [text])[0]
+
+    def _embed_query_batch(self, key, texts: List[str]) -> List[List[float]]:
+        _, dimensions = key
+        # Consultas idénticas dentro de la misma ventana se embeben una sola vez
+        unique_texts = list(dict.fromkeys(texts))
+        embeddings = dict(zip(unique_texts, self.create_embeddings(unique_texts, dimensions)))
+        return [embeddings[text] for text in texts] 
\ No newline at end of file
@@ -0,0 +1,195 @@
+import contextvars
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Hashable, Optional
+
+from app.configurations.config import (
+    DOWNLOAD_MAX_WORKERS, EMBEDDING_INTERACTIVE_RESERVED, EMBEDDING_MAX_CONCURRENCY, LOCAL_REPLICA_BUILD_CONCURRENCY,
+    PARSING_MAX_WORKERS, PROVIDER_READ_MAX_CONCURRENCY, SNAPSHOT_CONCURRENCY, UPLOAD_MAX_CONCURRENCY,
+    UPSERT_MAX_CONCURRENCY
+)
+from app.services.metrics_service import (
+    EXECUTOR_ACTIVE_WORKERS, EXECUTOR_QUEUE_DEPTH, EXECUTOR_QUEUE_WAIT_SECONDS
+)
+from app.services.profiler_service import ProfilerService
+from app.services.scheduler_service import PRIORITIES, PRIORITY_BULK, PRIORITY_INTERACTIVE, current_priority
+
+# Grupo de equidad de la tarea: todas las tareas que nacen de un mismo request comparten grupo
+_request_group: contextvars.ContextVar[Optional[Hashable]] = contextvars.ContextVar("request_group", default=None)
+_group_ids = itertools.count()
+
+
+def current_request_group() -> Hashable:
+    group = _request_group.get()
+    if group is None:
+        group = next(_group_ids)
+        _request_group.set(group)
+    return group
+
+
+class _Task:
+    __slots__ = ("future", "priority", "context", "fn", "args", "kwargs", "enqueued_at")
+
+    def __init__(self, future: Future, priority: str, context: contextvars.Context, fn: Callable, args, kwargs):
+        self.future = future
+        self.priority = priority
+        self.context = context
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued_at = time.perf_counter()
+
+
+class FairExecutor:
+    """Pool de hilos de larga vida, con un límite global y una cola por request servida en round-robin.
+
+    Las tareas interactivas siempre se atienden antes que las bulk, y `reserved_interactive`
+    workers nunca ejecutan trabajo bulk, de modo que una ingesta masiva no agota el cupo de las
+    búsquedas. Dentro de cada clase, un request que encola cientos de tareas no bloquea a los
+    demás: cada worker libre toma la siguiente tarea del siguiente grupo. Los hilos se crean bajo
+    demanda hasta `max_workers`. Las tareas no deben esperar resultados de tareas del mismo pool.
+    """
+
+    def __init__(self, name: str, max_workers: int, reserved_interactive: int = 0):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_bulk_workers = max(1, self.max_workers - reserved_interactive)
+        self._queues: Dict[str, "OrderedDict[Hashable, Deque[_Task]]"] = {
+            priority: OrderedDict() for priority in PRIORITIES
+        }
+        self._condition = threading.Condition()
+        self._threads = []
+        self._idle_workers = 0
+        self._queued = {priority: 0 for priority in PRIORITIES}
+        self._active = {priority: 0 for priority in PRIORITIES}
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        future = Future()
+        group = current_request_group()
+        priority = current_priority()
+        # Las tareas corren con el contexto de quien las encola (trazas, grupo, prioridad)
+        task = _Task(future, priority, contextvars.copy_context(), fn, args, kwargs)
+
+        with self._condition:
+            queues = self._queues[priority]
+            queue = queues.get(group)
+            if queue is None:
+                queue = queues[group] = deque()
+            queue.append(task)
+            self._queued[priority] += 1
+            EXECUTOR_QUEUE_DEPTH.set(self._queued[priority], pool=self.name, priority=priority)
+            if sum(self._queued.values()) > self._idle_workers and len(self._threads) < self.max_workers:
+                self._start_worker()
+            self._condition.notify()
+        return future
+
+    def _start_worker(self):
+        thread = threading.Thread(
+            target=self._worker, name=f"{self.name}-worker-{len(self._threads)}", daemon=True
+        )
+        self._threads.append(thread)
+        thread.start()
+
+    def _next_task(self) -> Optional[_Task]:
+        if self._queues[PRIORITY_INTERACTIVE]:
+            priority = PRIORITY_INTERACTIVE
+        elif self._queues[PRIORITY_BULK] and self._active[PRIORITY_BULK] < self.max_bulk_workers:
+            priority = PRIORITY_BULK
+        else:
+            return None
+
+        queues = self._queues[priority]
+        group, queue = next(iter(queues.items()))
+        task = queue.popleft()
+        if queue:
+            queues.move_to_end(group)
+        else:
+            del queues[group]
+        return task
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                self._idle_workers += 1
+                task = self._next_task()
+                while task is None:
+                    self._condition.wait()
+                    task = self._next_task()
+                self._idle_workers -= 1
+                self._queued[task.priority] -= 1
+                self._active[task.priority] += 1
+                EXECUTOR_QUEUE_DEPTH.set(self._queued[task.priority], pool=self.name, priority=task.priority)
+                EXECUTOR_ACTIVE_WORKERS.set(self._active[task.priority], pool=self.name, priority=task.priority)
+
+            EXECUTOR_QUEUE_WAIT_SECONDS.observe(
+                time.perf_counter() - task.enqueued_at, pool=self.name, priority=task.priority
+            )
+            if task.future.set_running_or_notify_cancel():
+                # Si quien encoló la tarea se está perfilando, este worker cuenta para su perfil
+                profile_binding = ProfilerService.bind_task(task.context)
+                try:
+                    result = task.context.run(task.fn, *task.args, **task.kwargs)
+                except BaseException as e:
+                    task.future.set_exception(e)
+                else:
+                    task.future.set_result(result)
+                finally:
+                    ProfilerService.unbind_task(profile_binding)
+            priority = task.priority
+            task = None
+
+            with self._condition:
+                self._active[priority] -= 1
+                EXECUTOR_ACTIVE_WORKERS.set(self._active[priority], pool=self.name, priority=priority)
+                # Al liberarse un hueco bulk, un worker ocioso puede tomar la tarea bulk que esperaba
+                if priority == PRIORITY_BULK and self._queues[PRIORITY_BULK]:
+                    self._condition.notify()
+
+
+class ExecutorService:
+    """Pools compartidos por proceso, uno por recurso, con límites globales de concurrencia."""
+
+    DOWNLOAD = "download"
+    PARSING = "parsing"
+    EMBEDDING = "embedding"
+    UPSERT = "upsert"
+    PROVIDER_READ = "provider_read"
+    REPLICA = "replica"
+    SNAPSHOT = "snapshot"
+    UPLOAD = "upload"
+
+    _limits = {
+        DOWNLOAD: DOWNLOAD_MAX_WORKERS,
+        PARSING: PARSING_MAX_WORKERS,
+        EMBEDDING: EMBEDDING_MAX_CONCURRENCY,
+        UPSERT: UPSERT_MAX_CONCURRENCY,
+        PROVIDER_READ: PROVIDER_READ_MAX_CONCURRENCY,
+        REPLICA: LOCAL_REPLICA_BUILD_CONCURRENCY,
+        SNAPSHOT: SNAPSHOT_CONCURRENCY,
+        UPLOAD: UPLOAD_MAX_CONCURRENCY,
+    }
+    _reserved_interactive = {
+        EMBEDDING: EMBEDDING_INTERACTIVE_RESERVED,
+    }
+    _executors: Dict[str, FairExecutor] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(name: str) -> FairExecutor:
+        executor = ExecutorService._executors.get(name)
+        if executor is None:
+            with ExecutorService._lock:
+                executor = ExecutorService._executors.get(name)
+                if executor is None:
+                    executor = FairExecutor(
+                        name, ExecutorService._limits[name], ExecutorService._reserved_interactive.get(name, 0)
+                    )
+                    ExecutorService._executors[name] = executor
+        return executor
+
+    @staticmethod
+    def submit(name: str, fn: Callable, *args, **kwargs) -> Future:
+        return ExecutorService.get(name).submit(fn, *args, **kwargs)
@@ -1,11 +1,28 @@
-import csv
 import inspect
-import requests
+import io
+import logging
+import queue
 import tempfile
+import threading
+import time
 import os
-from typing import List, Dict, Any, Generator
+from typing import List, Dict, Any, BinaryIO, Generator, Iterable, Iterator, Optional
 from urllib.parse import urlparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
+
+from app.models.columnar_batch import ColumnarBatch
+from app.models.models import StructuredIngestionConfig
+from app.services.executor_service import ExecutorService
+from app.services.html_extractor_service import HtmlExtractorService
+from app.services.metrics_service import (
+    FILE_DOWNLOAD_BYTES, FILE_DOWNLOAD_SECONDS, FILE_DOWNLOAD_SIZE, FILE_EXTRACTION_SECONDS,
+    FILE_PROCESSING_FAILURES, record_span
+)
+from app.services.structured_file_service import StructuredFileService
+
+logger = logging.getLogger(__name__)
+
+_END_OF_BATCHES = object()
 
 
 class FileProcessorService:
@@ -13,49 +30,116 @@ class FileProcessorService:
         self.supported_extensions = {'.txt', '.md', '.pdf', '.docx', '.html', '.csv', '.jsonl'}
         self.max_file_size = 50 * 1024 * 1024  # 50MB
         self.timeout = 30
+        # CSV/JSONL se leen en streaming como lotes columnares en lugar de materializarse
+        self.structured_extensions = {'.csv', '.jsonl'}
+        self.structured_file_service = StructuredFileService()
+        # Formatos de texto plano que se extraen línea a línea
+        self.text_extensions = {'.txt', '.md', '.html'}
+        self.html_extractor = HtmlExtractorService()
     
-    def process_file_urls_to_records(self, file_urls: List[str], base_record_id: str, base_metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def process_file_urls_to_records(self, file_urls: List[str], base_record_id: str, base_metadata: Dict[str, Any],
+                                     ingestion: Optional[StructuredIngestionConfig] = None) -> List[Dict[str, Any]]:
         if not file_urls:
             return []
         
         file_records = []
         
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_url = {
-                executor.submit(self._download_and_process_file, url): url 
-                for url in file_urls
-            }
-            
-            for future in as_completed(future_to_url):
-                url = future_to_url[future]
-                try:
-                    content, metadata = future.result()
-                    if content:
-                        file_key = self._generate_file_key(url)
-                        file_records.append({
-                            "id": f"{base_record_id}_{file_key}",
-                            "data": {
-                                "text": content,
-                                "source_url": url
-                            },
-                            "metadata": {
-                                **base_metadata,
-                                "source": "file_url",
-                                "source_url": url,
-                                "file_type": metadata["file_type"],
-                                "original_record_id": base_record_id
-                            }
-                        })
-                except Exception as e:
-                    print(f"Error processing {url}: {e}")
+        # Descarga y extracción usan pools compartidos distintos, así cada etapa tiene su propio límite global
+        download_futures = {
+            ExecutorService.submit(ExecutorService.DOWNLOAD, self._download_file, url): url
+            for url in file_urls
+        }
+        
+        process_futures = {}
+        for future in as_completed(download_futures):
+            url = download_futures[future]
+            try:
+                temp_file_path, metadata = future.result()
+            except Exception as e:
+                FILE_PROCESSING_FAILURES.inc()
+                logger.warning("Error processing %s: %s", url, e)
+                continue
+            process_future = ExecutorService.submit(
+                ExecutorService.PARSING, self._process_downloaded_file, temp_file_path, metadata, ingestion
+            )
+            process_futures[process_future] = url
+        
+        for future in as_completed(process_futures):
+            url = process_futures[future]
+            try:
+                content, metadata = future.result()
+                if content:
+                    file_records.append(self._build_file_record(
+                        base_record_id, base_metadata, self._generate_file_key(url), metadata["file_type"],
+                        content, "file_url", {"source_url": url}
+                    ))
+            except Exception as e:
+                FILE_PROCESSING_FAILURES.inc()
+                logger.warning("Error processing %s: %s", url, e)
         
         return file_records
     
-    def _download_and_process_file(self, url: str) -> tuple[str, Dict[str, Any]]:
+    def detect_file_extension(self, file_name: str, content_type: str) -> str:
+        content_type = content_type.split(';')[0].strip().lower()
+        file_extension = self._get_file_extension(file_name, content_type)
+        if file_extension not in self.supported_extensions:
+            raise ValueError(f"Unsupported file type: {file_extension}")
+        return file_extension
+    
+    def process_stream_to_record(self, stream: BinaryIO, file_name: str, file_extension: str, base_record_id: str,
+                                 base_metadata: Dict[str, Any],
+                                 ingestion: Optional[StructuredIngestionConfig] = None) -> Dict[str, Any]:
+        """Extrae el contenido de un archivo subido leyendo directamente de `stream`, sin archivo temporal.
+        
+        Los formatos de texto se consumen línea a línea a medida que llegan; CSV/JSONL devuelven el
+        generador de lotes, que sigue leyendo de `stream` mientras el proveedor lo consume. Texto,
+        HTML, PDF y DOCX se embeben como un único documento, así que su texto extraído queda completo
+        en memoria: el receptor de la subida los limita a UPLOAD_MAX_TEXT_FILE_BYTES.
+        """
+        if file_extension in self.structured_extensions:
+            lines = io.TextIOWrapper(stream, encoding='utf-8', errors='ignore', newline='')
+            batches = self.structured_file_service.read_batches(lines, file_extension, ingestion)
+            content = self._timed_batches(batches, file_extension)
+        else:
+            with FILE_EXTRACTION_SECONDS.time(span="extract", file_type=file_extension):
+                if file_extension in self.text_extensions:
+                    lines = io.TextIOWrapper(stream, encoding='utf-8', errors='ignore')
+                    content = list(self._extract_text_lines(lines, file_extension, file_name))
+                else:
+                    content = self._extract_binary_content(stream, file_extension)
+        
+        return self._build_file_record(
+            base_record_id, base_metadata, self._file_key_from_name(file_name), file_extension,
+            content, "upload", {"file_name": file_name}
+        )
+    
+    def _build_file_record(self, base_record_id: str, base_metadata: Dict[str, Any], file_key: str,
+                           file_type: str, content: Any, source: str, source_fields: Dict[str, str]) -> Dict[str, Any]:
+        # Los archivos estructurados viajan como generador de lotes en "rows"
+        content_key = "rows" if file_type in self.structured_extensions else "text"
+        return {
+            "id": f"{base_record_id}_{file_key}",
+            "data": {
+                content_key: content,
+                **source_fields
+            },
+            "metadata": {
+                **base_metadata,
+                "source": source,
+                **source_fields,
+                "file_type": file_type,
+                "original_record_id": base_record_id
+            }
+        }
+    
+    def _download_file(self, url: str) -> tuple[str, Dict[str, Any]]:
         try:
             # Convertir enlaces de Google Drive a enlaces de descarga directa
             url = self._convert_google_drive_url(url)
             
+            import requests
+            
+            download_start = time.perf_counter()
             response = requests.get(url, timeout=self.timeout, stream=True)
             response.raise_for_status()
             
@@ -75,31 +159,52 @@ class FileProcessorService:
             if file_extension not in self.supported_extensions:
                 raise ValueError(f"Unsupported file type: {file_extension}")
             
+            downloaded_bytes = 0
             with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
                 for chunk in response.iter_content(chunk_size=8192):
                     temp_file.write(chunk)
+                    downloaded_bytes += len(chunk)
                 temp_file_path = temp_file.name
             
-            try:
-                content = self._extract_content(temp_file_path, file_extension)
+            download_seconds = time.perf_counter() - download_start
+            FILE_DOWNLOAD_SECONDS.observe(download_seconds, file_type=file_extension)
+            FILE_DOWNLOAD_BYTES.inc(downloaded_bytes, file_type=file_extension)
+            FILE_DOWNLOAD_SIZE.observe(downloaded_bytes, file_type=file_extension)
+            record_span("download", download_seconds)
+            
+            metadata = {
+                "url": url,
+                "file_type": file_extension,
+                "content_type": content_type
+            }
+            
+            return temp_file_path, metadata
+                
+        except Exception as e:
+            raise Exception(f"Failed to process file {url}: {str(e)}")
+    
+    def _process_downloaded_file(self, temp_file_path: str, metadata: Dict[str, Any],
+                                 ingestion: Optional[StructuredIngestionConfig] = None) -> tuple[Any, Dict[str, Any]]:
+        file_extension = metadata["file_type"]
+        
+        if file_extension in self.structured_extensions:
+            # El generador es dueño del archivo temporal abierto; el parseo corre en el pool PARSING
+            return self._stream_structured_file(temp_file_path, file_extension, ingestion), metadata
+        
+        try:
+            with FILE_EXTRACTION_SECONDS.time(span="extract", file_type=file_extension):
+                content = self._extract_content(temp_file_path, file_extension, metadata["url"])
                 
                 # Si content es un generador, lo procesamos inmediatamente para evitar
                 # que el archivo temporal se elimine antes de poder leerlo
                 if inspect.isgenerator(content):
                     content = list(content)  # Convertir generador a lista
-                
-                metadata = {
-                    "url": url,
-                    "file_type": file_extension,
-                    "content_type": content_type
-                }
-                
-                return content, metadata
-            finally:
-                os.unlink(temp_file_path)
-                
+            
+            return content, metadata
         except Exception as e:
-            raise Exception(f"Failed to process file {url}: {str(e)}")
+            raise Exception(f"Failed to process file {metadata['url']}: {str(e)}")
+        finally:
+            os.unlink(temp_file_path)
     
     def _get_file_extension(self, url: str, content_type: str) -> str:
         parsed_url = urlparse(url)
@@ -120,25 +225,31 @@ class FileProcessorService:
         
         return content_type_mapping.get(content_type, '.txt')
     
-    def _extract_content(self, file_path: str, file_extension: str) -> str:
-        if file_extension in {'.txt', '.md', '.html', '.jsonl'}:
+    def _extract_content(self, file_path: str, file_extension: str, source: str = "") -> str:
+        if file_extension == '.html':
+            return self._read_html(file_path, source)
+        
+        if file_extension in self.text_extensions:
             return self._read_text_in_chunks(file_path)
         
-        elif file_extension == '.pdf':
+        with open(file_path, 'rb') as f:
+            return self._extract_binary_content(f, file_extension)
+    
+    def _extract_binary_content(self, f: BinaryIO, file_extension: str) -> str:
+        if file_extension == '.pdf':
             try:
                 import PyPDF2
-                with open(file_path, 'rb') as f:
-                    reader = PyPDF2.PdfReader(f)
-                    text = ""
-                    page_texts = []
-                    
-                    for page_num, page in enumerate(reader.pages):
-                        page_text = page.extract_text()
-                        if page_text.strip():
-                            page_texts.append(f"[Página {page_num + 1}]\n{page_text}")
-                    
-                    text = "\n\n".join(page_texts)
-                    return self._post_process_pdf_text(text)
+                reader = PyPDF2.PdfReader(f)
+                text = ""
+                page_texts = []
+                
+                for page_num, page in enumerate(reader.pages):
+                    page_text = page.extract_text()
+                    if page_text.strip():
+                        page_texts.append(f"[Página {page_num + 1}]\n{page_text}")
+                
+                text = "\n\n".join(page_texts)
+                return self._post_process_pdf_text(text)
             except ImportError:
                 raise ImportError("PyPDF2 is required for PDF processing. Install with: pip install PyPDF2")
         
@@ -146,7 +257,7 @@ class FileProcessorService:
             # python-docx también maneja bien la memoria
             try:
                 from docx import Document
-                doc = Document(file_path)
+                doc = Document(f)
                 text = ""
                 for paragraph in doc.paragraphs:
                     text += paragraph.text + "\n"
@@ -154,63 +265,107 @@ class FileProcessorService:
             except ImportError:
                 raise ImportError("python-docx is required for DOCX processing. Install with: pip install python-docx")
         
-        elif file_extension == '.csv':
-            # Para CSVs grandes, no leemos todo a memoria
-            # Devolvemos un generador que procesa el archivo en chunks
-            return self._read_csv_in_chunks(file_path)
-            
         else:
             raise ValueError(f"Unsupported file extension: {file_extension}")
             
     def _read_text_in_chunks(self, file_path: str, chunk_size_lines: int = 500):
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            chunk = []
-            for i, line in enumerate(f):
-                chunk.append(line)
-                if (i + 1) % chunk_size_lines == 0:
-                    yield "".join(chunk)
-                    chunk = []
-            if chunk:
-                yield "".join(chunk)
-            
-    def _read_csv_in_chunks(self, file_path: str, chunk_size_rows: int = 50, max_chunk_chars: int = 30000):
+            yield from self._chunk_lines(f, chunk_size_lines)
+    
+    def _read_html(self, file_path: str, source: str = ""):
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            reader = csv.DictReader(f, delimiter=';')
-            chunk_rows_data = []
-            current_chunk_size = 0
+            yield from self.html_extractor.extract(f, source)
+    
+    def _extract_text_lines(self, lines: Iterable[str], file_extension: str, source: str = "") -> Iterator[str]:
+        if file_extension == '.html':
+            return self.html_extractor.extract(lines, source)
+        return self._chunk_lines(lines)
+    
+    def _chunk_lines(self, lines: Iterable[str], chunk_size_lines: int = 500) -> Iterator[str]:
+        chunk = []
+        for i, line in enumerate(lines):
+            chunk.append(line)
+            if (i + 1) % chunk_size_lines == 0:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
             
-            # Columnas clave para el texto del embedding (puedes ajustarlas)
-            key_columns_for_embedding = ['Status', 'Name', 'Lastname', 'Startup', 'Email', 'Call']
+    def _stream_structured_file(self, file_path: str, file_extension: str,
+                                ingestion: Optional[StructuredIngestionConfig]) -> Iterator[ColumnarBatch]:
+        # Se abre ahora y se borra la ruta enseguida: el espacio se libera al cerrar el archivo, aunque
+        # el generador nunca llegue a recorrerse (el GC cierra el descriptor)
+        try:
+            f = open(file_path, 'r', encoding='utf-8', errors='ignore', newline='')
+        finally:
+            os.unlink(file_path)
+        return self._parse_in_pool(self._read_structured_batches(f, file_extension, ingestion))
+    
+    def _read_structured_batches(self, f, file_extension: str,
+                                 ingestion: Optional[StructuredIngestionConfig]) -> Iterator[ColumnarBatch]:
+        with f:
+            batches = self.structured_file_service.read_batches(f, file_extension, ingestion)
+            yield from self._timed_batches(batches, file_extension)
+    
+    def _parse_in_pool(self, batches: Iterator[ColumnarBatch], max_pending: int = 2) -> Iterator[ColumnarBatch]:
+        """Parsea `batches` en el pool PARSING y entrega los lotes por una cola acotada.
 
-            for row in reader:
-                # 1. Crear el texto para el embedding (corto y conciso)
-                embedding_values = [str(row.get(col, '')) for col in key_columns_for_embedding if row.get(col)]
-                embedding_text = " | ".join(embedding_values)
-                row_size = len(embedding_text)
+        El parseo arranca recién con el primer `next`, así un request con varios archivos ocupa un
+        solo worker a la vez; si el consumidor abandona el generador, el productor se detiene.
+        """
+        handoff: queue.Queue = queue.Queue(max_pending)
+        stop = threading.Event()
 
-                # 2. Guardar la fila completa como metadatos
-                full_metadata = {k: v for k, v in row.items() if v is not None}
-                
-                # Si agregar esta fila excede los límites, enviar el chunk actual
-                if (len(chunk_rows_data) >= chunk_size_rows or 
-                    current_chunk_size + row_size > max_chunk_chars) and chunk_rows_data:
-                    
-                    yield chunk_rows_data
-                    chunk_rows_data = []
-                    current_chunk_size = 0
-                
-                chunk_rows_data.append({
-                    "text": embedding_text,
-                    "metadata": full_metadata
-                })
-                current_chunk_size += row_size + 1
-            
-            if chunk_rows_data:
-                yield chunk_rows_data
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    handoff.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in batches:
+                    if not put(batch):
+                        return
+                put(_END_OF_BATCHES)
+            except BaseException as e:
+                put(e)
+            finally:
+                batches.close()
+
+        ExecutorService.submit(ExecutorService.PARSING, produce)
+        try:
+            while True:
+                item = handoff.get()
+                if item is _END_OF_BATCHES:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def _timed_batches(self, batches: Iterator[ColumnarBatch], file_extension: str) -> Iterator[ColumnarBatch]:
+        # Solo cuenta el tiempo de parseo, no el que el consumidor pasa embebiendo cada lote
+        parse_seconds = 0.0
+        while True:
+            start = time.perf_counter()
+            batch = next(batches, None)
+            parse_seconds += time.perf_counter() - start
+            if batch is None:
+                break
+            yield batch
+        FILE_EXTRACTION_SECONDS.observe(parse_seconds, file_type=file_extension)
     
     def _generate_file_key(self, url: str) -> str:
         parsed_url = urlparse(url)
-        filename = os.path.basename(parsed_url.path) or "file"
+        return self._file_key_from_name(parsed_url.path)
+    
+    def _file_key_from_name(self, file_name: str) -> str:
+        filename = os.path.basename(file_name) or "file"
         name_without_ext = os.path.splitext(filename)[0]
         return f"{name_without_ext}_content"
     
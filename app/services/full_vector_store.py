@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+from app.configurations.config import FULL_VECTOR_STORE_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class FullVectorStore:
+    """Vectores de dimensión completa de los índices two-stage, en SQLite como float32.
+
+    El índice de Pinecone guarda solo la versión recortada; aquí quedan los vectores completos para
+    re-puntuar candidatos, junto con el registro de qué índices son two-stage. Las columnas
+    original_id/original_record_id permiten aplicar el mismo borrado por documento que en Pinecone.
+
+    También guarda las referencias de la deduplicación en modo `reference`: chunks duplicados que
+    no se suben al índice y se guardan solo con su metadata y el ID del canónico.
+
+    Es un archivo local: lo comparten los workers de un mismo host, pero no varios nodos. Con más de
+    un nodo los índices two-stage y las referencias solo existen en el nodo que los escribió.
+    """
+
+    def __init__(self, path: str = FULL_VECTOR_STORE_PATH):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            with self._lock:
+                if self._connection is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+                    journal_mode = connection.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+                    if journal_mode.lower() != "wal":
+                        # Sin WAL (p. ej. en un sistema de archivos de red) los workers se bloquean entre sí
+                        logger.warning(
+                            "Full vector store at %s is not in WAL mode (%s); keep it on a local filesystem",
+                            self.path, journal_mode
+                        )
+                    connection.execute("PRAGMA synchronous=NORMAL")
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS two_stage_indexes ("
+                        "index_name TEXT PRIMARY KEY, full_dimension INTEGER NOT NULL)"
+                    )
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS vectors ("
+                        "index_name TEXT NOT NULL, namespace TEXT NOT NULL, id TEXT NOT NULL, "
+                        "original_id TEXT, original_record_id TEXT, vector BLOB NOT NULL, "
+                        "PRIMARY KEY (index_name, namespace, id)) WITHOUT ROWID"
+                    )
+                    connection.execute(
+                        "CREATE INDEX IF NOT EXISTS vectors_original_id ON vectors (index_name, namespace, original_id)"
+                    )
+                    connection.execute(
+                        "CREATE INDEX IF NOT EXISTS vectors_original_record_id "
+                        "ON vectors (index_name, namespace, original_record_id)"
+                    )
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS chunk_references ("
+                        "index_name TEXT NOT NULL, namespace TEXT NOT NULL, id TEXT NOT NULL, "
+                        "duplicate_of TEXT NOT NULL, original_id TEXT, original_record_id TEXT, metadata TEXT NOT NULL, "
+                        "PRIMARY KEY (index_name, namespace, id)) WITHOUT ROWID"
+                    )
+                    connection.execute(
+                        "CREATE INDEX IF NOT EXISTS chunk_references_original_id "
+                        "ON chunk_references (index_name, namespace, original_id)"
+                    )
+                    connection.execute(
+                        "CREATE INDEX IF NOT EXISTS chunk_references_original_record_id "
+                        "ON chunk_references (index_name, namespace, original_record_id)"
+                    )
+                    connection.commit()
+                    self._connection = connection
+        return self._connection
+
+    def check(self):
+        """Comprobación de arranque: abre (o crea) la base y avisa si hay índices two-stage registrados."""
+        count = self.connection.execute("SELECT COUNT(*) FROM two_stage_indexes").fetchone()[0]
+        if count:
+            logger.info(
+                "Full vector store at %s holds %d two-stage index(es); it is local to this node", self.path, count
+            )
+
+    def register_index(self, index_name: str, full_dimension: int):
+        # La conexión se abre fuera del lock: su inicialización también lo toma
+        connection = self.connection
+        with self._lock:
+            connection.execute(
+                "INSERT OR REPLACE INTO two_stage_indexes (index_name, full_dimension) VALUES (?, ?)",
+                (index_name, full_dimension)
+            )
+            connection.commit()
+
+    def get_full_dimension(self, index_name: str) -> Optional[int]:
+        connection = self.connection
+        with self._lock:
+            row = connection.execute(
+                "SELECT full_dimension FROM two_stage_indexes WHERE index_name = ?", (index_name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, index_name: str, namespace: str, vectors: List[Dict[str, Any]]):
+        import numpy as np
+
+        connection = self.connection
+        rows = [
+            (
+                index_name, namespace, vector["id"],
+                vector["metadata"].get("original_id"), vector["metadata"].get("original_record_id"),
+                np.asarray(vector["values"], dtype=np.float32).tobytes()
+            )
+            for vector in vectors
+        ]
+        with self._lock:
+            connection.executemany(
+                "INSERT OR REPLACE INTO vectors "
+                "(index_name, namespace, id, original_id, original_record_id, vector) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            connection.commit()
+
+    def get(self, index_name: str, namespace: str, ids: List[str]) -> Dict[str, Any]:
+        """Devuelve id -> vector numpy float32 para los ids presentes."""
+        import numpy as np
+
+        connection = self.connection
+        results = {}
+        # SQLite limita la cantidad de parámetros por consulta
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = connection.execute(
+                    f"SELECT id, vector FROM vectors WHERE index_name = ? AND namespace = ? AND id IN ({placeholders})",
+                    (index_name, namespace, *batch)
+                ).fetchall()
+            for vector_id, blob in rows:
+                results[vector_id] = np.frombuffer(blob, dtype=np.float32)
+        return results
+
+    def delete_documents(self, index_name: str, namespace: str, original_ids: List[str], table: str = "vectors"):
+        connection = self.connection
+        with self._lock:
+            for i in range(0, len(original_ids), 400):
+                batch = original_ids[i:i + 400]
+                placeholders = ",".join("?" * len(batch))
+                connection.execute(
+                    f"DELETE FROM {table} WHERE index_name = ? AND namespace = ? "
+                    f"AND (original_id IN ({placeholders}) OR original_record_id IN ({placeholders}))",
+                    (index_name, namespace, *batch, *batch)
+                )
+            connection.commit()
+
+    def put_references(self, index_name: str, namespace: str, references: List[Dict[str, Any]]):
+        """Guarda chunks duplicados (id + metadata con "text" y "duplicate_of") sin vector propio."""
+        if not references:
+            return
+        connection = self.connection
+        rows = [
+            (
+                index_name, namespace, reference["id"], reference["metadata"]["duplicate_of"],
+                reference["metadata"].get("original_id"), reference["metadata"].get("original_record_id"),
+                json.dumps(reference["metadata"], default=str)
+            )
+            for reference in references
+        ]
+        with self._lock:
+            connection.executemany(
+                "INSERT OR REPLACE INTO chunk_references "
+                "(index_name, namespace, id, duplicate_of, original_id, original_record_id, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            connection.commit()
+
+    def get_references(self, index_name: str, namespace: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Devuelve id -> metadata (con "duplicate_of") de las referencias presentes."""
+        connection = self.connection
+        results = {}
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = connection.execute(
+                    f"SELECT id, metadata FROM chunk_references "
+                    f"WHERE index_name = ? AND namespace = ? AND id IN ({placeholders})",
+                    (index_name, namespace, *batch)
+                ).fetchall()
+            for reference_id, metadata in rows:
+                results[reference_id] = json.loads(metadata)
+        return results
+
+    def delete_references(self, index_name: str, namespace: str, original_ids: List[str]):
+        self.delete_documents(index_name, namespace, original_ids, table="chunk_references")
@@ -0,0 +1,212 @@
+import logging
+import re
+import threading
+from html.parser import HTMLParser
+from typing import Iterable, Iterator, List, Tuple
+
+from app.services.metrics_service import HTML_EXTRACTION_TOKENS, HTML_TOKEN_REDUCTION
+
+logger = logging.getLogger(__name__)
+
+# Contenido que nunca aporta texto útil: código, estilos y navegación del sitio
+SKIP_TAGS = {
+    'script', 'style', 'noscript', 'template', 'svg', 'canvas', 'iframe', 'object',
+    'nav', 'footer', 'aside', 'form', 'button', 'select', 'textarea'
+}
+# Encabezados y bloques se convierten en límites de párrafo para _smart_split_text
+PARAGRAPH_TAGS = {
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'title', 'p', 'div', 'section', 'article', 'main', 'header',
+    'blockquote', 'pre', 'ul', 'ol', 'dl', 'table', 'figure', 'figcaption', 'details', 'summary', 'hr'
+}
+LINE_TAGS = {'br', 'li', 'dt', 'dd', 'tr', 'caption'}
+CELL_TAGS = {'td', 'th'}
+# Su texto conserva espacios, saltos e indentación tal cual
+PREFORMATTED_TAGS = {'pre', 'code'}
+
+# Fuerza de cada separador, para quedarse con uno solo entre etiquetas contiguas
+_SEPARATORS = {' ': 0, '\n': 1, '\n\n': 2}
+
+_WHITESPACE = re.compile(r'\s+')
+_EXTRA_SPACES = re.compile(r' {2,}')
+_SPACES_AROUND_NEWLINE = re.compile(r'[ \t]*\n[ \t]*')
+_EXTRA_NEWLINES = re.compile(r'\n{3,}')
+
+
+class _HtmlTextParser(HTMLParser):
+    """Parser incremental que acumula solo el texto visible, con los límites de bloque como saltos de línea.
+
+    Cada trozo se guarda con una marca de preformateado; `take` corta en el último límite de párrafo
+    registrado sin volver a recorrer el texto acumulado, así que el costo total es lineal.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[Tuple[str, bool]] = []
+        # Posición en `parts` del último límite de párrafo, o -1 si no hay ninguno pendiente
+        self._last_paragraph = -1
+        self._skip_depth = 0
+        self._pre_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif not self._skip_depth:
+            self._boundary(tag)
+            if tag in PREFORMATTED_TAGS:
+                self._pre_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in SKIP_TAGS and not self._skip_depth:
+            self._boundary(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            if self._skip_depth:
+                self._skip_depth -= 1
+        elif not self._skip_depth:
+            if tag in PREFORMATTED_TAGS and self._pre_depth:
+                self._pre_depth -= 1
+            self._boundary(tag)
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._pre_depth:
+            self.parts.append((data, True))
+        else:
+            self.parts.append((_WHITESPACE.sub(' ', data), False))
+
+    def _boundary(self, tag: str):
+        if tag in PARAGRAPH_TAGS:
+            separator = '\n\n'
+        elif tag in LINE_TAGS:
+            separator = '\n'
+        elif tag in CELL_TAGS:
+            separator = ' '
+        else:
+            return
+        if tag != 'br':
+            # Etiquetas contiguas (</li><li>, </td> <td>) dejan un solo separador, el más fuerte;
+            # cada <br> sí cuenta, para que <br><br> siga siendo un párrafo
+            while self.parts and not self.parts[-1][1] and self.parts[-1][0] in _SEPARATORS:
+                last = self.parts.pop()[0]
+                if _SEPARATORS[last] > _SEPARATORS[separator]:
+                    separator = last
+        if separator == '\n\n':
+            self._last_paragraph = len(self.parts)
+        self.parts.append((separator, False))
+
+    def take(self, final: bool = False) -> str:
+        """Devuelve el texto hasta el último límite de párrafo completo y conserva el resto."""
+        if final:
+            parts, self.parts = self.parts, []
+        elif self._last_paragraph == -1:
+            return ''
+        else:
+            cut = self._last_paragraph
+            parts, self.parts = self.parts[:cut], self.parts[cut:]
+        self._last_paragraph = -1
+        return self._render(parts)
+
+    @staticmethod
+    def _render(parts: List[Tuple[str, bool]]) -> str:
+        # Los espacios y saltos se normalizan solo fuera de pre/code
+        segments: List[Tuple[List[str], bool]] = []
+        for text, preformatted in parts:
+            if segments and segments[-1][1] == preformatted:
+                segments[-1][0].append(text)
+            else:
+                segments.append(([text], preformatted))
+
+        rendered = []
+        for i, (texts, preformatted) in enumerate(segments):
+            text = ''.join(texts)
+            if preformatted:
+                # Los saltos en los bordes de pre/code los aportan los separadores de bloque, igual que fuera
+                text = text.strip('\n')
+            else:
+                # Un espacio partido entre dos trozos de entrada llega como dos espacios
+                text = _EXTRA_NEWLINES.sub('\n\n', _SPACES_AROUND_NEWLINE.sub('\n', _EXTRA_SPACES.sub(' ', text)))
+                if i == 0:
+                    text = text.lstrip()
+                if i == len(segments) - 1:
+                    text = text.rstrip()
+            rendered.append(text)
+        return ''.join(rendered)
+
+
+class HtmlExtractorService:
+    _encoding = None
+    _encoding_loaded = False
+    _encoding_lock = threading.Lock()
+
+    def __init__(self, max_piece_chars: int = 50000):
+        self.max_piece_chars = max_piece_chars
+
+    def extract(self, chunks: Iterable[str], source: str = "") -> Iterator[str]:
+        """Extrae el texto visible de un HTML leído por trozos, en piezas que terminan en límite de párrafo.
+
+        Descarta scripts, estilos y navegación; registra cuántos tokens se ahorran frente al HTML crudo.
+        """
+        parser = _HtmlTextParser()
+        raw_tokens = 0.0
+        text_tokens = 0.0
+        pending: List[str] = []
+        pending_chars = 0
+
+        for chunk in chunks:
+            raw_tokens += self._estimate_tokens(chunk)
+            parser.feed(chunk)
+            text = parser.take()
+            if text:
+                pending.append(text)
+                pending_chars += len(text)
+            if pending_chars >= self.max_piece_chars:
+                piece = '\n\n'.join(pending)
+                text_tokens += self._estimate_tokens(piece)
+                yield piece
+                pending = []
+                pending_chars = 0
+
+        parser.close()
+        text = parser.take(final=True)
+        if text:
+            pending.append(text)
+        if pending:
+            piece = '\n\n'.join(pending)
+            text_tokens += self._estimate_tokens(piece)
+            yield piece
+
+        self._record_reduction(source, raw_tokens, text_tokens)
+
+    def _record_reduction(self, source: str, raw_tokens: float, text_tokens: float):
+        HTML_EXTRACTION_TOKENS.inc(raw_tokens, stage="raw")
+        HTML_EXTRACTION_TOKENS.inc(text_tokens, stage="extracted")
+        if raw_tokens:
+            reduction = 1 - text_tokens / raw_tokens
+            HTML_TOKEN_REDUCTION.observe(reduction)
+            logger.info(
+                "HTML %s: %d tokens -> %d tokens (%.0f%% menos)",
+                source or "sin nombre", raw_tokens, text_tokens, reduction * 100
+            )
+
+    def _estimate_tokens(self, text: str) -> float:
+        encoding = self._get_encoding()
+        if encoding is None:
+            # Sin tiktoken se usa la aproximación habitual de ~4 caracteres por token
+            return len(text) / 4
+        return len(encoding.encode(text, disallowed_special=()))
+
+    @classmethod
+    def _get_encoding(cls):
+        # tiktoken es opcional; se intenta cargar una sola vez por proceso
+        if not cls._encoding_loaded:
+            with cls._encoding_lock:
+                if not cls._encoding_loaded:
+                    try:
+                        import tiktoken
+                        cls._encoding = tiktoken.get_encoding("cl100k_base")
+                    except Exception:
+                        cls._encoding = None
+                    cls._encoding_loaded = True
+        return cls._encoding
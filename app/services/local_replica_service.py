@@ -0,0 +1,540 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.configurations.config import (
+    LOCAL_REPLICA_ENABLED, LOCAL_REPLICA_HOT_QUERIES, LOCAL_REPLICA_HOT_WINDOW_SECONDS, LOCAL_REPLICA_MAX_AGE_SECONDS,
+    LOCAL_REPLICA_MEMORY_MB, SHARED_STATE_ENABLED
+)
+from app.models.index_profile import IndexProfile
+from app.services.executor_service import ExecutorService
+from app.services.metrics_service import (
+    LOCAL_REPLICA_BUILD_SECONDS, LOCAL_REPLICA_BYTES, LOCAL_REPLICA_EVICTIONS, LOCAL_REPLICA_NAMESPACES,
+    LOCAL_REPLICA_REQUESTS, LOCAL_REPLICA_SEGMENT_LOADS, SEARCH_SECONDS
+)
+from app.services.scheduler_service import PRIORITY_BULK, priority_scope
+from app.services.shared_state_service import ReplicaSegments, SharedGenerations
+
+logger = logging.getLogger(__name__)
+
+# Costo fijo estimado por vector además de valores y metadata (id, dicts, entradas del índice)
+_ROW_OVERHEAD_BYTES = 256
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        raise ImportError("numpy is required for local replicas. Install with: pip install numpy")
+
+
+class UnsupportedFilterError(ValueError):
+    """El filtro usa un operador que la réplica no evalúa; la búsqueda va al proveedor."""
+
+
+def _matches_eq(present: bool, value: Any, operand: Any) -> bool:
+    # En Pinecone un campo lista coincide si contiene el valor
+    return present and (value == operand or (isinstance(value, list) and operand in value))
+
+
+def _matches_in(present: bool, value: Any, operand: Any) -> bool:
+    if not present:
+        return False
+    if isinstance(value, list):
+        return any(item in operand for item in value)
+    return value in operand
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _compare(check: Callable[[Any, Any], bool]) -> Callable[[bool, Any, Any], bool]:
+    return lambda present, value, operand: present and _is_number(value) and check(value, operand)
+
+
+_OPERATORS: Dict[str, Callable[[bool, Any, Any], bool]] = {
+    "$eq": _matches_eq,
+    "$ne": lambda present, value, operand: not _matches_eq(present, value, operand),
+    "$in": _matches_in,
+    "$nin": lambda present, value, operand: not _matches_in(present, value, operand),
+    "$gt": _compare(lambda value, operand: value > operand),
+    "$gte": _compare(lambda value, operand: value >= operand),
+    "$lt": _compare(lambda value, operand: value < operand),
+    "$lte": _compare(lambda value, operand: value <= operand),
+    "$exists": lambda present, value, operand: present == bool(operand),
+}
+
+
+def compile_filter(expression: Optional[Dict[str, Any]]) -> Callable[[Dict[str, Any]], bool]:
+    """Convierte un filtro de metadata de Pinecone en un predicado sobre el dict de metadata."""
+    if not expression:
+        return lambda metadata: True
+
+    predicates = []
+    for key, condition in expression.items():
+        if key in ("$and", "$or"):
+            children = [compile_filter(child) for child in condition]
+            combine = all if key == "$and" else any
+            predicates.append(lambda metadata, children=children, combine=combine: combine(
+                child(metadata) for child in children
+            ))
+        elif key.startswith("$"):
+            raise UnsupportedFilterError(f"Operador de filtro no soportado: {key}")
+        else:
+            predicates.append(_compile_field(key, condition))
+    return lambda metadata: all(predicate(metadata) for predicate in predicates)
+
+
+def _compile_field(field: str, condition: Any) -> Callable[[Dict[str, Any]], bool]:
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    checks = []
+    for operator, operand in condition.items():
+        check = _OPERATORS.get(operator)
+        if check is None:
+            raise UnsupportedFilterError(f"Operador de filtro no soportado: {operator}")
+        checks.append((check, operand))
+
+    def predicate(metadata: Dict[str, Any]) -> bool:
+        present = field in metadata
+        value = metadata.get(field)
+        return all(check(present, value, operand) for check, operand in checks)
+
+    return predicate
+
+
+class _NamespaceReplica:
+    """Copia en memoria de un namespace: matriz float32 que crece por duplicación, metadata por fila e id -> fila.
+
+    Los borrados mueven la última fila al hueco, así la matriz siempre está compacta en [:size].
+    """
+
+    def __init__(self, profile: IndexProfile):
+        np = _numpy()
+        self.dimension = profile.dimension
+        self.metric = profile.metric
+        self.ids: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.metadata_bytes: List[int] = []
+        self.rows: Dict[str, int] = {}
+        self.matrix = np.empty((0, self.dimension), dtype=np.float32)
+        self.norms = np.empty(0, dtype=np.float32)
+        self.total_metadata_bytes = 0
+        self.built_at = 0.0
+        # Generación compartida del namespace al cargar la réplica (solo en modo multi-worker)
+        self.generation = 0
+        # Mientras se carga el snapshot, las escrituras se anotan aquí y se reaplican al terminar
+        self.pending: Optional[List[Tuple[str, Any]]] = []
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.norms.nbytes + self.total_metadata_bytes + self.size * _ROW_OVERHEAD_BYTES
+
+    def load_segment(self, ids: List[str], matrix, norms, metadata: List[Dict[str, Any]]):
+        """Adopta un segmento compartido; la matriz mapeada es de solo lectura y no se copia."""
+        with self.lock:
+            self.ids = ids
+            self.metadata = metadata
+            self.metadata_bytes = [len(json.dumps(row, default=str)) for row in metadata]
+            self.total_metadata_bytes = sum(self.metadata_bytes)
+            self.rows = {vector_id: row for row, vector_id in enumerate(ids)}
+            self.matrix = matrix
+            self.norms = norms
+
+    def upsert(self, vectors: Iterable[Dict[str, Any]]):
+        np = _numpy()
+        with self.lock:
+            for vector in vectors:
+                values = np.asarray(vector["values"], dtype=np.float32)
+                if values.shape != (self.dimension,):
+                    continue
+                metadata = dict(vector.get("metadata") or {})
+                metadata_bytes = len(json.dumps(metadata, default=str))
+                row = self.rows.get(vector["id"])
+                if row is None:
+                    row = self.size
+                    self._ensure_capacity(row + 1)
+                    self.rows[vector["id"]] = row
+                    self.ids.append(vector["id"])
+                    self.metadata.append(metadata)
+                    self.metadata_bytes.append(metadata_bytes)
+                else:
+                    self.total_metadata_bytes -= self.metadata_bytes[row]
+                    self.metadata[row] = metadata
+                    self.metadata_bytes[row] = metadata_bytes
+                self.total_metadata_bytes += metadata_bytes
+                self.matrix[row] = values
+                self.norms[row] = np.linalg.norm(values)
+
+    def delete_documents(self, original_ids: Iterable[str]):
+        original_ids = set(original_ids)
+        with self.lock:
+            doomed = [
+                row for row, metadata in enumerate(self.metadata)
+                if metadata.get("original_id") in original_ids or metadata.get("original_record_id") in original_ids
+            ]
+            # De atrás hacia adelante para que el swap con la última fila no mueva filas pendientes de borrar
+            for row in reversed(doomed):
+                self._remove_row(row)
+
+    def query(self, vector: List[float], top_k: int, predicate: Optional[Callable[[Dict[str, Any]], bool]],
+              include_values: bool) -> List[Dict[str, Any]]:
+        np = _numpy()
+        query = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            size = self.size
+            if not size or top_k <= 0:
+                return []
+            if predicate is None:
+                candidates = np.arange(size)
+                matrix = self.matrix[:size]
+            else:
+                candidates = np.fromiter(
+                    (row for row in range(size) if predicate(self.metadata[row])), dtype=np.int64
+                )
+                if not len(candidates):
+                    return []
+                matrix = self.matrix[candidates]
+            if self.metric == "euclidean":
+                # Pinecone devuelve la distancia euclídea al cuadrado; menor es mejor
+                scores = ((matrix - query) ** 2).sum(axis=1)
+                order_scores = -scores
+            else:
+                scores = matrix @ query
+                if self.metric == "cosine":
+                    scores = scores / np.maximum(self.norms[candidates] * (np.linalg.norm(query) or 1.0), 1e-12)
+                order_scores = scores
+            k = min(top_k, len(candidates))
+            best = np.argpartition(-order_scores, k - 1)[:k]
+            best = best[np.argsort(-order_scores[best])]
+            return [
+                {
+                    "id": self.ids[candidates[position]],
+                    "score": float(scores[position]),
+                    "metadata": dict(self.metadata[candidates[position]]),
+                    "values": matrix[position].tolist() if include_values else []
+                }
+                for position in best
+            ]
+
+    def fetch(self, ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            results = {}
+            for vector_id in ids:
+                row = self.rows.get(vector_id)
+                if row is not None:
+                    results[vector_id] = {
+                        "id": vector_id,
+                        "values": self.matrix[row].tolist(),
+                        "metadata": dict(self.metadata[row])
+                    }
+            return results
+
+    def _ensure_capacity(self, rows: int):
+        np = _numpy()
+        capacity = len(self.matrix)
+        if rows <= capacity:
+            return
+        capacity = max(rows, capacity * 2, 64)
+        matrix = np.empty((capacity, self.dimension), dtype=np.float32)
+        matrix[:self.size] = self.matrix[:self.size]
+        norms = np.empty(capacity, dtype=np.float32)
+        norms[:self.size] = self.norms[:self.size]
+        self.matrix = matrix
+        self.norms = norms
+
+    def _remove_row(self, row: int):
+        last = self.size - 1
+        del self.rows[self.ids[row]]
+        self.total_metadata_bytes -= self.metadata_bytes[row]
+        if row != last:
+            self.ids[row] = self.ids[last]
+            self.metadata[row] = self.metadata[last]
+            self.metadata_bytes[row] = self.metadata_bytes[last]
+            self.matrix[row] = self.matrix[last]
+            self.norms[row] = self.norms[last]
+            self.rows[self.ids[row]] = row
+        self.ids.pop()
+        self.metadata.pop()
+        self.metadata_bytes.pop()
+
+
+class LocalReplicaService:
+    """Réplica en proceso de los namespaces más consultados, delante del proveedor.
+
+    Un namespace que supera LOCAL_REPLICA_HOT_QUERIES búsquedas en la ventana se carga en segundo
+    plano con un snapshot (listado de IDs + fetch) y luego se mantiene al día con las escrituras de
+    este proceso. Las búsquedas y fetch se sirven localmente mientras la réplica es vigente; si no
+    existe, venció o el filtro no se puede evaluar aquí, van al proveedor. Las escrituras de otros
+    procesos no se ven, por eso cada réplica se recarga al cumplir LOCAL_REPLICA_MAX_AGE_SECONDS.
+    Las réplicas comparten un presupuesto de memoria y se descartan por namespace en orden LRU.
+
+    Con estado compartido (varios workers), cada escritura incrementa la generación del namespace y
+    las réplicas de cualquier worker con otra generación dejan de ser vigentes. La carga se hace una
+    sola vez por generación: el primer worker publica el segmento y los demás lo mapean.
+    """
+
+    def __init__(self, snapshot_fn: Callable[[str, str], Iterator[Iterable[Dict[str, Any]]]],
+                 count_fn: Callable[[str, str], int], enabled: bool = LOCAL_REPLICA_ENABLED,
+                 memory_budget: int = LOCAL_REPLICA_MEMORY_MB * 1024 * 1024, shared: bool = SHARED_STATE_ENABLED):
+        self.snapshot_fn = snapshot_fn
+        self.count_fn = count_fn
+        self.enabled = enabled and memory_budget > 0
+        self.memory_budget = memory_budget
+        # Réplicas listas, en orden LRU (la más reciente al final)
+        self._replicas: "OrderedDict[Tuple[str, str], _NamespaceReplica]" = OrderedDict()
+        self._building: Dict[Tuple[str, str], _NamespaceReplica] = {}
+        self._hits: Dict[Tuple[str, str], Tuple[float, int]] = {}
+        # Namespaces que no entran en el presupuesto o cuya carga falló: no se reintenta hasta la fecha guardada
+        self._skipped_until: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self.generations = SharedGenerations() if shared else None
+        self.segments = ReplicaSegments() if shared else None
+
+    def query(self, profile: IndexProfile, namespace: str, vector: List[float], top_k: int,
+              metadata_filter: Optional[Dict[str, Any]], include_values: bool) -> Optional[Dict[str, Any]]:
+        """Resultado con la forma de `index.query` si la réplica puede responder; None para ir al proveedor."""
+        if not self.enabled:
+            return None
+        key = (profile.name, namespace)
+        replica = self._fresh_replica(key, profile)
+        if replica is None:
+            LOCAL_REPLICA_REQUESTS.inc(operation="query", source="provider")
+            return None
+        try:
+            predicate = compile_filter(metadata_filter) if metadata_filter else None
+        except UnsupportedFilterError:
+            LOCAL_REPLICA_REQUESTS.inc(operation="query", source="provider")
+            return None
+        LOCAL_REPLICA_REQUESTS.inc(operation="query", source="local")
+        with SEARCH_SECONDS.time(span="search_local_query", stage="local_query"):
+            return {"matches": replica.query(vector, top_k, predicate, include_values)}
+
+    def fetch(self, index_name: str, namespace: str, ids: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Vectores con la forma de `index.fetch(...)['vectors']`; un ID ausente en una réplica vigente no existe."""
+        if not self.enabled:
+            return None
+        key = (index_name, namespace)
+        with self._lock:
+            replica = self._replicas.get(key)
+            if replica is None or not self._is_fresh(key, replica):
+                replica = None
+            else:
+                self._replicas.move_to_end(key)
+        if replica is None:
+            LOCAL_REPLICA_REQUESTS.inc(operation="fetch", source="provider")
+            return None
+        LOCAL_REPLICA_REQUESTS.inc(operation="fetch", source="local")
+        return replica.fetch(ids)
+
+    def apply_upsert(self, index_name: str, namespace: str, vectors: List[Dict[str, Any]]):
+        """Refleja un upsert ya confirmado por el proveedor."""
+        self._apply(index_name, namespace, "upsert", vectors)
+
+    def apply_delete(self, index_name: str, namespace: str, original_ids: List[str]):
+        """Refleja el borrado por documento ya confirmado por el proveedor."""
+        self._apply(index_name, namespace, "delete", original_ids)
+
+    def invalidate(self, index_name: str, namespace: str):
+        """Descarta la réplica tras una escritura cuyo resultado en el proveedor es incierto."""
+        if not self.enabled:
+            return
+        key = (index_name, namespace)
+        if self.generations is not None:
+            self.generations.bump(index_name, namespace)
+        with self._lock:
+            replica = self._replicas.pop(key, None)
+            building = self._building.pop(key, None)
+            if building is not None:
+                building.cancelled = True
+            if replica is not None or building is not None:
+                LOCAL_REPLICA_EVICTIONS.inc(reason="invalidated")
+                self._update_gauges()
+
+    def drop_index(self, index_name: str):
+        with self._lock:
+            for key in [key for key in self._replicas if key[0] == index_name]:
+                del self._replicas[key]
+            for key in [key for key in self._building if key[0] == index_name]:
+                self._building.pop(key).cancelled = True
+            self._update_gauges()
+
+    def _apply(self, index_name: str, namespace: str, operation: str, payload):
+        if not self.enabled:
+            return
+        if self.generations is not None:
+            # Las réplicas de todos los workers (esta incluida) quedan viejas; se recargan de un segmento nuevo
+            self.generations.bump(index_name, namespace)
+            return
+        key = (index_name, namespace)
+        with self._lock:
+            replica = self._replicas.get(key)
+            building = self._building.get(key)
+            if building is not None and building.pending is not None:
+                building.pending.append((operation, payload))
+        if replica is not None:
+            self._apply_to(replica, operation, payload)
+            if operation == "upsert":
+                with self._lock:
+                    self._enforce_budget()
+
+    @staticmethod
+    def _apply_to(replica: _NamespaceReplica, operation: str, payload):
+        if operation == "upsert":
+            replica.upsert(payload)
+        else:
+            replica.delete_documents(payload)
+
+    def _is_fresh(self, key: Tuple[str, str], replica: _NamespaceReplica) -> bool:
+        if self.generations is not None and self.generations.get(*key) != replica.generation:
+            return False
+        return time.monotonic() - replica.built_at < LOCAL_REPLICA_MAX_AGE_SECONDS
+
+    def _fresh_replica(self, key: Tuple[str, str], profile: IndexProfile) -> Optional[_NamespaceReplica]:
+        now = time.monotonic()
+        with self._lock:
+            replica = self._replicas.get(key)
+            if replica is not None:
+                self._replicas.move_to_end(key)
+                if self._is_fresh(key, replica):
+                    return replica
+                if self.generations is not None and self.generations.get(*key) != replica.generation:
+                    # Otro worker escribió: se descarta y vuelve a contar búsquedas, para no recargar en cada escritura
+                    del self._replicas[key]
+                    LOCAL_REPLICA_EVICTIONS.inc(reason="invalidated")
+                    self._update_gauges()
+                    return None
+                # Vencida: se sigue caliente, así que se recarga sin esperar a acumular búsquedas
+                self._start_build(key, profile)
+                return None
+
+            if len(self._hits) > 10000:
+                self._hits.clear()
+            window_start, count = self._hits.get(key, (now, 0))
+            if now - window_start > LOCAL_REPLICA_HOT_WINDOW_SECONDS:
+                window_start, count = now, 0
+            count += 1
+            self._hits[key] = (window_start, count)
+            if count >= LOCAL_REPLICA_HOT_QUERIES and self._skipped_until.get(key, 0) <= now:
+                self._start_build(key, profile)
+            return None
+
+    def _start_build(self, key: Tuple[str, str], profile: IndexProfile):
+        # Se llama con el lock tomado
+        if key in self._building:
+            return
+        replica = self._building[key] = _NamespaceReplica(profile)
+        self._hits.pop(key, None)
+        # La carga corre en un contexto limpio: no hereda el deadline ni la traza de la búsqueda que la disparó
+        contextvars.Context().run(self._submit_build, key, replica)
+
+    def _submit_build(self, key: Tuple[str, str], replica: _NamespaceReplica):
+        with priority_scope(PRIORITY_BULK):
+            ExecutorService.submit(ExecutorService.REPLICA, self._build, key, replica)
+
+    def _build(self, key: Tuple[str, str], replica: _NamespaceReplica):
+        index_name, namespace = key
+        started = time.perf_counter()
+        try:
+            if self.segments is None:
+                self._load_snapshot(key, replica)
+            else:
+                replica.generation = self.generations.get(index_name, namespace)
+                with self.segments.build_lock(index_name, namespace):
+                    self._load_shared(key, replica)
+        except Exception as e:
+            logger.warning("Local replica of %s/%s not built: %s", index_name, namespace, e)
+            with self._lock:
+                if self._building.get(key) is replica:
+                    del self._building[key]
+                self._skipped_until[key] = time.monotonic() + LOCAL_REPLICA_MAX_AGE_SECONDS
+            return
+
+        with self._lock:
+            if replica.cancelled or self._building.get(key) is not replica:
+                return
+            del self._building[key]
+            if self.generations is not None and self.generations.get(index_name, namespace) != replica.generation:
+                # Hubo escrituras durante la carga: el namespace se está escribiendo, se espera una ventana
+                self._skipped_until[key] = time.monotonic() + LOCAL_REPLICA_HOT_WINDOW_SECONDS
+                return
+            # Las escrituras confirmadas durante el snapshot se reaplican en orden sobre lo cargado
+            for operation, payload in replica.pending:
+                self._apply_to(replica, operation, payload)
+            replica.pending = None
+            if not replica.built_at:
+                replica.built_at = time.monotonic()
+            self._skipped_until.pop(key, None)
+            self._replicas[key] = replica
+            self._replicas.move_to_end(key)
+            self._enforce_budget()
+        LOCAL_REPLICA_BUILD_SECONDS.observe(time.perf_counter() - started)
+        logger.info("Local replica of %s/%s loaded: %d vectors", index_name, namespace, replica.size)
+
+    def _load_snapshot(self, key: Tuple[str, str], replica: _NamespaceReplica):
+        index_name, namespace = key
+        estimated = self.count_fn(index_name, namespace) * (replica.dimension * 4 + 4 + _ROW_OVERHEAD_BYTES)
+        if estimated > self.memory_budget:
+            raise MemoryError(f"~{estimated} bytes supera el presupuesto de {self.memory_budget}")
+        for page in self.snapshot_fn(index_name, namespace):
+            if replica.cancelled:
+                return
+            replica.upsert(page)
+            if replica.nbytes > self.memory_budget:
+                raise MemoryError(f"{replica.nbytes} bytes supera el presupuesto de {self.memory_budget}")
+
+    def _load_shared(self, key: Tuple[str, str], replica: _NamespaceReplica):
+        # Se llama con el lock de carga entre workers tomado
+        index_name, namespace = key
+        segment = self.segments.load(index_name, namespace, replica.generation, LOCAL_REPLICA_MAX_AGE_SECONDS)
+        if segment is not None:
+            ids, matrix, norms, metadata, created_at = segment
+            replica.load_segment(ids, matrix, norms, metadata)
+            # La antigüedad cuenta desde que se tomó el snapshot, no desde que este worker lo mapeó
+            replica.built_at = time.monotonic() - (time.time() - created_at)
+            LOCAL_REPLICA_SEGMENT_LOADS.inc(source="segment")
+            if replica.nbytes > self.memory_budget:
+                raise MemoryError(f"{replica.nbytes} bytes supera el presupuesto de {self.memory_budget}")
+            return
+
+        self._load_snapshot(key, replica)
+        LOCAL_REPLICA_SEGMENT_LOADS.inc(source="provider")
+        if replica.cancelled or self.generations.get(index_name, namespace) != replica.generation:
+            return
+        size = replica.size
+        self.segments.save(
+            index_name, namespace, replica.generation, replica.ids, replica.matrix[:size], replica.norms[:size],
+            replica.metadata
+        )
+        # Este worker también pasa a usar la copia mapeada, que comparte páginas con los demás
+        segment = self.segments.load(index_name, namespace, replica.generation, LOCAL_REPLICA_MAX_AGE_SECONDS)
+        if segment is not None:
+            replica.load_segment(*segment[:4])
+
+    def _enforce_budget(self):
+        # Se llama con el lock tomado; se descartan namespaces enteros empezando por el menos usado
+        total = sum(replica.nbytes for replica in self._replicas.values())
+        while self._replicas and total > self.memory_budget:
+            key, replica = self._replicas.popitem(last=False)
+            total -= replica.nbytes
+            LOCAL_REPLICA_EVICTIONS.inc(reason="memory")
+            logger.info("Local replica of %s/%s evicted to stay within the memory budget", *key)
+        self._update_gauges(total)
+
+    def _update_gauges(self, total: Optional[int] = None):
+        if total is None:
+            total = sum(replica.nbytes for replica in self._replicas.values())
+        LOCAL_REPLICA_NAMESPACES.set(len(self._replicas))
+        LOCAL_REPLICA_BYTES.set(total)
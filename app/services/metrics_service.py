@@ -0,0 +1,473 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.services.profiler_service import ProfilerService
+from app.services.shared_state_service import _file_lock
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+BYTES_BUCKETS = (1024, 16384, 131072, 1048576, 8388608, 33554432, 67108864)
+
+# Spans del request en curso; solo existe cuando el cliente pide trazas
+_trace_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("trace_spans", default=None)
+
+
+def start_trace():
+    """Activa la captura de spans para el contexto actual y devuelve el token para restaurarlo."""
+    return _trace_spans.set([])
+
+
+def stop_trace(token) -> List[Tuple[str, float]]:
+    spans = _trace_spans.get() or []
+    _trace_spans.reset(token)
+    return spans
+
+
+def current_spans() -> List[Tuple[str, float]]:
+    return list(_trace_spans.get() or [])
+
+
+def record_span(name: str, seconds: float):
+    spans = _trace_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Sequence[Tuple[str, str]] = ()) -> str:
+        # Los gauges agregados entre workers traen el pid como etiqueta adicional al final de la clave
+        pairs = list(zip(self.labelnames + ("pid",), key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._lock:
+            return [(key, copy.deepcopy(value)) for key, value in self._values.items()]
+
+    def _samples(self, items: List[Tuple[Tuple[str, ...], object]]) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {_format_value(value)}" for key, value in items]
+
+    def render(self, items: Optional[List[Tuple[Tuple[str, ...], object]]] = None) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self._samples(self.snapshot() if items is None else items)
+        ]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        bucket_index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [conteos por bucket (+Inf al final), suma, total]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bucket_index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, span: Optional[str] = None, **labels):
+        """Mide el bloque, lo registra en el histograma y como span si hay una traza activa.
+
+        Si el request se está perfilando, el span también marca la etapa de las muestras.
+        """
+        stage = ProfilerService.enter_stage(span or self.name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            ProfilerService.exit_stage(stage)
+            self.observe(elapsed, **labels)
+            record_span(span or self.name, elapsed)
+
+    def _samples(self, items: List[Tuple[Tuple[str, ...], object]]) -> List[str]:
+        lines = []
+        for key, (counts, total_sum, total_count) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = self._format_labels(key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {total_count}")
+        return lines
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_state(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(path: str, state: Dict):
+    # Escritura atómica: quien lee nunca ve un archivo a medias
+    partial_path = f"{path}.partial"
+    with open(partial_path, "w") as f:
+        json.dump(state, f)
+    os.replace(partial_path, path)
+
+
+class MetricsRegistry:
+    """Métricas del proceso, renderizadas en el formato de texto de Prometheus.
+
+    Con varios workers cada proceso tiene sus propios valores: `share` hace que cada uno los vuelque
+    a un archivo en `directory` cada `flush_seconds` y que /metrics los agregue. Contadores e
+    histogramas se suman; los de workers que ya terminaron pasan a un archivo acumulado, así nunca
+    retroceden. Los gauges describen a cada proceso y se exportan con la etiqueta `pid`.
+    """
+
+    ARCHIVE = "archive.json"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._shared_dir: Optional[str] = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def share(self, directory: str, flush_seconds: float):
+        """Activa la agregación entre workers; se llama en cada proceso, después del fork."""
+        with self._lock:
+            if self._shared_dir is not None:
+                return
+            os.makedirs(directory, exist_ok=True)
+            self._shared_dir = directory
+
+        path = self._state_path(os.getpid())
+        with _file_lock(self._lock_path()):
+            # Un archivo con nuestro pid es de un proceso anterior que tuvo el mismo pid: se acumula
+            previous = _read_state(path)
+            if previous is not None:
+                self._archive([previous])
+                os.remove(path)
+        self.export()
+        threading.Thread(target=self._flush_loop, args=(flush_seconds,), name="metrics-flush", daemon=True).start()
+        atexit.register(self._export_quietly)
+
+    def export(self):
+        if self._shared_dir is None:
+            return
+        state = {"pid": os.getpid(), "metrics": self._snapshot()}
+        _write_state(self._state_path(os.getpid()), state)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        if self._shared_dir is None:
+            for metric in metrics:
+                lines.extend(metric.render())
+            return "\n".join(lines) + "\n"
+
+        self.export()
+        archive, live = self._collect()
+        for metric in metrics:
+            if isinstance(metric, Gauge):
+                items = [
+                    ((*key, str(state["pid"])), value)
+                    for state in live for key, value in state["metrics"].get(metric.name, [])
+                ]
+            else:
+                items = self._combine(metric, [archive, *live])
+            lines.extend(metric.render(items))
+        return "\n".join(lines) + "\n"
+
+    def _flush_loop(self, flush_seconds: float):
+        while True:
+            time.sleep(flush_seconds)
+            self._export_quietly()
+
+    def _export_quietly(self):
+        try:
+            self.export()
+        except Exception as e:
+            logger.warning("Could not export metrics to %s: %s", self._shared_dir, e)
+
+    def _state_path(self, pid: int) -> str:
+        return os.path.join(self._shared_dir, f"{pid}.json")
+
+    def _lock_path(self) -> str:
+        return os.path.join(self._shared_dir, ".lock")
+
+    def _snapshot(self) -> Dict[str, list]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: [[list(key), value] for key, value in metric.snapshot()] for metric in metrics}
+
+    def _collect(self) -> Tuple[Dict, List[Dict]]:
+        """Lee los archivos de todos los workers; los de procesos que ya no existen pasan al acumulado."""
+        own_pid = os.getpid()
+        live, dead = [], []
+        with _file_lock(self._lock_path()):
+            for name in os.listdir(self._shared_dir):
+                if not name.endswith(".json") or name == self.ARCHIVE:
+                    continue
+                path = os.path.join(self._shared_dir, name)
+                state = _read_state(path)
+                if state is None:
+                    continue
+                if state["pid"] == own_pid or _is_alive(state["pid"]):
+                    live.append(state)
+                else:
+                    dead.append((path, state))
+            if dead:
+                self._archive([state for _, state in dead])
+                for path, _ in dead:
+                    os.remove(path)
+            archive = _read_state(os.path.join(self._shared_dir, self.ARCHIVE)) or {"metrics": {}}
+        return archive, live
+
+    def _archive(self, states: List[Dict]):
+        # Se llama con el lock de archivo tomado
+        path = os.path.join(self._shared_dir, self.ARCHIVE)
+        archive = _read_state(path) or {"metrics": {}}
+        with self._lock:
+            metrics = [metric for metric in self._metrics.values() if not isinstance(metric, Gauge)]
+        merged = {
+            metric.name: [[list(key), value] for key, value in self._combine(metric, [archive, *states])]
+            for metric in metrics
+        }
+        _write_state(path, {"metrics": merged})
+
+    @staticmethod
+    def _combine(metric: _Metric, states: List[Dict]) -> List[Tuple[Tuple[str, ...], object]]:
+        combined: Dict[Tuple[str, ...], object] = {}
+        for state in states:
+            for key, value in state["metrics"].get(metric.name, []):
+                key = tuple(key)
+                current = combined.get(key)
+                if not isinstance(metric, Histogram):
+                    combined[key] = (current or 0.0) + value
+                elif current is None:
+                    combined[key] = [list(value[0]), value[1], value[2]]
+                elif len(current[0]) == len(value[0]):
+                    # Con buckets distintos (otra versión del código) no se pueden sumar: se descartan
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+        return list(combined.items())
+
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Latencia de los requests HTTP", ["method", "route", "status"])
+
+APP_IMPORT_SECONDS = metrics.gauge(
+    "app_import_duration_seconds", "Tiempo de importación de la aplicación al arrancar")
+APP_WARMUP_SECONDS = metrics.gauge(
+    "app_warmup_duration_seconds", "Tiempo del warm-up de proveedores e índices al arrancar")
+FIRST_REQUEST_SECONDS = metrics.gauge(
+    "first_request_duration_seconds", "Latencia del primer request servido por el proceso en cada ruta", ["route"])
+
+FILE_DOWNLOAD_BYTES = metrics.counter(
+    "file_download_bytes_total", "Bytes descargados desde file_urls", ["file_type"])
+FILE_DOWNLOAD_SIZE = metrics.histogram(
+    "file_download_size_bytes", "Tamaño de cada archivo descargado", ["file_type"], BYTES_BUCKETS)
+FILE_DOWNLOAD_SECONDS = metrics.histogram(
+    "file_download_duration_seconds", "Tiempo de descarga de cada archivo", ["file_type"])
+FILE_EXTRACTION_SECONDS = metrics.histogram(
+    "file_extraction_duration_seconds", "Tiempo de extracción de contenido por tipo de archivo", ["file_type"])
+FILE_PROCESSING_FAILURES = metrics.counter(
+    "file_processing_failures_total", "Archivos que no se pudieron descargar o procesar")
+UPLOAD_BYTES = metrics.counter(
+    "file_upload_bytes_total", "Bytes recibidos por el endpoint de subida, en streaming o spool", ["file_type", "mode"])
+UPLOAD_SIZE = metrics.histogram(
+    "file_upload_size_bytes", "Tamaño de cada archivo subido", ["file_type"], BYTES_BUCKETS)
+
+HTML_EXTRACTION_TOKENS = metrics.counter(
+    "html_extraction_tokens_total", "Tokens estimados del HTML crudo y del texto extraído", ["stage"])
+HTML_TOKEN_REDUCTION = metrics.histogram(
+    "html_token_reduction_ratio", "Fracción de tokens eliminada por documento HTML", (),
+    (0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99))
+
+TEXT_SPLIT_SECONDS = metrics.histogram(
+    "text_split_duration_seconds", "Tiempo de división de texto en chunks", ["file_type"])
+
+EMBEDDING_BATCH_SIZE = metrics.histogram(
+    "embedding_batch_size", "Textos enviados por llamada de embeddings", ["model"], SIZE_BUCKETS)
+EMBEDDING_TOKENS = metrics.counter(
+    "embedding_tokens_total", "Tokens consumidos por la API de embeddings", ["model"])
+EMBEDDING_REQUEST_SECONDS = metrics.histogram(
+    "embedding_request_duration_seconds", "Latencia de cada llamada de embeddings", ["model"])
+EMBEDDING_RETRIES = metrics.counter(
+    "embedding_retries_total", "Reintentos de llamadas de embeddings", ["model", "reason"])
+
+DEDUP_CHUNKS = metrics.counter(
+    "dedup_chunks_total", "Chunks de ingestas con deduplicación: embebidos o duplicados exactos/cercanos", ["result"])
+
+UPSERT_BATCH_SECONDS = metrics.histogram(
+    "vector_upsert_batch_duration_seconds", "Latencia de cada lote de upsert al proveedor")
+UPSERT_BATCH_SIZE = metrics.histogram(
+    "vector_upsert_batch_size", "Vectores por lote de upsert", (), SIZE_BUCKETS)
+UPSERT_BATCH_FAILURES = metrics.counter(
+    "vector_upsert_batch_failures_total", "Lotes de upsert fallidos")
+
+SEARCH_SECONDS = metrics.histogram(
+    "search_duration_seconds", "Latencia de búsqueda por etapa (embed, query, fetch)", ["stage"])
+
+COALESCED_REQUESTS = metrics.counter(
+    "coalesced_requests_total", "Requests servidos por una llamada upstream compartida", ["operation"])
+MICRO_BATCH_SIZE = metrics.histogram(
+    "micro_batch_size", "Items agrupados en cada lote de los micro-batchers", ["batcher"], SIZE_BUCKETS)
+MICRO_BATCH_FILL_RATIO = metrics.histogram(
+    "micro_batch_fill_ratio", "Fracción del tamaño máximo ocupada por cada lote", ["batcher"],
+    (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0))
+
+EXECUTOR_QUEUE_DEPTH = metrics.gauge(
+    "executor_queue_depth", "Tareas encoladas esperando un worker en cada pool compartido", ["pool", "priority"])
+EXECUTOR_ACTIVE_WORKERS = metrics.gauge(
+    "executor_active_workers", "Workers ejecutando tareas en cada pool compartido", ["pool", "priority"])
+EXECUTOR_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "executor_queue_wait_seconds", "Tiempo que cada tarea espera en la cola del pool", ["pool", "priority"])
+
+ADMISSION_INFLIGHT = metrics.gauge(
+    "admission_inflight_requests", "Requests admitidos en curso por clase de prioridad", ["priority"])
+ADMISSION_REJECTED = metrics.counter(
+    "admission_rejected_requests_total", "Requests rechazados con 429 por el control de admisión", ["priority"])
+
+PROVIDER_CALL_FAILURES = metrics.counter(
+    "provider_call_failures_total", "Llamadas a proveedores fallidas por error transitorio", ["provider", "operation", "reason"])
+PROVIDER_RETRIES = metrics.counter(
+    "provider_retries_total", "Reintentos con backoff de llamadas a proveedores", ["provider", "operation"])
+HEDGED_REQUESTS = metrics.counter(
+    "hedged_requests_total", "Lecturas duplicadas tras el p95 y cuál de las copias respondió primero", ["operation", "outcome"])
+CIRCUIT_STATE = metrics.gauge(
+    "circuit_breaker_state", "Estado del circuit breaker (0 cerrado, 1 semiabierto, 2 abierto)", ["provider", "target"])
+CIRCUIT_REJECTED = metrics.counter(
+    "circuit_breaker_rejected_total", "Llamadas rechazadas sin intentar por circuito abierto", ["provider", "target"])
+STALE_RESULTS = metrics.counter(
+    "stale_results_total", "Respuestas servidas desde la caché de últimos resultados", ["operation"])
+
+LOCAL_REPLICA_REQUESTS = metrics.counter(
+    "local_replica_requests_total", "Búsquedas y fetch servidos por la réplica local o por el proveedor", ["operation", "source"])
+LOCAL_REPLICA_NAMESPACES = metrics.gauge(
+    "local_replica_namespaces", "Namespaces replicados en memoria")
+LOCAL_REPLICA_BYTES = metrics.gauge(
+    "local_replica_bytes", "Memoria estimada de las réplicas locales")
+LOCAL_REPLICA_EVICTIONS = metrics.counter(
+    "local_replica_evictions_total", "Réplicas descartadas por presupuesto de memoria o por invalidación", ["reason"])
+LOCAL_REPLICA_BUILD_SECONDS = metrics.histogram(
+    "local_replica_build_duration_seconds", "Tiempo de carga del snapshot de un namespace")
+
+SEARCH_GROUP_ROUNDS = metrics.histogram(
+    "search_group_rounds", "Consultas al índice por búsqueda agrupada por documento", (), (1, 2, 3, 4, 6, 8))
+SEARCH_GROUP_DOCUMENTS = metrics.histogram(
+    "search_group_documents", "Documentos distintos encontrados por búsqueda agrupada", (), SIZE_BUCKETS)
+
+RESPONSE_ENCODING_SECONDS = metrics.histogram(
+    "response_encoding_duration_seconds", "Tiempo de serialización de las respuestas de búsqueda", ["format"])
+RESPONSE_BYTES = metrics.histogram(
+    "response_size_bytes", "Tamaño de las respuestas de búsqueda por formato", ["format"], BYTES_BUCKETS)
+
+SNAPSHOT_VECTORS = metrics.counter(
+    "snapshot_vectors_total", "Vectores exportados a snapshots o importados desde ellos", ["operation"])
+SNAPSHOT_PAGE_SECONDS = metrics.histogram(
+    "snapshot_page_duration_seconds", "Tiempo de leer del proveedor o subir una página de snapshot", ["operation"])
+
+EMBEDDING_CACHE_REQUESTS = metrics.counter(
+    "embedding_cache_requests_total", "Textos buscados en la caché compartida de embeddings", ["result"])
+LOCAL_REPLICA_SEGMENT_LOADS = metrics.counter(
+    "local_replica_segment_loads_total", "Réplicas cargadas desde un segmento compartido o desde el proveedor", ["source"])
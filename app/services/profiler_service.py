@@ -0,0 +1,275 @@
+import contextvars
+import functools
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.configurations.config import PROFILE_CONTINUOUS_HZ, PROFILE_MAX_STORED, PROFILE_SAMPLE_HZ
+
+# Sesión y etapas activas del contexto actual; None (el caso normal) cuando no se está perfilando
+_binding: contextvars.ContextVar[Optional[Tuple["ProfileSession", Tuple[str, ...]]]] = contextvars.ContextVar(
+    "profile_binding", default=None
+)
+_profile_ids = itertools.count(1)
+_frame_labels: Dict[Any, str] = {}
+_root = os.getcwd() + os.sep
+
+
+def _frame_label(code) -> str:
+    label = _frame_labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        if filename.startswith(_root):
+            filename = filename[len(_root):]
+        label = _frame_labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+    return label
+
+
+def _folded_stack(frame, stages: Tuple[str, ...]) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    # Las etapas del pipeline van como marcos raíz: el flamegraph agrupa primero por etapa
+    return ";".join([f"[{stage}]" for stage in stages] + labels)
+
+
+class ProfileSession:
+    """Muestras de un request (o del modo continuo) en formato folded: `marco;marco;... cantidad`."""
+
+    def __init__(self, label: str, sample_hz: float):
+        self.id = str(next(_profile_ids))
+        self.label = label
+        self.sample_hz = sample_hz
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.stacks: Counter = Counter()
+        self.stage_seconds: Dict[str, float] = {}
+        self.closed = False
+        self._lock = threading.Lock()
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def add(self, stack: str):
+        with self._lock:
+            self.stacks[stack] += 1
+
+    def add_stage_time(self, stages: Tuple[str, ...], seconds: float):
+        path = "/".join(stages)
+        with self._lock:
+            self.stage_seconds[path] = self.stage_seconds.get(path, 0.0) + seconds
+
+    def close(self):
+        self.duration = time.perf_counter() - self._started
+        self.closed = True
+
+    def folded(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.stage_seconds.clear()
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stage_seconds = dict(self.stage_seconds)
+        return {
+            "id": self.id,
+            "label": self.label,
+            "started_at": self.started_at,
+            "duration_seconds": self.duration if self.duration is not None else time.perf_counter() - self._started,
+            "sample_hz": self.sample_hz,
+            "samples": self.samples,
+            # Tiempo de pared acumulado por etapa, sumando todos los hilos que trabajaron para el request
+            "stage_seconds": stage_seconds
+        }
+
+
+class ProfilerService:
+    """Profiler por muestreo de stacks (sys._current_frames) para requests puntuales o en modo continuo.
+
+    Cada hilo que trabaja para un request perfilado (el del endpoint y los workers de los pools
+    compartidos) queda asociado a su sesión; un único hilo muestreador recorre sus stacks. Sin
+    sesiones activas no hay hilo muestreador y el costo se reduce a leer un contextvar por etapa.
+    """
+
+    # thread id -> (sesión, etapas) mientras el hilo trabaja para un request perfilado
+    _threads: Dict[int, Tuple[ProfileSession, Tuple[str, ...]]] = {}
+    _active: Dict[str, ProfileSession] = {}
+    _finished: "OrderedDict[str, ProfileSession]" = OrderedDict()
+    _continuous: Optional[ProfileSession] = None
+    _sampler: Optional[threading.Thread] = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def start(label: str) -> Tuple[ProfileSession, contextvars.Token]:
+        session = ProfileSession(label, PROFILE_SAMPLE_HZ)
+        with ProfilerService._lock:
+            ProfilerService._active[session.id] = session
+            ProfilerService._ensure_sampler()
+        return session, _binding.set((session, ()))
+
+    @staticmethod
+    def finish(session: ProfileSession, token: contextvars.Token):
+        _binding.reset(token)
+        session.close()
+        with ProfilerService._lock:
+            ProfilerService._active.pop(session.id, None)
+            ProfilerService._finished[session.id] = session
+            while len(ProfilerService._finished) > PROFILE_MAX_STORED:
+                ProfilerService._finished.popitem(last=False)
+
+    @staticmethod
+    def get(profile_id: str) -> Optional[ProfileSession]:
+        with ProfilerService._lock:
+            return ProfilerService._finished.get(profile_id) or ProfilerService._active.get(profile_id)
+
+    @staticmethod
+    def summaries() -> List[Dict[str, Any]]:
+        with ProfilerService._lock:
+            sessions = list(ProfilerService._active.values()) + list(reversed(ProfilerService._finished.values()))
+        return [session.summary() for session in sessions]
+
+    @staticmethod
+    def continuous() -> Optional[ProfileSession]:
+        return ProfilerService._continuous
+
+    @staticmethod
+    def set_continuous(enabled: bool, sample_hz: float = PROFILE_CONTINUOUS_HZ) -> Optional[ProfileSession]:
+        with ProfilerService._lock:
+            if not enabled:
+                if ProfilerService._continuous is not None:
+                    ProfilerService._continuous.close()
+                ProfilerService._continuous = None
+                return None
+            if ProfilerService._continuous is None or ProfilerService._continuous.sample_hz != sample_hz:
+                ProfilerService._continuous = ProfileSession("continuous", sample_hz)
+            ProfilerService._ensure_sampler()
+            return ProfilerService._continuous
+
+    @staticmethod
+    def enter_stage(name: str):
+        """Abre una etapa en el hilo actual; devuelve None sin costo adicional si no se está perfilando."""
+        binding = _binding.get()
+        if binding is None:
+            return None
+        session, stages = binding
+        stages = stages + (name,)
+        token = _binding.set((session, stages))
+        thread_id = threading.get_ident()
+        previous = ProfilerService._threads.get(thread_id)
+        ProfilerService._threads[thread_id] = (session, stages)
+        return token, thread_id, previous, session, stages, time.perf_counter()
+
+    @staticmethod
+    def exit_stage(handle):
+        if handle is None:
+            return
+        token, thread_id, previous, session, stages, started = handle
+        _binding.reset(token)
+        if previous is None:
+            ProfilerService._threads.pop(thread_id, None)
+        else:
+            ProfilerService._threads[thread_id] = previous
+        session.add_stage_time(stages, time.perf_counter() - started)
+
+    @staticmethod
+    @contextmanager
+    def stage(name: str):
+        handle = ProfilerService.enter_stage(name)
+        try:
+            yield
+        finally:
+            ProfilerService.exit_stage(handle)
+
+    @staticmethod
+    def bind_task(context: contextvars.Context):
+        """Asocia el worker que va a ejecutar una tarea a la sesión de quien la encoló."""
+        binding = context.get(_binding)
+        if binding is None:
+            return None
+        thread_id = threading.get_ident()
+        previous = ProfilerService._threads.get(thread_id)
+        ProfilerService._threads[thread_id] = binding
+        return thread_id, previous
+
+    @staticmethod
+    def bound_endpoint(endpoint):
+        """Envuelve un endpoint síncrono: el hilo del threadpool que lo ejecuta queda asociado a la
+        sesión durante todo el endpoint, no solo dentro de las etapas."""
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            handle = ProfilerService.bind_task(contextvars.copy_context())
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                ProfilerService.unbind_task(handle)
+        return wrapper
+
+    @staticmethod
+    def unbind_task(handle):
+        if handle is None:
+            return
+        thread_id, previous = handle
+        if previous is None:
+            ProfilerService._threads.pop(thread_id, None)
+        else:
+            ProfilerService._threads[thread_id] = previous
+
+    @staticmethod
+    def _ensure_sampler():
+        # Se llama con el lock tomado
+        if ProfilerService._sampler is None:
+            ProfilerService._sampler = threading.Thread(
+                target=ProfilerService._sample_loop, name="profiler-sampler", daemon=True
+            )
+            ProfilerService._sampler.start()
+
+    @staticmethod
+    def _sample_loop():
+        sampler_id = threading.get_ident()
+        next_continuous = 0.0
+        while True:
+            with ProfilerService._lock:
+                continuous = ProfilerService._continuous
+                if not ProfilerService._active and continuous is None:
+                    ProfilerService._sampler = None
+                    return
+                has_requests = bool(ProfilerService._active)
+            interval = 1 / PROFILE_SAMPLE_HZ if has_requests else 1 / continuous.sample_hz
+            time.sleep(interval)
+
+            now = time.monotonic()
+            continuous_due = continuous is not None and now >= next_continuous
+            if continuous_due:
+                next_continuous = now + 1 / continuous.sample_hz
+            threads = dict(ProfilerService._threads)
+            frames = sys._current_frames()
+            try:
+                for thread_id, frame in frames.items():
+                    if thread_id == sampler_id:
+                        continue
+                    binding = threads.get(thread_id)
+                    if binding is None and not continuous_due:
+                        continue
+                    session, stages = binding if binding is not None else (None, ())
+                    stack = _folded_stack(frame, stages)
+                    if session is not None and not session.closed:
+                        session.add(stack)
+                    if continuous_due:
+                        continuous.add(stack)
+            finally:
+                del frames
@@ -0,0 +1,158 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List
+
+from app.services.metrics_service import COALESCED_REQUESTS, MICRO_BATCH_FILL_RATIO, MICRO_BATCH_SIZE
+from app.services.resilience_service import DeadlineExceededError, _deadline, remaining_time
+from app.services.scheduler_service import PRIORITY_INTERACTIVE, current_priority, priority_scope
+
+
+def _wait(event: threading.Event, operation: str):
+    """Espera el resultado compartido sin pasarse del deadline de quien espera."""
+    remaining = remaining_time()
+    if remaining is None:
+        event.wait()
+    elif remaining <= 0 or not event.wait(remaining):
+        raise DeadlineExceededError(f"Se agotó el deadline del request esperando {operation}")
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Comparte una única llamada upstream entre requests idénticos que están en vuelo a la vez.
+
+    No cachea nada: en cuanto la llamada termina, la siguiente petición con la misma clave
+    vuelve a ir al proveedor, así que no introduce datos obsoletos. Cada seguidor espera como
+    mucho hasta su propio deadline.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            COALESCED_REQUESTS.inc(operation=self.name)
+            _wait(call.done, self.name)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class _Batch:
+    __slots__ = ("items", "deadlines", "interactive", "full", "done", "results", "error")
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.deadlines: List[float] = []
+        self.interactive = False
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Agrupa en una sola llamada los items que llegan con la misma clave dentro de una ventana corta.
+
+    El primer llamador de cada ventana actúa de líder: espera `window_seconds` (o a que el lote
+    se llene), ejecuta `batch_fn(key, items)` y reparte los resultados alineados por posición.
+    Si no hay otro request de la misma clave en curso, el líder no espera la ventana. El lote
+    corre con el deadline más estricto y la prioridad más alta de sus integrantes, y cada
+    seguidor espera como mucho hasta su propio deadline.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[Hashable, List[Any]], List[Any]],
+                 window_seconds: float, max_batch_size: int):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[Hashable, _Batch] = {}
+        # Requests de cada clave dentro de submit (esperando o ejecutando un lote)
+        self._inflight: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, items: List[Any]) -> List[Any]:
+        if self.window_seconds <= 0:
+            return self.batch_fn(key, list(items))
+
+        deadline = _deadline.get()
+        with self._lock:
+            inflight = self._inflight[key] = self._inflight.get(key, 0) + 1
+            batch = self._pending.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = self._pending[key] = _Batch()
+            offset = len(batch.items)
+            batch.items.extend(items)
+            if deadline is not None:
+                batch.deadlines.append(deadline)
+            batch.interactive = batch.interactive or current_priority() == PRIORITY_INTERACTIVE
+            if len(batch.items) >= self.max_batch_size or (is_leader and inflight == 1):
+                # Lote lleno, o nadie más en curso con quien agruparse: se cierra ya
+                self._pending.pop(key, None)
+                batch.full.set()
+
+        try:
+            if is_leader:
+                self._run(key, batch)
+            else:
+                COALESCED_REQUESTS.inc(operation=self.name)
+                _wait(batch.done, self.name)
+        finally:
+            with self._lock:
+                self._inflight[key] -= 1
+                if not self._inflight[key]:
+                    del self._inflight[key]
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[offset:offset + len(items)]
+
+    def _run(self, key: Hashable, batch: _Batch):
+        batch.full.wait(self.window_seconds)
+        with self._lock:
+            if self._pending.get(key) is batch:
+                del self._pending[key]
+            deadlines = list(batch.deadlines)
+        MICRO_BATCH_SIZE.observe(len(batch.items), batcher=self.name)
+        MICRO_BATCH_FILL_RATIO.observe(min(1.0, len(batch.items) / self.max_batch_size), batcher=self.name)
+        # Los integrantes que ya vencieron (incluido el líder) dejan de esperar por su cuenta y no
+        # acortan el lote de los demás; sin deadlines vigentes se usa el más estricto
+        now = time.monotonic()
+        live = [deadline for deadline in deadlines if deadline > now]
+        token = _deadline.set(min(live or deadlines) if deadlines else None)
+        try:
+            with priority_scope(PRIORITY_INTERACTIVE if batch.interactive else current_priority()):
+                batch.results = self.batch_fn(key, batch.items)
+        except BaseException as e:
+            batch.error = e
+        finally:
+            _deadline.reset(token)
+            batch.done.set()
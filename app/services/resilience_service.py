@@ -0,0 +1,436 @@
+import contextvars
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from app.configurations.config import (
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS, HEDGE_LATENCY_WINDOW, HEDGE_MAX_RATIO, HEDGE_MIN_DELAY_MS,
+    HEDGE_MIN_SAMPLES, RATE_LIMIT_BASE_DELAY_SECONDS, RATE_LIMIT_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_ATTEMPTS, RETRY_MAX_DELAY_SECONDS,
+    STALE_CACHE_MAX_AGE_SECONDS, STALE_CACHE_MAX_ENTRIES
+)
+from app.services.executor_service import ExecutorService
+from app.services.metrics_service import (
+    CIRCUIT_REJECTED, CIRCUIT_STATE, HEDGED_REQUESTS, PROVIDER_CALL_FAILURES, PROVIDER_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Instante (reloj monotónico) en que vence el request en curso; None si no tiene deadline
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceededError(TimeoutError):
+    """El request agotó su deadline; se responde 504."""
+
+
+class CircuitOpenError(Exception):
+    """El circuito del destino está abierto: se falla sin llamar al proveedor y se responde 503 con Retry-After."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def remaining_time() -> Optional[float]:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Limita el bloque (y las tareas que encole) a `seconds`; nunca alarga un deadline heredado más estricto."""
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None and current < deadline:
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def call_timeout(operation: str, operation_timeout: float) -> float:
+    """Timeout de una llamada: el de la operación, recortado a lo que quede del deadline del request."""
+    remaining = remaining_time()
+    if remaining is None:
+        return operation_timeout
+    if remaining <= 0:
+        raise DeadlineExceededError(f"Se agotó el deadline del request antes de {operation}")
+    return min(operation_timeout, remaining)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    # Pinecone expone `status` y OpenAI `status_code`
+    for attribute in ("status", "status_code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_transient(error: BaseException) -> bool:
+    """Errores que vale la pena reintentar: timeouts, conexión, rate limit y 5xx."""
+    if isinstance(error, (DeadlineExceededError, CircuitOpenError)):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    name = type(error).__name__.lower()
+    if any(marker in name for marker in ("timeout", "connection", "ratelimit", "maxretry", "protocol")):
+        return True
+    return "rate limit" in str(error).lower()
+
+
+def is_unavailable(error: BaseException) -> bool:
+    """El proveedor no respondió a tiempo o no está disponible; se puede responder con resultados cacheados."""
+    return isinstance(error, (DeadlineExceededError, CircuitOpenError)) or is_transient(error)
+
+
+def failure_reason(error: BaseException) -> str:
+    status = _status_code(error)
+    if status == 429 or "rate limit" in str(error).lower():
+        return "rate_limit"
+    if status is not None:
+        return "server_error" if status >= 500 else "timeout"
+    if isinstance(error, TimeoutError) or "timeout" in type(error).__name__.lower():
+        return "timeout"
+    return "connection"
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    # Formato de x-ratelimit-reset-* de OpenAI: "20ms", "1.5s", "6m0s"
+    parts = _DURATION_PART.findall(value.strip())
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    # Los 429 de OpenAI traen Retry-After y los headers de reset del cupo; se respeta el mayor
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    delays = []
+    for header, scale in (("retry-after", 1.0), ("retry-after-ms", 0.001)):
+        try:
+            delays.append(float(headers.get(header)) * scale)
+        except (TypeError, ValueError):
+            pass
+    if failure_reason(error) == "rate_limit":
+        for header in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+            value = headers.get(header)
+            duration = _parse_duration(value) if value else None
+            if duration is not None:
+                delays.append(duration)
+    return max(delays) if delays else None
+
+
+def backoff_delay(attempt: int, error: Optional[BaseException] = None) -> float:
+    """Backoff exponencial con jitter completo, acotado a RETRY_MAX_DELAY_SECONDS.
+
+    Los rate limits usan una escala propia (RATE_LIMIT_*), porque el cupo tarda segundos en reponerse.
+    """
+    base_delay, max_delay = RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS
+    if error is not None and failure_reason(error) == "rate_limit":
+        base_delay, max_delay = RATE_LIMIT_BASE_DELAY_SECONDS, RATE_LIMIT_MAX_DELAY_SECONDS
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+    retry_after = _retry_after(error) if error is not None else None
+    if retry_after:
+        delay = max(delay, min(retry_after, max_delay))
+    return delay
+
+
+class CircuitBreaker:
+    """Circuito de un destino (proveedor + índice o modelo).
+
+    Tras `failure_threshold` fallos transitorios seguidos se abre y las llamadas fallan de inmediato
+    durante `reset_seconds`; luego deja pasar una sola llamada de prueba y se cierra si responde.
+    Los errores del cliente (4xx) cuentan como respuesta: el destino está vivo.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    _state_values = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, provider: str, target: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.provider = provider
+        self.target = target
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                elapsed = time.monotonic() - self._opened_at
+                if elapsed < self.reset_seconds:
+                    self._reject(self.reset_seconds - elapsed)
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self._reject(1)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                logger.info("Circuit %s/%s closed", self.provider, self.target)
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(
+                        "Circuit %s/%s opened after %d consecutive failures", self.provider, self.target, self._failures
+                    )
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def release(self):
+        # La llamada se abandonó por el deadline del request: no dice nada sobre el destino
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _reject(self, retry_after: float):
+        CIRCUIT_REJECTED.inc(provider=self.provider, target=self.target)
+        raise CircuitOpenError(
+            f"{self.provider}/{self.target} no está disponible, reintente más tarde", max(1, math.ceil(retry_after))
+        )
+
+    def _set_state(self, state: str):
+        self.state = state
+        CIRCUIT_STATE.set(self._state_values[state], provider=self.provider, target=self.target)
+
+
+class _LatencyTracker:
+    """Ventana de latencias recientes de una lectura, para fijar el retardo del hedge en su p95."""
+
+    def __init__(self, window: int = HEDGE_LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._p95: Optional[float] = None
+        self._since_update = 0
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self._since_update += 1
+            # Ordenar la ventana en cada muestra sería caro; el p95 se recalcula cada 16 muestras
+            if self._p95 is None or self._since_update >= 16:
+                ordered = sorted(self._samples)
+                self._p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+                self._since_update = 0
+
+    def start_call(self) -> Optional[float]:
+        """Cuenta la llamada y devuelve tras cuánto lanzar la copia (None si aún no hay muestras suficientes)."""
+        with self._lock:
+            self._calls += 1
+            if self._calls >= 10000:
+                # Decae el historial para que el cupo refleje la carga reciente
+                self._calls //= 2
+                self._hedges //= 2
+            if len(self._samples) < HEDGE_MIN_SAMPLES or self._p95 is None:
+                return None
+            return max(self._p95, HEDGE_MIN_DELAY_MS / 1000)
+
+    def try_hedge(self) -> bool:
+        # Los hedges nunca suman más de HEDGE_MAX_RATIO de carga extra sobre el proveedor
+        with self._lock:
+            if self._hedges >= self._calls * HEDGE_MAX_RATIO:
+                return False
+            self._hedges += 1
+            return True
+
+
+class ResilienceService:
+    """Deadlines, reintentos, hedging y circuit breaking para las llamadas a proveedores externos."""
+
+    _breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+    _trackers: Dict[Tuple[str, str, str], _LatencyTracker] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def breaker(provider: str, target: str) -> CircuitBreaker:
+        key = (provider, target)
+        breaker = ResilienceService._breakers.get(key)
+        if breaker is None:
+            with ResilienceService._lock:
+                breaker = ResilienceService._breakers.get(key)
+                if breaker is None:
+                    breaker = ResilienceService._breakers[key] = CircuitBreaker(provider, target)
+        return breaker
+
+    @staticmethod
+    def _tracker(provider: str, target: str, operation: str) -> _LatencyTracker:
+        key = (provider, target, operation)
+        tracker = ResilienceService._trackers.get(key)
+        if tracker is None:
+            with ResilienceService._lock:
+                tracker = ResilienceService._trackers.get(key)
+                if tracker is None:
+                    tracker = ResilienceService._trackers[key] = _LatencyTracker()
+        return tracker
+
+    @staticmethod
+    def call(provider: str, target: str, operation: str, fn: Callable[[float], Any], operation_timeout: float,
+             hedge: bool = False, max_attempts: int = RETRY_MAX_ATTEMPTS,
+             on_retry: Optional[Callable[[BaseException], None]] = None) -> Any:
+        """Ejecuta `fn(timeout)` contra `provider/target` con deadline, reintentos y circuit breaker.
+
+        `fn` recibe el timeout de la llamada y debe pasárselo al SDK. Con `hedge=True` (solo lecturas
+        idempotentes) se lanza una copia si la primera tarda más que el p95 reciente y gana la que
+        responda antes. Los reintentos nunca esperan más allá del deadline del request.
+        """
+        breaker = ResilienceService.breaker(provider, target)
+        attempt = 0
+        while True:
+            timeout = call_timeout(operation, operation_timeout)
+            breaker.before_call()
+            try:
+                if hedge:
+                    result = ResilienceService._hedged(provider, target, operation, fn, timeout)
+                else:
+                    result = fn(timeout)
+            except DeadlineExceededError:
+                breaker.release()
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    breaker.record_success()
+                    raise
+                reason = failure_reason(e)
+                if reason == "rate_limit":
+                    # Un 429 es una respuesta del destino: no abre el circuito, se espera al cupo
+                    breaker.release()
+                else:
+                    breaker.record_failure()
+                PROVIDER_CALL_FAILURES.inc(provider=provider, operation=operation, reason=reason)
+
+                attempt += 1
+                if attempt >= max_attempts:
+                    raise
+                delay = backoff_delay(attempt, e)
+                remaining = remaining_time()
+                if remaining is not None and delay >= remaining:
+                    raise
+                PROVIDER_RETRIES.inc(provider=provider, operation=operation)
+                if on_retry is not None:
+                    on_retry(e)
+                logger.warning(
+                    "%s %s/%s failed (%s), retry %d in %.2fs: %s",
+                    operation, provider, target, reason, attempt, delay, e
+                )
+                time.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
+
+    @staticmethod
+    def _hedged(provider: str, target: str, operation: str, fn: Callable[[float], Any], timeout: float) -> Any:
+        tracker = ResilienceService._tracker(provider, target, operation)
+        started = time.monotonic()
+
+        def timed():
+            call_started = time.perf_counter()
+            result = fn(timeout)
+            tracker.observe(time.perf_counter() - call_started)
+            return result
+
+        futures = [ExecutorService.submit(ExecutorService.PROVIDER_READ, timed)]
+        delay = tracker.start_call()
+        if delay is not None and delay < timeout:
+            done, _ = wait(futures, timeout=delay)
+            if not done and tracker.try_hedge():
+                HEDGED_REQUESTS.inc(operation=operation, outcome="sent")
+                futures.append(ExecutorService.submit(ExecutorService.PROVIDER_READ, timed))
+
+        pending = set(futures)
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = wait(
+                    pending, timeout=max(0.0, started + timeout - time.monotonic()), return_when=FIRST_COMPLETED
+                )
+                if not done:
+                    remaining = remaining_time()
+                    if remaining is not None and remaining <= 0:
+                        raise DeadlineExceededError(f"Se agotó el deadline del request durante {operation}")
+                    raise TimeoutError(f"{operation} en {provider}/{target} no respondió en {timeout:.2f}s")
+                for future in done:
+                    if future.exception() is None:
+                        if len(futures) > 1:
+                            outcome = "hedge_won" if future is futures[1] else "primary_won"
+                            HEDGED_REQUESTS.inc(operation=operation, outcome=outcome)
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            # La copia perdedora que aún no arrancó no llega a llamar al proveedor
+            for future in pending:
+                future.cancel()
+
+
+class StaleResultCache:
+    """Últimos resultados correctos por clave, para responder mientras el proveedor no está disponible.
+
+    Solo se consulta cuando la llamada falla por timeout, error transitorio o circuito abierto;
+    nunca reemplaza a una respuesta fresca.
+    """
+
+    def __init__(self, max_entries: int = STALE_CACHE_MAX_ENTRIES, max_age: float = STALE_CACHE_MAX_AGE_SECONDS):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.max_age:
+                del self._entries[key]
+                return None
+            return value
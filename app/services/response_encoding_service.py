@@ -0,0 +1,101 @@
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from starlette.responses import Response
+
+from app.services.metrics_service import RESPONSE_BYTES, RESPONSE_ENCODING_SECONDS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Alias aceptados en Accept para cada formato
+_MEDIA_TYPES = {
+    JSON_MEDIA_TYPE: JSON_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE: NDJSON_MEDIA_TYPE,
+    "application/jsonl": NDJSON_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE: MSGPACK_MEDIA_TYPE,
+    "application/x-msgpack": MSGPACK_MEDIA_TYPE,
+    "application/vnd.msgpack": MSGPACK_MEDIA_TYPE,
+}
+_FORMAT_NAMES = {JSON_MEDIA_TYPE: "json", NDJSON_MEDIA_TYPE: "ndjson", MSGPACK_MEDIA_TYPE: "msgpack"}
+
+
+def _import_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("msgpack is required for MessagePack responses. Install with: pip install msgpack")
+    return msgpack
+
+
+def dumps(content: Any) -> bytes:
+    """JSON compacto en bytes; usa orjson si está instalado."""
+    if orjson is not None:
+        return orjson.dumps(content, default=str, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Elige JSON, NDJSON o MessagePack según el header Accept (con pesos q); JSON por defecto."""
+    best, best_quality = JSON_MEDIA_TYPE, 0.0
+    for part in (accept or "").split(","):
+        media_type, _, parameters = part.partition(";")
+        candidate = _MEDIA_TYPES.get(media_type.strip().lower())
+        if candidate is None:
+            continue
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > best_quality:
+            best, best_quality = candidate, quality
+    return best
+
+
+def _pack_vectors(matches: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    import numpy as np
+
+    packed = []
+    for match in matches:
+        if match.get("vector"):
+            # El vector viaja como bytes float32 little-endian: ~4 bytes por dimensión en lugar de ~20 en texto
+            match = {**match, "vector": np.asarray(match["vector"], dtype="<f4").tobytes()}
+        elif match.get("matches"):
+            # En la búsqueda agrupada los vectores van dentro de los chunks de cada documento
+            match = {**match, "matches": _pack_vectors(match["matches"])}
+        packed.append(match)
+    return packed
+
+
+class ResponseEncoder:
+    """Respuestas ya serializadas que evitan la validación y el jsonable_encoder de FastAPI.
+
+    Los resultados de búsqueda son dicts planos que ya tienen la forma final, así que se
+    serializan directamente al formato negociado. NDJSON es solo un formato de líneas: la búsqueda
+    ya terminó cuando se codifica, así que el cuerpo se envía entero como en JSON.
+    """
+
+    @staticmethod
+    def matches_response(matches: List[Dict[str, Any]], accept: Optional[str]) -> Response:
+        media_type = negotiate(accept)
+        started = time.perf_counter()
+        if media_type == NDJSON_MEDIA_TYPE:
+            body = b"".join(dumps(match) + b"\n" for match in matches)
+        elif media_type == MSGPACK_MEDIA_TYPE:
+            body = _import_msgpack().packb(_pack_vectors(matches), use_bin_type=True, default=str)
+        else:
+            body = dumps(matches)
+        RESPONSE_ENCODING_SECONDS.observe(time.perf_counter() - started, format=_FORMAT_NAMES[media_type])
+        RESPONSE_BYTES.observe(len(body), format=_FORMAT_NAMES[media_type])
+        return Response(content=body, media_type=media_type)
@@ -0,0 +1,87 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+from app.configurations.config import (
+    INGEST_MAX_INFLIGHT, INGEST_MAX_INFLIGHT_PER_NAMESPACE, INGEST_RETRY_AFTER_SECONDS,
+    SEARCH_MAX_INFLIGHT, SEARCH_MAX_INFLIGHT_PER_NAMESPACE, SEARCH_RETRY_AFTER_SECONDS
+)
+from app.services.metrics_service import ADMISSION_INFLIGHT, ADMISSION_REJECTED
+
+# Clases de prioridad, de mayor a menor
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("priority", default=PRIORITY_INTERACTIVE)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+@contextmanager
+def priority_scope(priority: str):
+    """Marca todo el trabajo del bloque (y las tareas que encole) con la clase de prioridad dada."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class OverloadedError(Exception):
+    """El request supera los límites de admisión; se responde 429 con Retry-After."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Límites de requests en vuelo por clase de prioridad, globales y por namespace.
+
+    No encola: si no hay cupo se rechaza de inmediato para que el cliente reintente más tarde
+    en lugar de acumular trabajo que degradaría la latencia de todos.
+    """
+
+    _limits = {
+        PRIORITY_INTERACTIVE: (SEARCH_MAX_INFLIGHT, SEARCH_MAX_INFLIGHT_PER_NAMESPACE, SEARCH_RETRY_AFTER_SECONDS),
+        PRIORITY_BULK: (INGEST_MAX_INFLIGHT, INGEST_MAX_INFLIGHT_PER_NAMESPACE, INGEST_RETRY_AFTER_SECONDS),
+    }
+    _inflight: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+    _inflight_by_tenant: Dict[Tuple[str, str], int] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    @contextmanager
+    def admit(priority: str, tenant: str):
+        max_inflight, max_per_tenant, retry_after = AdmissionController._limits[priority]
+        key = (priority, tenant)
+
+        with AdmissionController._lock:
+            inflight = AdmissionController._inflight[priority]
+            tenant_inflight = AdmissionController._inflight_by_tenant.get(key, 0)
+            if inflight >= max_inflight or tenant_inflight >= max_per_tenant:
+                ADMISSION_REJECTED.inc(priority=priority)
+                raise OverloadedError(
+                    f"Demasiados requests {priority} en curso para {tenant}, reintente más tarde",
+                    retry_after
+                )
+            AdmissionController._inflight[priority] = inflight + 1
+            AdmissionController._inflight_by_tenant[key] = tenant_inflight + 1
+            ADMISSION_INFLIGHT.set(inflight + 1, priority=priority)
+
+        try:
+            with priority_scope(priority):
+                yield
+        finally:
+            with AdmissionController._lock:
+                AdmissionController._inflight[priority] -= 1
+                remaining = AdmissionController._inflight_by_tenant[key] - 1
+                if remaining:
+                    AdmissionController._inflight_by_tenant[key] = remaining
+                else:
+                    del AdmissionController._inflight_by_tenant[key]
+                ADMISSION_INFLIGHT.set(AdmissionController._inflight[priority], priority=priority)
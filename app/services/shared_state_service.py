@@ -0,0 +1,235 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.configurations.config import (
+    EMBEDDING_CACHE_MAX_ENTRIES, SHARED_GENERATION_SLOTS, SHARED_STATE_DIR
+)
+
+_COUNTER = struct.Struct("<Q")
+
+
+def _numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("numpy is required for shared replica segments. Install with: pip install numpy")
+    return np
+
+
+def _digest(*parts: str, size: int = 16) -> bytes:
+    return hashlib.blake2b("\0".join(parts).encode("utf-8"), digest_size=size).digest()
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Lock exclusivo entre procesos (flock) sobre `path`; se libera al cerrar el descriptor."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+class SharedGenerations:
+    """Contadores de generación por (índice, namespace) en un archivo mapeado en memoria por todos los workers.
+
+    Cada escritura confirmada incrementa la generación de su namespace; un worker que guardó datos de
+    una generación anterior sabe, con una lectura de 8 bytes y sin syscalls, que ya no son vigentes.
+    Los namespaces se reparten en `slots` contadores por hash: una colisión solo provoca una
+    invalidación de más, nunca una de menos.
+    """
+
+    def __init__(self, directory: str = SHARED_STATE_DIR, slots: int = SHARED_GENERATION_SLOTS):
+        self.path = os.path.join(directory, "generations.bin")
+        self.slots = slots
+        self._map: Optional[mmap.mmap] = None
+        self._init_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    @property
+    def map(self) -> mmap.mmap:
+        if self._map is None:
+            with self._init_lock:
+                if self._map is None:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    size = self.slots * _COUNTER.size
+                    with _file_lock(f"{self.path}.lock"):
+                        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                        try:
+                            if os.fstat(fd).st_size < size:
+                                os.ftruncate(fd, size)
+                            self._map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+                        finally:
+                            os.close(fd)
+        return self._map
+
+    def _offset(self, index_name: str, namespace: str) -> int:
+        slot = int.from_bytes(_digest(index_name, namespace, size=8), "little") % self.slots
+        return slot * _COUNTER.size
+
+    def get(self, index_name: str, namespace: str) -> int:
+        return _COUNTER.unpack_from(self.map, self._offset(index_name, namespace))[0]
+
+    def bump(self, index_name: str, namespace: str) -> int:
+        offset = self._offset(index_name, namespace)
+        shared_map = self.map
+        # El lock de archivo ordena a los procesos; el de hilos, a los hilos de este proceso
+        with self._lock, _file_lock(f"{self.path}.lock"):
+            generation = _COUNTER.unpack_from(shared_map, offset)[0] + 1
+            _COUNTER.pack_into(shared_map, offset, generation)
+        return generation
+
+
+class SharedEmbeddingCache:
+    """Caché de embeddings (modelo, dimensión, texto) -> float32 compartida por los workers en SQLite.
+
+    SQLite en modo WAL admite lectores y escritores de varios procesos, y con `mmap_size` las lecturas
+    salen de páginas mapeadas que el sistema operativo comparte entre todos ellos. Al superar
+    `max_entries` se descartan las entradas escritas hace más tiempo.
+    """
+
+    def __init__(self, directory: str = SHARED_STATE_DIR, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = os.path.join(directory, "embeddings.sqlite3")
+        self.max_entries = max_entries
+        self._connection: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            with self._lock:
+                if self._connection is None:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.execute("PRAGMA synchronous=NORMAL")
+                    connection.execute(f"PRAGMA mmap_size={1 << 30}")
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS embeddings ("
+                        "seq INTEGER PRIMARY KEY AUTOINCREMENT, key BLOB NOT NULL UNIQUE, vector BLOB NOT NULL)"
+                    )
+                    connection.commit()
+                    self._connection = connection
+        return self._connection
+
+    @staticmethod
+    def _key(model: str, dimensions: Optional[int], text: str) -> bytes:
+        return _digest(model, str(dimensions or ""), text)
+
+    def get_many(self, model: str, dimensions: Optional[int], texts: Sequence[str]) -> List[Optional[List[float]]]:
+        np = _numpy()
+        keys = [self._key(model, dimensions, text) for text in texts]
+        connection = self.connection
+        found: Dict[bytes, bytes] = {}
+        # SQLite limita la cantidad de parámetros por consulta
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            with self._lock:
+                rows = connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+            found.update(rows)
+        return [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+
+    def put_many(self, model: str, dimensions: Optional[int], texts: Sequence[str],
+                 embeddings: Sequence[Sequence[float]]):
+        np = _numpy()
+        rows = [
+            (self._key(model, dimensions, text), np.asarray(embedding, dtype=np.float32).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        connection = self.connection
+        with self._lock:
+            connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._writes += len(rows)
+            # El recorte se hace cada tanto y no en cada escritura
+            if self._writes >= max(1000, self.max_entries // 10):
+                self._writes = 0
+                connection.execute(
+                    "DELETE FROM embeddings WHERE seq <= (SELECT MAX(seq) FROM embeddings) - ?", (self.max_entries,)
+                )
+            connection.commit()
+
+
+class ReplicaSegments:
+    """Segmentos de réplicas locales en disco: los vectores se abren con np.load(mmap_mode='r').
+
+    El worker que carga un namespace desde el proveedor publica su segmento con la generación que
+    tenía al empezar; los demás lo mapean en lugar de repetir el snapshot, y las páginas de la matriz
+    quedan una sola vez en memoria aunque las usen todos los workers. IDs y metadata se leen en cada
+    proceso porque se evalúan con filtros en Python.
+    """
+
+    def __init__(self, directory: str = SHARED_STATE_DIR):
+        self.directory = os.path.join(directory, "replicas")
+
+    def _base(self, index_name: str, namespace: str) -> str:
+        return os.path.join(self.directory, _digest(index_name, namespace).hex())
+
+    @contextmanager
+    def build_lock(self, index_name: str, namespace: str):
+        """Serializa la carga de un namespace entre workers: solo uno va al proveedor."""
+        os.makedirs(self.directory, exist_ok=True)
+        with _file_lock(f"{self._base(index_name, namespace)}.lock"):
+            yield
+
+    def load(self, index_name: str, namespace: str, generation: int,
+             max_age: float) -> Optional[Tuple[List[str], Any, Any, List[Dict[str, Any]], float]]:
+        """(ids, matriz, normas, metadata, creación) del segmento de `generation`, o None si no existe o venció."""
+        np = _numpy()
+        path = f"{self._base(index_name, namespace)}.g{generation}"
+        try:
+            with open(os.path.join(path, "segment.json")) as f:
+                header = json.load(f)
+            if time.time() - header["created_at"] > max_age:
+                return None
+            matrix = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            norms = np.load(os.path.join(path, "norms.npy"), mmap_mode="r")
+            ids, metadata = [], []
+            with open(os.path.join(path, "rows.jsonl"), encoding="utf-8") as f:
+                for line in f:
+                    row = json.loads(line)
+                    ids.append(row["id"])
+                    metadata.append(row["metadata"])
+        except FileNotFoundError:
+            return None
+        return ids, matrix, norms, metadata, header["created_at"]
+
+    def save(self, index_name: str, namespace: str, generation: int, ids: List[str], matrix, norms,
+             metadata: List[Dict[str, Any]]):
+        np = _numpy()
+        base = self._base(index_name, namespace)
+        path = f"{base}.g{generation}"
+        partial_path = f"{path}.partial"
+        shutil.rmtree(partial_path, ignore_errors=True)
+        os.makedirs(partial_path)
+        np.save(os.path.join(partial_path, "vectors.npy"), np.ascontiguousarray(matrix, dtype=np.float32))
+        np.save(os.path.join(partial_path, "norms.npy"), np.ascontiguousarray(norms, dtype=np.float32))
+        with open(os.path.join(partial_path, "rows.jsonl"), "w", encoding="utf-8") as f:
+            for vector_id, row_metadata in zip(ids, metadata):
+                f.write(json.dumps({"id": vector_id, "metadata": row_metadata}, default=str) + "\n")
+        with open(os.path.join(partial_path, "segment.json"), "w") as f:
+            json.dump({"generation": generation, "size": len(ids), "created_at": time.time()}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(partial_path, path)
+
+        # Las generaciones anteriores ya no se pueden usar; quien las tenga mapeadas conserva sus páginas
+        prefix = os.path.basename(base) + ".g"
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name != os.path.basename(path) and not name.endswith(".partial"):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
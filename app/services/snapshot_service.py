@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import time
+import zlib
+from typing import Any, Dict, List, Set, Tuple
+
+from app.configurations.config import SNAPSHOT_DIR
+
+# Formato de snapshot (little-endian), versión 1:
+#
+#   "VDBSNAP1"                      magic, 8 bytes
+#   u32 header_len + header JSON    {"version", "dimension", "index", "namespace", "metric", "created_at"}
+#   página*                         una por cada SNAPSHOT_PAGE_SIZE vectores:
+#     "PAGE" + u32 count + u64 ids_len + u64 metadata_len
+#     u32[count + 1]                offsets de los IDs dentro del bloque de IDs
+#     ids_len bytes                 IDs en UTF-8, concatenados
+#     f32[count * dimension]        vectores, fila por fila
+#     u32[count + 1]                offsets de la metadata dentro del bloque de metadata
+#     metadata_len bytes            un objeto JSON por vector, concatenados
+#   footer JSON                     {"pages": [{"offset", "count", "crc32"}], "vectors"}
+#   u64 footer_offset + "VDBSNAP1"  cola fija de 16 bytes
+#
+# Cada columna de una página es contigua, así que los vectores se leen con un único frombuffer, y el
+# footer permite leer cualquier página sin recorrer las anteriores (importación paralela y reanudable).
+MAGIC = b"VDBSNAP1"
+PAGE_MAGIC = b"PAGE"
+FORMAT_VERSION = 1
+_PAGE_HEADER = struct.Struct("<4sIQQ")
+_TRAILER = struct.Struct("<Q8s")
+_NAME_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]{0,127}")
+
+
+class SnapshotFormatError(ValueError):
+    pass
+
+
+def _numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("numpy is required for namespace snapshots. Install with: pip install numpy")
+    return np
+
+
+def snapshot_path(name: str) -> str:
+    """Ruta del snapshot dentro de SNAPSHOT_DIR; el nombre no puede salir de ese directorio."""
+    if not _NAME_PATTERN.fullmatch(name) or ".." in name:
+        raise ValueError(f"Nombre de snapshot inválido: {name!r} (letras, números, '.', '_' y '-')")
+    return os.path.join(SNAPSHOT_DIR, name if name.endswith(".vdbsnap") else f"{name}.vdbsnap")
+
+
+def _column(values: List[bytes]) -> Tuple[bytes, bytes]:
+    np = _numpy()
+    offsets = np.zeros(len(values) + 1, dtype=np.uint64)
+    np.cumsum(np.fromiter((len(value) for value in values), dtype=np.uint64, count=len(values)), out=offsets[1:])
+    if offsets[-1] > 0xFFFFFFFF:
+        raise SnapshotFormatError("Una columna de la página supera 4 GiB; reducir SNAPSHOT_PAGE_SIZE")
+    return offsets.astype("<u4").tobytes(), b"".join(values)
+
+
+class SnapshotWriter:
+    """Escribe un snapshot página a página; el archivo aparece con su nombre final recién al cerrarlo."""
+
+    def __init__(self, path: str, dimension: int, header: Dict[str, Any]):
+        self.path = path
+        self.dimension = dimension
+        self.pages: List[Dict[str, int]] = []
+        self.vectors = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._partial_path = f"{path}.partial"
+        self._file = open(self._partial_path, "wb")
+        header_bytes = json.dumps(
+            {**header, "version": FORMAT_VERSION, "dimension": dimension, "created_at": time.time()}
+        ).encode("utf-8")
+        self._file.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+
+    def write_page(self, ids: List[str], vectors: List[Any], metadatas: List[Dict[str, Any]]):
+        if not ids:
+            return
+        np = _numpy()
+        matrix = np.asarray(vectors, dtype="<f4")
+        if matrix.shape != (len(ids), self.dimension):
+            raise SnapshotFormatError(
+                f"Se esperaban {len(ids)} vectores de dimensión {self.dimension}, llegaron {matrix.shape}"
+            )
+        id_offsets, id_blob = _column([vector_id.encode("utf-8") for vector_id in ids])
+        metadata_offsets, metadata_blob = _column([
+            json.dumps(metadata or {}, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+            for metadata in metadatas
+        ])
+        payload = (
+            _PAGE_HEADER.pack(PAGE_MAGIC, len(ids), len(id_blob), len(metadata_blob))
+            + id_offsets + id_blob + matrix.tobytes() + metadata_offsets + metadata_blob
+        )
+        self.pages.append({"offset": self._file.tell(), "count": len(ids), "crc32": zlib.crc32(payload)})
+        self._file.write(payload)
+        self.vectors += len(ids)
+
+    def close(self) -> Dict[str, Any]:
+        footer_offset = self._file.tell()
+        self._file.write(json.dumps({"pages": self.pages, "vectors": self.vectors}).encode("utf-8"))
+        self._file.write(_TRAILER.pack(footer_offset, MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._partial_path, self.path)
+        return {"pages": len(self.pages), "vectors": self.vectors, "bytes": os.path.getsize(self.path)}
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._partial_path):
+            os.remove(self._partial_path)
+
+
+class SnapshotReader:
+    """Lee páginas sueltas de un snapshot; es seguro usarlo desde varios hilos (os.pread)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        size = os.fstat(self._fd).st_size
+        if size < len(MAGIC) + _TRAILER.size or os.pread(self._fd, len(MAGIC), 0) != MAGIC:
+            self.close()
+            raise SnapshotFormatError(f"{path} no es un snapshot")
+        footer_offset, magic = _TRAILER.unpack(os.pread(self._fd, _TRAILER.size, size - _TRAILER.size))
+        if magic != MAGIC:
+            self.close()
+            raise SnapshotFormatError(f"{path} está incompleto (falta el footer)")
+        (header_len,) = struct.unpack("<I", os.pread(self._fd, 4, len(MAGIC)))
+        self.header: Dict[str, Any] = json.loads(os.pread(self._fd, header_len, len(MAGIC) + 4))
+        if self.header.get("version") != FORMAT_VERSION:
+            self.close()
+            raise SnapshotFormatError(f"Versión de snapshot no soportada: {self.header.get('version')}")
+        footer = json.loads(os.pread(self._fd, size - _TRAILER.size - footer_offset, footer_offset))
+        self.pages: List[Dict[str, int]] = footer["pages"]
+        self.vectors: int = footer["vectors"]
+        self._ends = [page["offset"] for page in self.pages[1:]] + [footer_offset]
+
+    @property
+    def dimension(self) -> int:
+        return self.header["dimension"]
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifica este contenido: cambia si el snapshot se vuelve a exportar con el mismo nombre."""
+        identity = json.dumps([self.header.get("created_at"), [page["crc32"] for page in self.pages]])
+        return hashlib.blake2b(identity.encode("utf-8"), digest_size=16).hexdigest()
+
+    def read_page(self, number: int) -> Tuple[List[str], Any, List[Dict[str, Any]]]:
+        """Devuelve (ids, matriz float32 count x dimension, metadatas) de la página `number`."""
+        np = _numpy()
+        page = self.pages[number]
+        payload = os.pread(self._fd, self._ends[number] - page["offset"], page["offset"])
+        if zlib.crc32(payload) != page["crc32"]:
+            raise SnapshotFormatError(f"La página {number} de {self.path} está corrupta")
+        magic, count, ids_len, metadata_len = _PAGE_HEADER.unpack_from(payload)
+        if magic != PAGE_MAGIC or count != page["count"]:
+            raise SnapshotFormatError(f"La página {number} de {self.path} está corrupta")
+
+        position = _PAGE_HEADER.size
+        id_offsets = np.frombuffer(payload, dtype="<u4", count=count + 1, offset=position)
+        position += id_offsets.nbytes
+        id_blob = payload[position:position + ids_len]
+        position += ids_len
+        vectors = np.frombuffer(payload, dtype="<f4", count=count * self.dimension, offset=position)
+        position += vectors.nbytes
+        metadata_offsets = np.frombuffer(payload, dtype="<u4", count=count + 1, offset=position)
+        position += metadata_offsets.nbytes
+        metadata_blob = payload[position:position + metadata_len]
+
+        ids = [id_blob[id_offsets[i]:id_offsets[i + 1]].decode("utf-8") for i in range(count)]
+        metadatas = [json.loads(metadata_blob[metadata_offsets[i]:metadata_offsets[i + 1]]) for i in range(count)]
+        return ids, vectors.reshape(count, self.dimension), metadatas
+
+    def close(self):
+        os.close(self._fd)
+
+
+class ImportCheckpoint:
+    """Páginas ya importadas de un snapshot a un destino, persistidas para poder reanudar.
+
+    El destino entra en el nombre del archivo como hash: índice y namespace pueden traer '/' o '..'
+    y el checkpoint nunca debe salir del directorio del snapshot. Guarda además la huella del
+    snapshot; si el archivo se reemplazó desde entonces, el checkpoint se descarta.
+    """
+
+    def __init__(self, snapshot: str, index_name: str, namespace: str, fingerprint: str):
+        destination = hashlib.blake2b(f"{index_name}\0{namespace}".encode("utf-8"), digest_size=16).hexdigest()
+        self.path = f"{snapshot}.{destination}.checkpoint.json"
+        self.fingerprint = fingerprint
+        self.done: Set[int] = set()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            if state.get("fingerprint") == fingerprint:
+                self.done = set(state["done_pages"])
+
+    def mark(self, page: int):
+        self.done.add(page)
+        # Escritura atómica: un corte a mitad nunca deja un checkpoint ilegible
+        partial_path = f"{self.path}.partial"
+        with open(partial_path, "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "done_pages": sorted(self.done)}, f)
+        os.replace(partial_path, self.path)
+
+    def clear(self):
+        self.done = set()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
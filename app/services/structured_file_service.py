@@ -0,0 +1,167 @@
+import csv
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from app.models.columnar_batch import ColumnarBatch
+from app.models.models import StructuredIngestionConfig
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Columnas del export histórico de startups; se usan si la subida no define otras y existen en el CSV
+DEFAULT_CSV_EMBEDDING_COLUMNS = ['Status', 'Name', 'Lastname', 'Startup', 'Email', 'Call']
+
+
+class _RowMapping:
+    """Expone una fila de csv.reader como mapping para `str.format_map` sin crear un dict por fila."""
+
+    __slots__ = ("positions", "row")
+
+    def __init__(self, positions: Dict[str, int]):
+        self.positions = positions
+        self.row: List[str] = []
+
+    def __getitem__(self, key: str) -> str:
+        position = self.positions.get(key)
+        if position is None or position >= len(self.row):
+            return ""
+        return self.row[position]
+
+
+class _DictMapping(dict):
+    def __missing__(self, key: str) -> str:
+        return ""
+
+
+def _to_metadata_value(value: Any) -> Any:
+    # Pinecone solo acepta strings, números, booleanos y listas de strings en la metadata
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return value
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class StructuredFileService:
+    def __init__(self, max_batch_chars: int = 200000):
+        self.max_batch_chars = max_batch_chars
+
+    def read_batches(self, lines: Iterable[str], file_extension: str,
+                     config: Optional[StructuredIngestionConfig] = None) -> Iterator[ColumnarBatch]:
+        config = config or StructuredIngestionConfig()
+        if file_extension == '.csv':
+            return self.read_csv_batches(lines, config)
+        if file_extension == '.jsonl':
+            return self.read_jsonl_batches(lines, config)
+        raise ValueError(f"Unsupported structured file extension: {file_extension}")
+
+    def read_csv_batches(self, lines: Iterable[str], config: StructuredIngestionConfig) -> Iterator[ColumnarBatch]:
+        reader = csv.reader(lines, delimiter=config.delimiter)
+        header = next(reader, None)
+        if not header:
+            return
+        header[0] = header[0].lstrip('\ufeff')
+        positions = {name: i for i, name in enumerate(header)}
+
+        embedding_columns = config.embedding_columns or [
+            column for column in DEFAULT_CSV_EMBEDDING_COLUMNS if column in positions
+        ] or header
+        embedding_positions = [positions[column] for column in embedding_columns if column in positions]
+        metadata_positions = [
+            (column, positions[column]) for column in (config.metadata_columns or header) if column in positions
+        ]
+        template_row = _RowMapping(positions) if config.embedding_template else None
+
+        texts: List[str] = []
+        columns: Dict[str, List[Any]] = {column: [] for column, _ in metadata_positions}
+        batch_chars = 0
+        row_offset = 0
+
+        for row in reader:
+            if not row:
+                continue
+
+            if template_row is not None:
+                template_row.row = row
+                text = config.embedding_template.format_map(template_row).strip()
+            else:
+                text = " | ".join(
+                    row[position] for position in embedding_positions if position < len(row) and row[position]
+                )
+            if not text:
+                continue
+
+            if texts and (len(texts) >= config.batch_rows or batch_chars + len(text) > self.max_batch_chars):
+                yield ColumnarBatch(texts, columns, row_offset)
+                row_offset += len(texts)
+                texts = []
+                columns = {column: [] for column, _ in metadata_positions}
+                batch_chars = 0
+
+            texts.append(text)
+            batch_chars += len(text)
+            for column, position in metadata_positions:
+                columns[column].append(row[position] if position < len(row) else None)
+
+        if texts:
+            yield ColumnarBatch(texts, columns, row_offset)
+
+    def read_jsonl_batches(self, lines: Iterable[str], config: StructuredIngestionConfig) -> Iterator[ColumnarBatch]:
+        metadata_columns = set(config.metadata_columns) if config.metadata_columns else None
+
+        texts: List[str] = []
+        columns: Dict[str, List[Any]] = {}
+        batch_chars = 0
+        row_offset = 0
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = _json_loads(line)
+            except ValueError:
+                continue
+            if not isinstance(row, dict):
+                row = {"value": row}
+
+            text = self._jsonl_embedding_text(row, config)
+            if not text:
+                continue
+
+            if texts and (len(texts) >= config.batch_rows or batch_chars + len(text) > self.max_batch_chars):
+                yield ColumnarBatch(texts, columns, row_offset)
+                row_offset += len(texts)
+                texts = []
+                columns = {}
+                batch_chars = 0
+
+            rows_in_batch = len(texts)
+            for key, value in row.items():
+                if metadata_columns is not None and key not in metadata_columns:
+                    continue
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [None] * rows_in_batch
+                column.append(_to_metadata_value(value))
+            texts.append(text)
+            batch_chars += len(text)
+            for column in columns.values():
+                if len(column) < len(texts):
+                    column.append(None)
+
+        if texts:
+            yield ColumnarBatch(texts, columns, row_offset)
+
+    def _jsonl_embedding_text(self, row: Dict[str, Any], config: StructuredIngestionConfig) -> str:
+        if config.embedding_template:
+            return config.embedding_template.format_map(_DictMapping(row)).strip()
+        if config.embedding_columns:
+            return " | ".join(str(row[column]) for column in config.embedding_columns if row.get(column))
+        text = row.get("text")
+        if isinstance(text, str) and text.strip():
+            return text
+        return " | ".join(str(value) for value in row.values() if value not in (None, ""))
@@ -1,18 +1,13 @@
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from typing import List, Dict, Any
 import time
 import re
 from app.configurations.config import CHUNK_SIZE, CHUNK_OVERLAP
+from app.services.metrics_service import TEXT_SPLIT_SECONDS
 
 
 class TextSplitterService:
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len,
-            is_separator_regex=False,
-        )
+        self._text_splitter = None
         
         self.smart_separators = [
             r'\n\n\n+',  # Multiple line breaks (new sections)
@@ -24,14 +19,31 @@ class TextSplitterService:
             r' '         # Spaces (final fallback)
         ]
     
+    @property
+    def text_splitter(self):
+        # langchain es pesado de importar; solo se carga cuando hace falta dividir texto
+        if self._text_splitter is None:
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+            self._text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=CHUNK_SIZE,
+                chunk_overlap=CHUNK_OVERLAP,
+                length_function=len,
+                is_separator_regex=False,
+            )
+        return self._text_splitter
+    
     def split_text_with_metadata(self, text: str, original_id: str, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
         file_type = metadata.get("file_type", "")
         
-        if file_type == ".pdf":
-            cleaned_text = self._clean_pdf_text(text)
-            chunks = self._smart_split_text(cleaned_text)
-        else:
-            chunks = self.text_splitter.split_text(text)
+        with TEXT_SPLIT_SECONDS.time(span="split", file_type=file_type or "data"):
+            if file_type == ".pdf":
+                cleaned_text = self._clean_pdf_text(text)
+                chunks = self._smart_split_text(cleaned_text)
+            elif file_type == ".html":
+                # El extractor ya dejó encabezados y bloques como límites de párrafo
+                chunks = self._smart_split_text(text)
+            else:
+                chunks = self.text_splitter.split_text(text)
         
         timestamp = int(time.time() * 1000)
         
@@ -0,0 +1,287 @@
+import asyncio
+import io
+import os
+import queue
+from tempfile import SpooledTemporaryFile
+from typing import Any, Dict, Iterator, List, Optional
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+
+from app.configurations.config import (
+    UPLOAD_MAX_BYTES, UPLOAD_MAX_FILE_BYTES, UPLOAD_MAX_TEXT_FILE_BYTES, UPLOAD_SPOOL_MAX_MEMORY
+)
+from app.models.models import DataItem
+from app.models.uploaded_file import UploadedFile
+from app.services.executor_service import ExecutorService
+from app.services.file_processor_service import FileProcessorService
+from app.services.metrics_service import UPLOAD_BYTES, UPLOAD_SIZE
+from app.services.scheduler_service import PRIORITY_BULK, AdmissionController
+from app.services.vector_db_service_interface import VectorDBServiceInterface
+
+
+class UploadTooLargeError(Exception):
+    """El cuerpo o alguno de sus archivos supera el límite configurado; se responde 413."""
+
+
+def _import_multipart():
+    # python-multipart se importa solo al recibir la primera subida
+    try:
+        from python_multipart.multipart import MultipartParser, parse_options_header
+    except ImportError:
+        try:
+            from multipart.multipart import MultipartParser, parse_options_header
+        except ImportError:
+            raise ImportError("python-multipart is required for file uploads. Install with: pip install python-multipart")
+    return MultipartParser, parse_options_header
+
+
+class _QueueReader(io.RawIOBase):
+    """Stream de solo lectura que el event loop alimenta con los trozos del cuerpo del request.
+
+    La cola es acotada: si el consumidor (extracción + embeddings) va más lento que el cliente,
+    el productor espera en lugar de acumular el archivo en memoria.
+    """
+
+    def __init__(self, max_chunks: int = 16):
+        self._queue: queue.Queue = queue.Queue(max_chunks)
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self._error: Optional[BaseException] = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            if self._error is not None:
+                raise self._error
+            if self._eof:
+                return 0
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer = memoryview(chunk)
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def try_feed(self, chunk: Optional[bytes]) -> bool:
+        # Si el consumidor ya cerró el stream (terminó o falló) los datos se descartan
+        if self.closed:
+            return True
+        try:
+            self._queue.put_nowait(chunk)
+            return True
+        except queue.Full:
+            return False
+
+    async def feed(self, chunk: Optional[bytes]):
+        # Espera hueco en la cola desde el event loop, sin ocupar un hilo mientras el consumidor va lento
+        delay = 0.001
+        while not self.try_feed(chunk):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def abort(self, error: BaseException):
+        self._error = error
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class _MultipartReceiver:
+    """Parser incremental del cuerpo multipart que entrega cada archivo al consumidor en cuanto empieza.
+
+    Los formatos de texto se entregan como stream mientras siguen llegando; PDF y DOCX necesitan
+    acceso aleatorio, así que se acumulan en un spool que pasa a disco al superar
+    UPLOAD_SPOOL_MAX_MEMORY y se entregan al terminar la parte.
+    """
+
+    def __init__(self, file_processor: FileProcessorService, boundary: bytes, parser_cls, parse_options_header):
+        self.file_processor = file_processor
+        self.streamable_extensions = file_processor.text_extensions | file_processor.structured_extensions
+        self.structured_extensions = file_processor.structured_extensions
+        self.parse_options_header = parse_options_header
+        self.total_bytes = 0
+        self.file_count = 0
+        self._events = []
+        self._files: queue.Queue = queue.Queue()
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._reset_part()
+        self.parser = parser_cls(boundary, {
+            "on_part_begin": lambda: self._events.append(("part_begin", b"")),
+            "on_part_data": lambda data, start, end: self._events.append(("part_data", data[start:end])),
+            "on_part_end": lambda: self._events.append(("part_end", b"")),
+            "on_header_field": lambda data, start, end: self._events.append(("header_field", data[start:end])),
+            "on_header_value": lambda data, start, end: self._events.append(("header_value", data[start:end])),
+            "on_header_end": lambda: self._events.append(("header_end", b"")),
+            "on_headers_finished": lambda: self._events.append(("headers_finished", b"")),
+        })
+
+    def files(self) -> Iterator[UploadedFile]:
+        """Iterador bloqueante para el hilo consumidor; termina con la última parte o falla si se aborta."""
+        while True:
+            item = self._files.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    async def feed(self, chunk: bytes):
+        self.total_bytes += len(chunk)
+        if self.total_bytes > UPLOAD_MAX_BYTES:
+            raise UploadTooLargeError(f"El cuerpo supera el máximo de {UPLOAD_MAX_BYTES} bytes")
+        self.parser.write(chunk)
+        await self._process_events()
+
+    async def finish(self):
+        self.parser.finalize()
+        await self._process_events()
+        if not self.file_count:
+            raise ValueError("No se recibió ningún archivo en el cuerpo multipart")
+        self._files.put(None)
+
+    def abort(self, error: BaseException):
+        if self._reader is not None:
+            self._reader.abort(error)
+        if self._spool is not None:
+            self._spool.close()
+        self._files.put(error)
+
+    def _reset_part(self):
+        self._file_name: Optional[str] = None
+        self._file_extension: Optional[str] = None
+        self._part_bytes = 0
+        self._reader: Optional[_QueueReader] = None
+        self._spool: Optional[SpooledTemporaryFile] = None
+
+    async def _process_events(self):
+        events, self._events = self._events, []
+        for event, data in events:
+            if event == "part_begin":
+                self._headers = {}
+            elif event == "header_field":
+                self._header_field += data
+            elif event == "header_value":
+                self._header_value += data
+            elif event == "header_end":
+                self._headers[self._header_field.lower()] = self._header_value
+                self._header_field = b""
+                self._header_value = b""
+            elif event == "headers_finished":
+                self._start_part()
+            elif event == "part_data":
+                await self._write_part(data)
+            elif event == "part_end":
+                await self._end_part()
+
+    def _start_part(self):
+        _, options = self.parse_options_header(self._headers.get(b"content-disposition", b""))
+        file_name = options.get(b"filename")
+        if file_name is None:
+            # Los campos de formulario sin archivo se ignoran; la configuración viaja en la query
+            return
+
+        self._file_name = os.path.basename(file_name.decode("utf-8", "ignore").replace("\\", "/")) or "file"
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+        self._file_extension = self.file_processor.detect_file_extension(self._file_name, content_type)
+
+        if self._file_extension in self.streamable_extensions:
+            self._reader = _QueueReader()
+            self._files.put(UploadedFile(self._file_name, self._file_extension, io.BufferedReader(self._reader)))
+        else:
+            self._spool = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY)
+
+    async def _write_part(self, data: bytes):
+        if self._file_name is None:
+            return
+        self._part_bytes += len(data)
+        # Solo CSV/JSONL se procesan por lotes; el resto se extrae completo en memoria
+        max_bytes = UPLOAD_MAX_FILE_BYTES if self._file_extension in self.structured_extensions else min(
+            UPLOAD_MAX_FILE_BYTES, UPLOAD_MAX_TEXT_FILE_BYTES
+        )
+        if self._part_bytes > max_bytes:
+            raise UploadTooLargeError(f"El archivo {self._file_name} supera el máximo de {max_bytes} bytes")
+
+        if self._reader is not None:
+            UPLOAD_BYTES.inc(len(data), file_type=self._file_extension, mode="stream")
+            await self._reader.feed(data)
+        else:
+            UPLOAD_BYTES.inc(len(data), file_type=self._file_extension, mode="spool")
+            # Una vez que el spool pasó a disco, la escritura sale del event loop
+            if self._part_bytes > UPLOAD_SPOOL_MAX_MEMORY:
+                await run_in_threadpool(self._spool.write, data)
+            else:
+                self._spool.write(data)
+
+    async def _end_part(self):
+        if self._file_name is None:
+            return
+        if self._reader is not None:
+            await self._reader.feed(None)
+        else:
+            self._spool.seek(0)
+            self._files.put(UploadedFile(self._file_name, self._file_extension, self._spool))
+        UPLOAD_SIZE.observe(self._part_bytes, file_type=self._file_extension)
+        self.file_count += 1
+        self._reset_part()
+
+
+class UploadService:
+    def __init__(self, vector_db_service: VectorDBServiceInterface):
+        self.vector_db_service = vector_db_service
+        self.file_processor = FileProcessorService()
+
+    async def upload_multipart(self, request: Request, provider_name: str, index_name: str, namespace: str,
+                               record: DataItem) -> List[Dict[str, Any]]:
+        """Ingesta los archivos de un cuerpo multipart a medida que llegan, sin pasar por un object store.
+
+        El parseo corre en el event loop y la extracción, embeddings y upserts en un hilo del pool
+        UPLOAD, que consume los archivos en orden; admite transferencia chunked. La admisión bulk se
+        comprueba antes de leer el cuerpo, y ningún hilo del threadpool de requests espera al cliente.
+        """
+        content_length = request.headers.get("content-length")
+        if content_length and int(content_length) > UPLOAD_MAX_BYTES:
+            raise UploadTooLargeError(f"El cuerpo supera el máximo de {UPLOAD_MAX_BYTES} bytes")
+
+        parser_cls, parse_options_header = _import_multipart()
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise ValueError("Se esperaba un cuerpo multipart/form-data con boundary")
+
+        with AdmissionController.admit(PRIORITY_BULK, f"{index_name}/{namespace}"):
+            receiver = _MultipartReceiver(self.file_processor, boundary, parser_cls, parse_options_header)
+            task = ExecutorService.submit(
+                ExecutorService.UPLOAD, self.vector_db_service.upload_files,
+                provider_name, index_name, namespace, record, receiver.files()
+            )
+            consumer = asyncio.wrap_future(task)
+
+            completed = False
+            try:
+                async for chunk in request.stream():
+                    await receiver.feed(chunk)
+                    # Si el consumidor falló no tiene sentido seguir leyendo
+                    if consumer.done():
+                        break
+                else:
+                    await receiver.finish()
+                    completed = True
+            finally:
+                if not completed:
+                    receiver.abort(ValueError("La subida se interrumpió antes de terminar"))
+                    # Si el consumidor todavía no arrancó, no llega a ejecutarse
+                    task.cancel()
+                    await asyncio.wait([consumer])
+                    # El error del consumidor es consecuencia del aborto; se marca como leído
+                    if not consumer.cancelled():
+                        consumer.exception()
+            return await consumer
@@ -1,56 +1,161 @@
+import json
+import logging
+
+from app.configurations.config import FETCH_BATCH_MAX_IDS, FETCH_BATCH_WINDOW_MS, SEARCH_TIMEOUT_SECONDS
 from app.factories.vector_db_provider_factory import VectorDBProviderFactory
-from app.models.models import IndexConfig, UpsertRequest, QueryRequest
+from app.models.models import DataItem, IndexConfig, SnapshotRequest, UpsertRequest, QueryRequest
+from app.models.uploaded_file import UploadedFile
+from app.services.metrics_service import STALE_RESULTS
+from app.services.request_coalescing_service import MicroBatcher, SingleFlight
+from app.services.resilience_service import StaleResultCache, deadline_scope, is_unavailable
+from app.services.scheduler_service import PRIORITY_BULK, PRIORITY_INTERACTIVE, AdmissionController
 from app.services.vector_db_service_interface import VectorDBServiceInterface
-from typing import List, Dict, Any, Optional
+from typing import Iterable, List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _fetch_batch(key, ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+    provider_name, index_name, namespace = key
+    provider = VectorDBProviderFactory.get_provider(provider_name)
+    fetched = provider.fetch_by_ids(index_name, ids, namespace)
+    return [fetched.get(vector_id) for vector_id in ids]
 
 
 class VectorDBService(VectorDBServiceInterface):
+    # Compartidos entre instancias: el servicio se crea por request
+    _search_flight = SingleFlight("search")
+    _fetch_batcher = MicroBatcher("fetch", _fetch_batch, FETCH_BATCH_WINDOW_MS / 1000, FETCH_BATCH_MAX_IDS)
+    # Últimos resultados correctos, para responder si el proveedor falla o su circuito está abierto
+    _stale_searches = StaleResultCache()
+    _stale_fetches = StaleResultCache()
+
     def __init__(self, provider_name: str):
+        self.provider_name = provider_name
         self.provider = VectorDBProviderFactory.get_provider(provider_name)
 
     def create_index(self, provider_name: str, config: IndexConfig):
         self.provider.create_index(config)
 
     def upsert_data(self, provider_name: str, index_name: str, upsert_request: UpsertRequest):
-        self.provider.upsert_data(index_name, upsert_request)
+        tenant = f"{index_name}/{upsert_request.namespace}"
+        with AdmissionController.admit(PRIORITY_BULK, tenant):
+            return self.provider.upsert_data(index_name, upsert_request)
+
+    def upload_files(self, provider_name: str, index_name: str, namespace: str, record: DataItem,
+                     files: Iterable[UploadedFile]) -> List[Dict[str, Any]]:
+        """Reemplaza el documento `record.id` por los archivos subidos, procesándolos a medida que llegan.
+
+        El cupo de admisión bulk lo toma UploadService antes de empezar a leer el cuerpo.
+        """
+        ingested = []
+        for uploaded_file in files:
+            try:
+                if not ingested:
+                    # El documento anterior se borra recién al llegar el primer archivo
+                    self.provider.delete_records(index_name, namespace, [record.id])
+                ingested.append(self.provider.ingest_file(
+                    index_name, namespace, record, uploaded_file.file_name,
+                    uploaded_file.file_extension, uploaded_file.stream
+                ))
+            finally:
+                # Cerrar el stream libera el spool o avisa al productor que deje de alimentarlo
+                uploaded_file.stream.close()
+        return ingested
 
     def search(self, provider_name: str, index_name: str, query_request: QueryRequest):
-        return self.provider.search(index_name, query_request)
+        tenant = f"{index_name}/{query_request.namespace}"
+        with AdmissionController.admit(PRIORITY_INTERACTIVE, tenant), deadline_scope(SEARCH_TIMEOUT_SECONDS):
+            return self._search(index_name, query_request)
+    
+    def compare_search(self, provider_name: str, index_name: str, query_request: QueryRequest) -> Dict[str, Any]:
+        tenant = f"{index_name}/{query_request.namespace}"
+        with AdmissionController.admit(PRIORITY_INTERACTIVE, tenant):
+            return self.provider.compare_search(index_name, query_request)
+    
+    def _search(self, index_name: str, query_request: QueryRequest):
+        if query_request.ids:
+            return self._fetch_by_ids(index_name, query_request.ids, query_request.namespace)
+
+        key = (
+            self.provider_name,
+            index_name,
+            query_request.namespace,
+            query_request.query,
+            query_request.top_k,
+            json.dumps(query_request.metadata_filter, sort_keys=True, default=str),
+            query_request.group_by_document,
+            query_request.chunks_per_document,
+            query_request.mmr_lambda
+        )
+        try:
+            results = self._search_flight.do(key, lambda: self.provider.search(index_name, query_request))
+        except Exception as e:
+            stale = self._stale_searches.get(key) if is_unavailable(e) else None
+            if stale is None:
+                raise
+            STALE_RESULTS.inc(operation="search")
+            logger.warning("Serving cached search results for %s/%s: %s", index_name, query_request.namespace, e)
+            results = stale
+        else:
+            self._stale_searches.put(key, results)
+        # Copia superficial para que cada request tenga su propia lista
+        return list(results)
+    
+    def _fetch_by_ids(self, index_name: str, ids: List[str], namespace: str) -> List[Dict[str, Any]]:
+        key = (self.provider_name, index_name, namespace)
+        try:
+            fetched = self._fetch_batcher.submit(key, list(ids))
+        except Exception as e:
+            if not is_unavailable(e):
+                raise
+            stale = [self._stale_fetches.get((*key, vector_id)) for vector_id in ids]
+            # Solo se responde desde caché si están todos los IDs pedidos
+            if any(match is None for match in stale):
+                raise
+            STALE_RESULTS.inc(operation="fetch")
+            logger.warning("Serving cached vectors for %s/%s: %s", index_name, namespace, e)
+            return stale
+        for vector_id, match in zip(ids, fetched):
+            if match is not None:
+                self._stale_fetches.put((*key, vector_id), match)
+        return [match for match in fetched if match is not None]
     
     def ensure_namespace_exists(self, provider_name: str, index_name: str, namespace: str):
         return self.provider.ensure_namespace_exists(index_name, namespace)
     
+    def export_namespace(self, provider_name: str, index_name: str, namespace: str,
+                         snapshot_request: SnapshotRequest) -> Dict[str, Any]:
+        with AdmissionController.admit(PRIORITY_BULK, f"{index_name}/{namespace}"):
+            return self.provider.export_namespace(index_name, namespace, snapshot_request.snapshot)
+    
+    def import_namespace(self, provider_name: str, index_name: str, namespace: str,
+                         snapshot_request: SnapshotRequest) -> Dict[str, Any]:
+        with AdmissionController.admit(PRIORITY_BULK, f"{index_name}/{namespace}"):
+            return self.provider.import_namespace(
+                index_name, namespace, snapshot_request.snapshot, snapshot_request.resume
+            )
+    
     def get_chunk_with_context(self, provider_name: str, index_name: str, chunk_id: str, namespace: str) -> Dict[str, Any]:
-        query_request = QueryRequest(
-            ids=[chunk_id],
-            top_k=1,
-            namespace=namespace
-        )
-        
-        result = self.provider.search(index_name, query_request)
-        if not result or 'matches' not in result or not result['matches']:
+        result = self._fetch_by_ids(index_name, [chunk_id], namespace)
+        if not result:
             return None
             
-        chunk = result['matches'][0]
+        chunk = result[0]
         chunk_metadata = chunk.get('metadata', {})
         
         context_chunks = {}
         
-        # Obtener chunk anterior si existe
+        # Los vecinos se piden en un único fetch
         prev_chunk_id = chunk_metadata.get('prev_chunk_id')
-        if prev_chunk_id:
-            prev_query = QueryRequest(ids=[prev_chunk_id], top_k=1, namespace=namespace)
-            prev_result = self.provider.search(index_name, prev_query)
-            if prev_result and prev_result.get('matches'):
-                context_chunks['previous'] = prev_result['matches'][0]
-        
-        # Obtener chunk siguiente si existe
         next_chunk_id = chunk_metadata.get('next_chunk_id')
-        if next_chunk_id:
-            next_query = QueryRequest(ids=[next_chunk_id], top_k=1, namespace=namespace)
-            next_result = self.provider.search(index_name, next_query)
-            if next_result and next_result.get('matches'):
-                context_chunks['next'] = next_result['matches'][0]
+        neighbour_ids = [neighbour_id for neighbour_id in (prev_chunk_id, next_chunk_id) if neighbour_id]
+        if neighbour_ids:
+            neighbours = {match['id']: match for match in self._fetch_by_ids(index_name, neighbour_ids, namespace)}
+            if prev_chunk_id in neighbours:
+                context_chunks['previous'] = neighbours[prev_chunk_id]
+            if next_chunk_id in neighbours:
+                context_chunks['next'] = neighbours[next_chunk_id]
         
         return {
             'current_chunk': chunk,
@@ -66,11 +171,11 @@ class VectorDBService(VectorDBServiceInterface):
             metadata_filter={"original_id": original_id}
         )
         
-        result = self.provider.search(index_name, query_request)
-        if not result or 'matches' not in result:
+        result = self.search(provider_name, index_name, query_request)
+        if not result:
             return []
             
-        chunks = sorted(result['matches'], key=lambda x: x.get('metadata', {}).get('chunk_index', 0))
+        chunks = sorted(result, key=lambda x: x.get('metadata', {}).get('chunk_index', 0))
         return chunks
     
     def _combine_chunks_text(self, prev_chunk: Optional[Dict], current_chunk: Dict, next_chunk: Optional[Dict]) -> str:
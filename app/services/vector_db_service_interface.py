@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
-from app.models.models import IndexConfig, UpsertRequest, QueryRequest
-from typing import List, Dict, Any
+from app.models.models import DataItem, IndexConfig, SnapshotRequest, UpsertRequest, QueryRequest
+from app.models.uploaded_file import UploadedFile
+from typing import Iterable, List, Dict, Any
 
 
 class VectorDBServiceInterface(ABC):
@@ -12,14 +13,33 @@ class VectorDBServiceInterface(ABC):
     def upsert_data(self, provider_name: str, index_name: str, upsert_request: UpsertRequest):
         pass
 
+    @abstractmethod
+    def upload_files(self, provider_name: str, index_name: str, namespace: str, record: DataItem,
+                     files: Iterable[UploadedFile]) -> List[Dict[str, Any]]:
+        pass
+
     @abstractmethod
     def search(self, provider_name: str, index_name: str, query_request: QueryRequest):
         pass
     
+    @abstractmethod
+    def compare_search(self, provider_name: str, index_name: str, query_request: QueryRequest) -> Dict[str, Any]:
+        pass
+    
     @abstractmethod
     def ensure_namespace_exists(self, provider_name: str, index_name: str, namespace: str):
         pass
     
+    @abstractmethod
+    def export_namespace(self, provider_name: str, index_name: str, namespace: str,
+                         snapshot_request: SnapshotRequest) -> Dict[str, Any]:
+        pass
+    
+    @abstractmethod
+    def import_namespace(self, provider_name: str, index_name: str, namespace: str,
+                         snapshot_request: SnapshotRequest) -> Dict[str, Any]:
+        pass
+    
     @abstractmethod
     def get_chunk_with_context(self, provider_name: str, index_name: str, chunk_id: str, namespace: str) -> Dict[str, Any]:
         pass
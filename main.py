@@ -1,21 +1,76 @@
+import time
+
+_import_started = time.perf_counter()
+
+import logging
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from app.configurations.config import (
+    METRICS_FLUSH_SECONDS, SHARED_STATE_DIR, SHARED_STATE_ENABLED, WARMUP_INDEXES, WARMUP_PROVIDER, WEB_CONCURRENCY
+)
+from app.controllers.admin_controller import router as admin_router
 from app.controllers.base_controller import router
+from app.controllers.metrics_controller import router as metrics_router
+from app.factories.vector_db_provider_factory import VectorDBProviderFactory
+from app.middlewares.deadline_middleware import setup_deadline_middleware
 from app.middlewares.exception_handler_middleware import setup_exception_handlers
+from app.middlewares.metrics_middleware import setup_metrics_middleware
+from app.middlewares.profiling_middleware import setup_profiling_middleware
+from app.services.full_vector_store import FullVectorStore
+from app.services.metrics_service import APP_IMPORT_SECONDS, APP_WARMUP_SECONDS, metrics
 from app.services.vector_db_service import VectorDBService
 from app.services.vector_db_service_interface import VectorDBServiceInterface
 
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if SHARED_STATE_ENABLED:
+        # Cada worker corre su propio lifespan: /metrics suma los contadores de todos
+        metrics.share(os.path.join(SHARED_STATE_DIR, "metrics"), METRICS_FLUSH_SECONDS)
+    try:
+        FullVectorStore().check()
+    except Exception as e:
+        # Sin almacén local siguen funcionando los índices normales; los two-stage fallarán al usarse
+        logger.error("Full vector store is not usable: %s", e)
+    if WARMUP_INDEXES:
+        warmup_started = time.perf_counter()
+        try:
+            VectorDBProviderFactory.get_provider(WARMUP_PROVIDER).warm_up(WARMUP_INDEXES)
+        except Exception as e:
+            # Un warm-up fallido no debe impedir arrancar; el primer request lo reintentará
+            logger.warning("Warm-up failed for %s: %s", WARMUP_INDEXES, e)
+        APP_WARMUP_SECONDS.set(time.perf_counter() - warmup_started)
+    yield
+
+
 app = FastAPI(
     title="Vector DB API",
     description="API para interactuar con Pinecone Vector Database",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.include_router(router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
 app.dependency_overrides[VectorDBServiceInterface] = VectorDBService
 setup_exception_handlers(app)
+setup_deadline_middleware(app)
+setup_profiling_middleware(app)
+setup_metrics_middleware(app)
+
+APP_IMPORT_SECONDS.set(time.perf_counter() - _import_started)
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=9000)
+    if WEB_CONCURRENCY > 1:
+        # Con varios workers, cada proceso importa la app por su ruta; el estado compartido vive en SHARED_STATE_DIR
+        uvicorn.run("main:app", host="0.0.0.0", port=9000, workers=WEB_CONCURRENCY)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=9000)
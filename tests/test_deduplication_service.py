@@ -0,0 +1,81 @@
+import pytest
+
+from app.models.models import DeduplicationConfig
+from app.services.deduplication_service import (
+    NUM_PERM, DeduplicationSession, _DedupStore, _fingerprint, _NamespaceIndex
+)
+
+TEXT = (
+    "Todos los derechos reservados. Queda prohibida la reproducción total o parcial de este documento "
+    "sin autorización previa y por escrito de la empresa."
+)
+
+
+def _similarity(first: str, second: str) -> float:
+    return (_fingerprint(first).signature == _fingerprint(second).signature).sum() / NUM_PERM
+
+
+def _vector(vector_id: str, text: str, owner: str):
+    return {"id": vector_id, "metadata": {"text": text, "original_id": owner}}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return _NamespaceIndex(_DedupStore(str(tmp_path / "dedup.sqlite3")), "index", "namespace")
+
+
+def test_exact_hash_ignores_case_and_whitespace():
+    assert _fingerprint(TEXT).exact_hash == _fingerprint("  " + TEXT.upper().replace(" ", "\n ")).exact_hash
+    assert _fingerprint(" \n ") is None
+
+
+def test_similarity_tracks_the_amount_of_change():
+    small_change = TEXT.replace("empresa", "compañía")
+    unrelated = "El informe trimestral muestra un aumento de las ventas en la región norte."
+    assert _similarity(TEXT, small_change) > 0.7
+    assert _similarity(TEXT, unrelated) < 0.2
+
+
+def test_find_applies_the_threshold(index):
+    near = TEXT.replace("empresa", "compañía")
+    with index.transaction():
+        index.add("canonical", _fingerprint(TEXT), "doc")
+        assert index.find(_fingerprint(TEXT.upper()), 0.9) == ("canonical", "exact")
+        similarity = _similarity(TEXT, near)
+        assert index.find(_fingerprint(near), similarity) == ("canonical", "near")
+        assert index.find(_fingerprint(near), min(1.0, similarity + 0.01)) is None
+
+
+def test_index_is_scoped_by_namespace_and_forgets_owners(index):
+    other = _NamespaceIndex(index.store, "index", "other")
+    with index.transaction():
+        index.add("canonical", _fingerprint(TEXT), "doc")
+        assert other.find(_fingerprint(TEXT), 0.9) is None
+        index.forget(["doc"])
+        assert index.find(_fingerprint(TEXT), 0.9) is None
+
+
+def test_index_survives_a_new_store(tmp_path):
+    path = str(tmp_path / "dedup.sqlite3")
+    first = _NamespaceIndex(_DedupStore(path), "index", "namespace")
+    with first.transaction():
+        first.add("canonical", _fingerprint(TEXT), "doc")
+    # Otro worker, o el mismo proceso tras reiniciar, ve los canónicos ya registrados
+    second = _NamespaceIndex(_DedupStore(path), "index", "namespace")
+    with second.transaction():
+        assert second.find(_fingerprint(TEXT), 0.9) == ("canonical", "exact")
+
+
+def test_session_reuses_the_canonical_embedding(index):
+    session = DeduplicationSession(index, DeduplicationConfig(), fetch_vectors=lambda ids: {})
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return [[1.0, 0.0] for _ in texts]
+
+    vectors = session.embed([_vector("a", TEXT, "doc1"), _vector("b", TEXT.upper(), "doc2")], embed)
+    assert len(embedded) == 1
+    assert vectors[1]["values"] == [1.0, 0.0] and vectors[1]["metadata"]["duplicate_of"] == "a"
+    report = session.report()
+    assert report["embedded"] == 1 and report["exact_duplicates"] == 1
@@ -0,0 +1,88 @@
+import contextvars
+import threading
+
+from app.services.executor_service import FairExecutor
+from app.services.scheduler_service import PRIORITY_BULK, PRIORITY_INTERACTIVE, priority_scope
+
+TIMEOUT = 5
+
+
+def _blocked(executor: FairExecutor):
+    """Ocupa el único worker del pool hasta que se libera el evento devuelto."""
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(TIMEOUT)
+
+    future = contextvars.Context().run(executor.submit, block)
+    assert started.wait(TIMEOUT)
+    return release, future
+
+
+def _submit_group(executor: FairExecutor, labels, order, priority=PRIORITY_INTERACTIVE):
+    # Un contexto vacío equivale a un request nuevo: todas sus tareas comparten grupo
+    def submit_all():
+        with priority_scope(priority):
+            return [executor.submit(order.append, label) for label in labels]
+    return contextvars.Context().run(submit_all)
+
+
+def test_groups_are_served_round_robin():
+    executor = FairExecutor("test-fair", max_workers=1)
+    release, blocker = _blocked(executor)
+    order = []
+    futures = _submit_group(executor, ["a1", "a2", "a3", "a4"], order)
+    futures += _submit_group(executor, ["b1", "b2"], order)
+
+    release.set()
+    for future in [blocker, *futures]:
+        future.result(TIMEOUT)
+    assert order == ["a1", "b1", "a2", "b2", "a3", "a4"]
+
+
+def test_interactive_tasks_run_before_bulk():
+    executor = FairExecutor("test-priority", max_workers=1)
+    release, blocker = _blocked(executor)
+    order = []
+    futures = _submit_group(executor, ["bulk1", "bulk2"], order, PRIORITY_BULK)
+    futures += _submit_group(executor, ["search"], order, PRIORITY_INTERACTIVE)
+
+    release.set()
+    for future in [blocker, *futures]:
+        future.result(TIMEOUT)
+    assert order == ["search", "bulk1", "bulk2"]
+
+
+def test_reserved_workers_never_run_bulk():
+    executor = FairExecutor("test-reserved", max_workers=2, reserved_interactive=1)
+    release, first_started = threading.Event(), threading.Event()
+    started = []
+
+    def bulk(label):
+        started.append(label)
+        first_started.set()
+        release.wait(TIMEOUT)
+
+    with priority_scope(PRIORITY_BULK):
+        bulk_futures = [executor.submit(bulk, label) for label in ("bulk1", "bulk2")]
+    assert first_started.wait(TIMEOUT)
+
+    # Con un worker bulk ocupado, la búsqueda usa el reservado y la segunda tarea bulk sigue en cola
+    assert executor.submit(lambda: "search").result(TIMEOUT) == "search"
+    assert started == ["bulk1"]
+
+    release.set()
+    for future in bulk_futures:
+        future.result(TIMEOUT)
+    assert started == ["bulk1", "bulk2"]
+
+
+def test_errors_and_context_reach_the_caller():
+    executor = FairExecutor("test-errors", max_workers=2)
+    variable = contextvars.ContextVar("variable", default=None)
+    variable.set("request")
+
+    assert executor.submit(variable.get).result(TIMEOUT) == "request"
+    future = executor.submit(lambda: 1 / 0)
+    assert isinstance(future.exception(TIMEOUT), ZeroDivisionError)
@@ -0,0 +1,61 @@
+import pytest
+
+from app.services.html_extractor_service import HtmlExtractorService
+
+PAGE = """<html><head><title>Manual</title><style>p { color: red; }</style></head>
+<body>
+  <nav><a href="/">Inicio</a></nav>
+  <h1>Instalación</h1>
+  <p>Ejecute   el
+     comando <code>pip  install  app</code> en una terminal.</p>
+  <pre>def main():
+    return  1
+</pre>
+  <ul><li>Uno</li><li>Dos</li></ul>
+  <table><tr><td>a</td><td>b</td></tr></table>
+  <script>alert("x")</script>
+  <footer>Copyright</footer>
+</body></html>"""
+
+
+@pytest.fixture(autouse=True)
+def without_tiktoken(monkeypatch):
+    # La estimación de tokens no depende de tiktoken (que puede descargar su vocabulario)
+    monkeypatch.setattr(HtmlExtractorService, "_encoding", None)
+    monkeypatch.setattr(HtmlExtractorService, "_encoding_loaded", True)
+
+
+def _extract(chunks, max_piece_chars=50000):
+    return list(HtmlExtractorService(max_piece_chars).extract(chunks, "test.html"))
+
+
+def test_keeps_visible_text_with_block_boundaries():
+    text = "\n\n".join(_extract([PAGE]))
+    assert text.startswith("Manual\n\nInstalación\n\nEjecute el comando")
+    assert "Uno\nDos" in text
+    assert "a b" in text
+    for hidden in ("color: red", "Inicio", "alert", "Copyright"):
+        assert hidden not in text
+
+
+def test_pre_and_code_keep_their_whitespace():
+    text = "\n\n".join(_extract([PAGE]))
+    assert "comando pip  install  app en una terminal." in text
+    assert "def main():\n    return  1" in text
+
+
+def test_chunked_input_matches_whole_input():
+    whole = "\n\n".join(_extract([PAGE]))
+    # Cortes en medio de etiquetas, entidades y bloques pre
+    chunks = [PAGE[i:i + 7] for i in range(0, len(PAGE), 7)]
+    assert "\n\n".join(_extract(chunks)) == whole
+
+
+def test_pieces_end_on_paragraph_boundaries():
+    html = "".join(f"<p>Párrafo número {i} con algo de texto.</p>" for i in range(50))
+    chunks = [html[i:i + 64] for i in range(0, len(html), 64)]
+    pieces = _extract(chunks, max_piece_chars=200)
+    assert len(pieces) > 1
+    for piece in pieces:
+        assert piece.startswith("Párrafo número") and piece.endswith("con algo de texto.")
+    assert "\n\n".join(pieces).count("Párrafo número") == 50
@@ -0,0 +1,48 @@
+import pytest
+
+from app.services.local_replica_service import UnsupportedFilterError, compile_filter
+
+METADATA = {"genre": "drama", "year": 2019, "tags": ["a", "b"], "rating": 4.5, "draft": False}
+
+
+@pytest.mark.parametrize("expression, expected", [
+    # Igualdad implícita y explícita; un campo lista coincide si contiene el valor
+    ({"genre": "drama"}, True),
+    ({"genre": {"$eq": "comedy"}}, False),
+    ({"tags": "a"}, True),
+    ({"tags": {"$eq": "c"}}, False),
+    ({"genre": {"$ne": "comedy"}}, True),
+    ({"tags": {"$ne": "a"}}, False),
+    # $in / $nin, también contra campos lista
+    ({"genre": {"$in": ["drama", "comedy"]}}, True),
+    ({"tags": {"$in": ["b", "z"]}}, True),
+    ({"tags": {"$nin": ["b", "z"]}}, False),
+    ({"genre": {"$nin": ["comedy"]}}, True),
+    # Comparaciones solo sobre números (un booleano no es un número)
+    ({"year": {"$gte": 2019, "$lt": 2020}}, True),
+    ({"rating": {"$gt": 4.5}}, False),
+    ({"genre": {"$gt": 1}}, False),
+    ({"draft": {"$lt": 1}}, False),
+    # Un campo ausente no cumple ninguna comparación
+    ({"missing": {"$gt": 0}}, False),
+    ({"missing": {"$in": ["x"]}}, False),
+    ({"missing": {"$exists": False}}, True),
+    ({"year": {"$exists": True}}, True),
+    # Varias claves equivalen a $and; $and y $or se pueden anidar
+    ({"genre": "drama", "year": 2020}, False),
+    ({"$or": [{"year": 2020}, {"tags": "b"}]}, True),
+    ({"$and": [{"genre": "drama"}, {"$or": [{"year": {"$lt": 2000}}, {"rating": {"$gte": 4}}]}]}, True),
+    ({"$and": [{"genre": "drama"}, {"$or": [{"year": {"$lt": 2000}}, {"rating": {"$gte": 5}}]}]}, False),
+    ({}, True),
+])
+def test_filter_matches_pinecone_semantics(expression, expected):
+    assert compile_filter(expression)(METADATA) is expected
+
+
+@pytest.mark.parametrize("expression", [
+    {"$not": {"genre": "drama"}},
+    {"genre": {"$regex": "dr.*"}},
+])
+def test_unsupported_operators_fall_back_to_the_provider(expression):
+    with pytest.raises(UnsupportedFilterError):
+        compile_filter(expression)
@@ -0,0 +1,69 @@
+import json
+import os
+
+from app.services.metrics_service import MetricsRegistry
+
+# Mayor que cualquier pid_max de Linux: nunca es un proceso vivo
+DEAD_PID = 1 << 30
+
+
+def _registry(tmp_path):
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ["route"])
+    inflight = registry.gauge("inflight_requests", "Requests en curso")
+    latency = registry.histogram("latency_seconds", "Latencia", buckets=(0.1, 1.0))
+    registry.share(str(tmp_path), flush_seconds=3600)
+    return registry, requests, inflight, latency
+
+
+def _write_worker(tmp_path, pid, metrics):
+    with open(tmp_path / f"{pid}.json", "w") as f:
+        json.dump({"pid": pid, "metrics": metrics}, f)
+
+
+def test_single_process_render_is_unchanged():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests", ["route"]).inc(route="/a")
+    assert 'requests_total{route="/a"} 1' in registry.render()
+
+
+def test_counters_and_histograms_are_summed_across_workers(tmp_path):
+    registry, requests, inflight, latency = _registry(tmp_path)
+    requests.inc(2, route="/a")
+    inflight.set(4)
+    latency.observe(0.05)
+    _write_worker(tmp_path, os.getppid(), {
+        "requests_total": [[["/a"], 3], [["/b"], 1]],
+        "inflight_requests": [[[], 1]],
+        "latency_seconds": [[[], [[0, 1, 0], 0.5, 1]]],
+    })
+
+    output = registry.render()
+    assert 'requests_total{route="/a"} 5' in output
+    assert 'requests_total{route="/b"} 1' in output
+    assert 'latency_seconds_bucket{le="1"} 2' in output
+    assert "latency_seconds_count 2" in output
+    # Los gauges son de cada proceso
+    assert f'inflight_requests{{pid="{os.getpid()}"}} 4' in output
+    assert f'inflight_requests{{pid="{os.getppid()}"}} 1' in output
+
+
+def test_exited_workers_are_archived_and_never_go_backwards(tmp_path):
+    registry, requests, inflight, latency = _registry(tmp_path)
+    requests.inc(route="/a")
+    _write_worker(tmp_path, DEAD_PID, {"requests_total": [[["/a"], 10]], "inflight_requests": [[[], 7]]})
+
+    first = registry.render()
+    assert 'requests_total{route="/a"} 11' in first
+    assert f'pid="{DEAD_PID}"' not in first
+    assert not (tmp_path / f"{DEAD_PID}.json").exists()
+
+    requests.inc(route="/a")
+    assert 'requests_total{route="/a"} 12' in registry.render()
+
+
+def test_previous_process_with_the_same_pid_is_archived(tmp_path):
+    _write_worker(tmp_path, os.getpid(), {"requests_total": [[["/a"], 10]]})
+    registry, requests, inflight, latency = _registry(tmp_path)
+    requests.inc(route="/a")
+    assert 'requests_total{route="/a"} 11' in registry.render()
@@ -0,0 +1,15 @@
+import pytest
+from pydantic import ValidationError
+
+from app.models.models import DeduplicationConfig
+
+
+@pytest.mark.parametrize("config", [{"threshold": 1.5}, {"threshold": -0.1}, {"mode": "copy"}])
+def test_invalid_deduplication_config_is_rejected(config):
+    with pytest.raises(ValidationError):
+        DeduplicationConfig(**config)
+
+
+def test_deduplication_config_defaults():
+    config = DeduplicationConfig()
+    assert (config.threshold, config.mode) == (0.9, "reuse")
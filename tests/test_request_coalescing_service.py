@@ -0,0 +1,128 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services.request_coalescing_service import MicroBatcher, SingleFlight
+from app.services.resilience_service import DeadlineExceededError, deadline_scope, remaining_time
+
+TIMEOUT = 5
+
+
+def _in_thread(pool: ThreadPoolExecutor, fn, *args):
+    started = threading.Event()
+
+    def run():
+        started.set()
+        return fn(*args)
+
+    future = pool.submit(run)
+    assert started.wait(TIMEOUT)
+    return future
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def leader_call():
+        calls.append(1)
+        release.wait(TIMEOUT)
+        return "result"
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = _in_thread(pool, flight.do, "key", leader_call)
+        followers = [pool.submit(flight.do, "key", lambda: "other") for _ in range(3)]
+        threading.Event().wait(0.2)
+        release.set()
+        assert leader.result(TIMEOUT) == "result"
+        assert [follower.result(TIMEOUT) for follower in followers] == ["result"] * 3
+    assert len(calls) == 1
+    # Terminada la llamada, la siguiente vuelve al proveedor
+    assert flight.do("key", lambda: "fresh") == "fresh"
+
+
+def test_single_flight_shares_the_error():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def failing_call():
+        release.wait(TIMEOUT)
+        raise ValueError("upstream")
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = _in_thread(pool, flight.do, "key", failing_call)
+        follower = pool.submit(flight.do, "key", lambda: "other")
+        threading.Event().wait(0.2)
+        release.set()
+        with pytest.raises(ValueError):
+            leader.result(TIMEOUT)
+        with pytest.raises(ValueError):
+            follower.result(TIMEOUT)
+
+
+def test_single_flight_follower_respects_its_deadline():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def follow():
+        with deadline_scope(0.05):
+            return flight.do("key", lambda: "other")
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = _in_thread(pool, flight.do, "key", lambda: release.wait(TIMEOUT))
+        with pytest.raises(DeadlineExceededError):
+            pool.submit(follow).result(TIMEOUT)
+        release.set()
+        assert leader.result(TIMEOUT) is True
+
+
+def test_micro_batcher_aligns_results_by_position():
+    batches = []
+
+    def batch_fn(key, items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher("test", batch_fn, window_seconds=1, max_batch_size=5)
+    # Un request en curso de la misma clave hace que el líder espere la ventana (o a que se llene el lote)
+    batcher._inflight["key"] = 1
+    with ThreadPoolExecutor(3) as pool:
+        futures = [pool.submit(batcher.submit, "key", items) for items in ([1, 2], [3], [4, 5])]
+        results = [future.result(TIMEOUT) for future in futures]
+    assert results == [[10, 20], [30], [40, 50]]
+    assert len(batches) == 1 and sorted(batches[0]) == [1, 2, 3, 4, 5]
+
+
+def test_micro_batcher_shares_the_error():
+    def batch_fn(key, items):
+        raise RuntimeError("embedding caído")
+
+    batcher = MicroBatcher("test", batch_fn, window_seconds=1, max_batch_size=2)
+    batcher._inflight["key"] = 1
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(batcher.submit, "key", [item]) for item in ("a", "b")]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(TIMEOUT)
+
+
+def test_micro_batcher_runs_with_the_strictest_live_deadline():
+    seen = []
+
+    def batch_fn(key, items):
+        seen.append(remaining_time())
+        return items
+
+    batcher = MicroBatcher("test", batch_fn, window_seconds=1, max_batch_size=2)
+    batcher._inflight["key"] = 1
+
+    def submit(item, seconds):
+        with deadline_scope(seconds):
+            return batcher.submit("key", [item])
+
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(submit, "a", 30), pool.submit(submit, "b", 2)]
+        assert [future.result(TIMEOUT) for future in futures] == [["a"], ["b"]]
+    assert seen[0] is not None and seen[0] <= 2
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from app.services import resilience_service
+from app.services.resilience_service import CircuitBreaker, CircuitOpenError, ResilienceService
+
+RESET_SECONDS = 0.05
+
+
+class StatusError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def _open(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", "target", failure_threshold=3, reset_seconds=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    # Un éxito reinicia la cuenta: los fallos tienen que ser seguidos
+    breaker.before_call()
+    breaker.record_success()
+    _open(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert 1 <= error.value.retry_after <= 60
+
+
+def test_half_open_lets_a_single_probe_through():
+    breaker = CircuitBreaker("test", "target", failure_threshold=1, reset_seconds=RESET_SECONDS)
+    _open(breaker)
+    time.sleep(RESET_SECONDS * 2)
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker("test", "target", failure_threshold=5, reset_seconds=RESET_SECONDS)
+    _open(breaker)
+    time.sleep(RESET_SECONDS * 2)
+
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_released_probe_frees_the_slot():
+    breaker = CircuitBreaker("test", "target", failure_threshold=1, reset_seconds=RESET_SECONDS)
+    _open(breaker)
+    time.sleep(RESET_SECONDS * 2)
+
+    breaker.before_call()
+    # El deadline del request cortó la prueba: no dice nada del destino y otra llamada puede probar
+    breaker.release()
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(resilience_service, "backoff_delay", lambda attempt, error=None: 0)
+    breaker = CircuitBreaker("test", "call", failure_threshold=2, reset_seconds=60)
+    monkeypatch.setitem(ResilienceService._breakers, ("test", "call"), breaker)
+    return breaker
+
+
+def _failing(status: int):
+    def fn(timeout):
+        raise StatusError(status)
+    return fn
+
+
+def test_call_opens_the_circuit_on_server_errors(breaker):
+    with pytest.raises(StatusError):
+        ResilienceService.call("test", "call", "query", _failing(503), 1, max_attempts=2)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        ResilienceService.call("test", "call", "query", lambda timeout: calls.append(timeout), 1)
+    assert calls == []
+
+
+@pytest.mark.parametrize("status", [400, 429])
+def test_client_errors_and_rate_limits_keep_it_closed(breaker, status):
+    for _ in range(3):
+        with pytest.raises(StatusError):
+            ResilienceService.call("test", "call", "query", _failing(status), 1, max_attempts=2)
+    assert breaker.state == CircuitBreaker.CLOSED
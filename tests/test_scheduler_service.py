@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.middlewares.exception_handler_middleware import overloaded_error_handler
+from app.services.scheduler_service import (
+    PRIORITY_BULK, PRIORITY_INTERACTIVE, AdmissionController, OverloadedError, current_priority
+)
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    # Globales de 3, 2 por namespace y Retry-After de 7 s para ambas clases
+    monkeypatch.setitem(AdmissionController._limits, PRIORITY_INTERACTIVE, (3, 2, 7))
+    monkeypatch.setitem(AdmissionController._limits, PRIORITY_BULK, (3, 2, 7))
+
+
+def test_rejects_over_the_namespace_limit(limits):
+    with AdmissionController.admit(PRIORITY_BULK, "index/a"), AdmissionController.admit(PRIORITY_BULK, "index/a"):
+        with pytest.raises(OverloadedError) as error:
+            with AdmissionController.admit(PRIORITY_BULK, "index/a"):
+                pass
+        assert error.value.retry_after == 7
+        # Otro namespace todavía tiene cupo
+        with AdmissionController.admit(PRIORITY_BULK, "index/b"):
+            pass
+
+
+def test_rejects_over_the_global_limit(limits):
+    with AdmissionController.admit(PRIORITY_INTERACTIVE, "index/a"), \
+            AdmissionController.admit(PRIORITY_INTERACTIVE, "index/b"), \
+            AdmissionController.admit(PRIORITY_INTERACTIVE, "index/c"):
+        with pytest.raises(OverloadedError):
+            with AdmissionController.admit(PRIORITY_INTERACTIVE, "index/d"):
+                pass
+        # Los límites de cada clase son independientes
+        with AdmissionController.admit(PRIORITY_BULK, "index/d"):
+            pass
+
+
+def test_slots_are_released_on_error(limits):
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            with AdmissionController.admit(PRIORITY_BULK, "index/a"):
+                raise RuntimeError("falla la ingesta")
+    assert AdmissionController._inflight[PRIORITY_BULK] == 0
+    assert (PRIORITY_BULK, "index/a") not in AdmissionController._inflight_by_tenant
+
+
+def test_admitted_work_runs_with_its_priority(limits):
+    assert current_priority() == PRIORITY_INTERACTIVE
+    with AdmissionController.admit(PRIORITY_BULK, "index/a"):
+        assert current_priority() == PRIORITY_BULK
+    assert current_priority() == PRIORITY_INTERACTIVE
+
+
+def test_overloaded_error_is_a_429_with_retry_after():
+    response = asyncio.run(overloaded_error_handler(None, OverloadedError("ocupado", 30)))
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from app.services.snapshot_service import (
+    ImportCheckpoint, SnapshotFormatError, SnapshotReader, SnapshotWriter, snapshot_path
+)
+
+DIMENSION = 4
+
+
+def _write(path, pages):
+    writer = SnapshotWriter(path, DIMENSION, {"index": "docs", "namespace": "ns", "metric": "cosine"})
+    for ids, vectors, metadatas in pages:
+        writer.write_page(ids, vectors, metadatas)
+    return writer.close()
+
+
+def _pages():
+    generator = np.random.default_rng(0)
+    return [
+        (["a", "b", "ñandú"], generator.random((3, DIMENSION)), [{"text": "uno"}, {}, {"tags": ["x", "y"]}]),
+        (["c"], generator.random((1, DIMENSION)), [{"text": "dos", "n": 2}]),
+    ]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "docs.vdbsnap")
+    pages = _pages()
+    summary = _write(path, pages)
+    assert summary["pages"] == 2 and summary["vectors"] == 4
+
+    reader = SnapshotReader(path)
+    try:
+        assert reader.dimension == DIMENSION and reader.vectors == 4
+        assert reader.header["index"] == "docs"
+        # Las páginas se leen sueltas y en cualquier orden
+        for number in (1, 0):
+            ids, vectors, metadatas = reader.read_page(number)
+            expected_ids, expected_vectors, expected_metadatas = pages[number]
+            assert ids == expected_ids
+            assert metadatas == expected_metadatas
+            np.testing.assert_array_equal(vectors, np.asarray(expected_vectors, dtype=np.float32))
+    finally:
+        reader.close()
+
+
+def test_partial_and_corrupt_files_are_rejected(tmp_path):
+    path = str(tmp_path / "docs.vdbsnap")
+    _write(path, _pages())
+    reader = SnapshotReader(path)
+    offset = reader.pages[0]["offset"] + 40
+    reader.close()
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    # Un byte cambiado dentro de la primera página
+    data[offset] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(data)
+
+    reader = SnapshotReader(path)
+    try:
+        with pytest.raises(SnapshotFormatError):
+            reader.read_page(0)
+        assert reader.read_page(1)[0] == ["c"]
+    finally:
+        reader.close()
+
+    truncated = str(tmp_path / "truncated.vdbsnap")
+    with open(truncated, "wb") as f:
+        f.write(bytes(data[:-8]))
+    with pytest.raises(SnapshotFormatError):
+        SnapshotReader(truncated)
+
+
+def test_checkpoint_resumes_the_same_snapshot(tmp_path):
+    path = str(tmp_path / "docs.vdbsnap")
+    _write(path, _pages())
+    reader = SnapshotReader(path)
+    fingerprint = reader.fingerprint
+    reader.close()
+
+    checkpoint = ImportCheckpoint(path, "docs", "ns", fingerprint)
+    assert checkpoint.done == set()
+    checkpoint.mark(0)
+
+    assert ImportCheckpoint(path, "docs", "ns", fingerprint).done == {0}
+    # Otro destino tiene su propio checkpoint
+    assert ImportCheckpoint(path, "docs", "other", fingerprint).done == set()
+
+    checkpoint.clear()
+    assert ImportCheckpoint(path, "docs", "ns", fingerprint).done == set()
+
+
+def test_checkpoint_is_discarded_when_the_snapshot_changes(tmp_path):
+    path = str(tmp_path / "docs.vdbsnap")
+    _write(path, _pages())
+    reader = SnapshotReader(path)
+    ImportCheckpoint(path, "docs", "ns", reader.fingerprint).mark(0)
+    reader.close()
+
+    # Reexportado con el mismo nombre: las páginas ya importadas no valen para el contenido nuevo
+    _write(path, _pages()[1:])
+    reader = SnapshotReader(path)
+    try:
+        assert ImportCheckpoint(path, "docs", "ns", reader.fingerprint).done == set()
+    finally:
+        reader.close()
+
+
+@pytest.mark.parametrize("name", ["../etc/passwd", "a/b", "", ".hidden"])
+def test_snapshot_names_cannot_leave_the_directory(name):
+    with pytest.raises(ValueError):
+        snapshot_path(name)